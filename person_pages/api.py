@@ -0,0 +1,307 @@
+"""
+A read-only JSON API for the Person Pages application.
+
+* ``api/pages/``: the active pages.
+* ``api/pages/<slug>/``: one page.
+* ``api/pages/<slug>/sections/``: the active sections of a page.
+* ``api/pages/<slug>/files/``: the public files of a page.
+
+The ``fields`` query parameter selects the fields returned (a comma
+separated list; by default all).  Lists are keyset paginated (see
+``pagination``): ``limit`` rows after the ``after`` cursor, with the url
+of the ``next`` page.  Lists are streamed from a queryset
+``iterator()``, so memory use does not depend on the number of rows.
+"""
+
+#######################################################################
+from __future__ import print_function, unicode_literals
+
+import json
+from collections import OrderedDict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views.decorators.http import require_safe
+
+from . import conf
+from .models import PageFile, PageSection, PersonPage
+from .pagination import InvalidCursor, KeysetPaginator, encode_cursor
+
+#######################################################################
+
+
+class InvalidRequest(ValueError):
+    """
+    The query parameters are not valid.
+    """
+
+
+def _pageinfo_value(func):
+    def value(page):
+        try:
+            pageinfo = page.pageinfo
+        except PersonPage.pageinfo.RelatedObjectDoesNotExist:
+            return None
+        return func(pageinfo)
+
+    return value
+
+
+class Serializer(object):
+    """
+    Serializes objects to dictionaries of the selected fields.
+
+    ``fields`` maps each field name to ``(columns, value)``: the columns
+    needed for the field (for ``only()``; related columns are also
+    selected) and a function returning the value for an object.
+    ``ordering`` is the (total) list ordering.
+    """
+
+    fields = OrderedDict()
+    ordering = ["pk"]
+
+    def __init__(self, names=None):
+        if not names:
+            names = list(self.fields)
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise InvalidRequest("Unknown fields: {}".format(", ".join(unknown)))
+        self.names = names
+
+    def columns(self):
+        result = ["pk"]
+        for name in self.names:
+            result.extend(self.fields[name][0])
+        for name in self.ordering:
+            result.append(name.lstrip("-"))
+        return list(OrderedDict.fromkeys(result))
+
+    def prepare(self, queryset):
+        """
+        Limit ``queryset`` to the columns needed for the selected fields.
+        """
+        columns = self.columns()
+        related = set(c.rsplit("__", 1)[0] for c in columns if "__" in c)
+        if related:
+            queryset = queryset.select_related(*sorted(related))
+        return queryset.only(*columns)
+
+    def serialize(self, obj):
+        return OrderedDict((name, self.fields[name][1](obj)) for name in self.names)
+
+
+class PageSerializer(Serializer):
+    fields = OrderedDict(
+        [
+            ("slug", (["person", "person__slug"], lambda p: p.person.slug)),
+            ("name", (["person", "person__cn"], lambda p: p.person.cn)),
+            (
+                "url",
+                (
+                    ["person", "person__slug"],
+                    lambda p: reverse(
+                        "person-page-detail", kwargs={"slug": p.person.slug}
+                    ),
+                ),
+            ),
+            ("modified", (["modified"], lambda p: p.modified)),
+            (
+                "introduction",
+                (
+                    [
+                        "pageinfo__introduction",
+                        "pageinfo__introduction_html",
+                        "pageinfo__introduction_hash",
+                    ],
+                    _pageinfo_value(lambda info: info.get_rendered("introduction")),
+                ),
+            ),
+            (
+                "photo",
+                (
+                    ["pageinfo__photo"],
+                    _pageinfo_value(
+                        lambda info: info.photo.url if info.photo else None
+                    ),
+                ),
+            ),
+        ]
+    )
+    ordering = conf.get("list_ordering")
+
+    def columns(self):
+        # the ordering traverses the person.
+        return super(PageSerializer, self).columns() + ["person"]
+
+
+class SectionSerializer(Serializer):
+    fields = OrderedDict(
+        [
+            ("id", ([], lambda s: s.pk)),
+            ("title", (["title"], lambda s: s.title)),
+            ("ordering", (["ordering"], lambda s: s.ordering)),
+            (
+                "content",
+                (
+                    ["content", "content_html", "content_hash"],
+                    lambda s: s.get_rendered("content"),
+                ),
+            ),
+            ("modified", (["modified"], lambda s: s.modified)),
+        ]
+    )
+    ordering = ["ordering", "pk"]
+
+
+class FileSerializer(Serializer):
+    fields = OrderedDict(
+        [
+            ("slug", (["slug"], lambda f: f.slug)),
+            ("description", (["description"], lambda f: f.description)),
+            (
+                "url",
+                (
+                    ["slug", "the_file", "page", "page__person", "page__person__slug"],
+                    lambda f: f.get_absolute_url(),
+                ),
+            ),
+        ]
+    )
+    ordering = ["slug", "pk"]
+
+
+#######################################################################
+
+
+def _dumps(value):
+    return json.dumps(value, cls=DjangoJSONEncoder, separators=(",", ":"))
+
+
+def get_serializer(request, serializer_class):
+    names = [n.strip() for n in request.GET.get("fields", "").split(",") if n.strip()]
+    return serializer_class(names)
+
+
+def get_limit(request):
+    """
+    The number of rows requested (``limit``), within ``api_max_page_size``.
+    """
+    value = request.GET.get("limit")
+    if value is None:
+        return conf.get("api_page_size")
+    try:
+        limit = int(value)
+    except ValueError:
+        raise InvalidRequest("Invalid limit: {}".format(value))
+    if not 1 <= limit <= conf.get("api_max_page_size"):
+        raise InvalidRequest(
+            "The limit must be between 1 and {}".format(conf.get("api_max_page_size"))
+        )
+    return limit
+
+
+def next_url(request, cursor):
+    params = request.GET.copy()
+    params["after"] = cursor
+    return request.build_absolute_uri("?" + params.urlencode())
+
+
+def iter_list(request, paginator, serializer, queryset, limit):
+    """
+    Yield the JSON list of up to ``limit`` rows of ``queryset``, in
+    pieces, followed by the url of the next page (if any).
+    """
+    yield '{"results":['
+    last = None
+    cursor = None
+    chunk_size = conf.get("api_chunk_size")
+    for i, obj in enumerate(queryset[: limit + 1].iterator(chunk_size=chunk_size)):
+        if i == limit:
+            cursor = encode_cursor(paginator.get_values(last))
+            break
+        yield ("," if i else "") + _dumps(serializer.serialize(obj))
+        last = obj
+    yield '],"next":{}}}'.format(
+        _dumps(next_url(request, cursor) if cursor is not None else None)
+    )
+
+
+def list_response(request, queryset, serializer_class):
+    """
+    Stream one page of ``queryset``, as selected by the query parameters.
+    """
+    try:
+        serializer = get_serializer(request, serializer_class)
+        limit = get_limit(request)
+        paginator = KeysetPaginator(
+            serializer.prepare(queryset), serializer.ordering, limit
+        )
+        qs = paginator.get_queryset(request.GET.get("after") or None)
+    except InvalidCursor:
+        return error_response("Invalid cursor")
+    except InvalidRequest as e:
+        return error_response("{}".format(e))
+    return StreamingHttpResponse(
+        iter_list(request, paginator, serializer, qs, limit),
+        content_type="application/json",
+    )
+
+
+def error_response(message, status=400):
+    return JsonResponse({"error": message}, status=status)
+
+
+def get_page_id(slug):
+    page = get_object_or_404(PersonPage.objects.active().only("pk"), person__slug=slug)
+    return page.pk
+
+
+#######################################################################
+
+
+@require_safe
+def page_list(request):
+    """
+    The active pages.
+    """
+    return list_response(request, PersonPage.objects.active(), PageSerializer)
+
+
+@require_safe
+def page_detail(request, slug):
+    """
+    One active page.
+    """
+    try:
+        serializer = get_serializer(request, PageSerializer)
+    except InvalidRequest as e:
+        return error_response("{}".format(e))
+    qs = serializer.prepare(PersonPage.objects.active())
+    try:
+        page = qs.get(person__slug=slug)
+    except PersonPage.DoesNotExist:
+        raise Http404("No such page")
+    return JsonResponse(serializer.serialize(page))
+
+
+@require_safe
+def section_list(request, slug):
+    """
+    The active sections of one active page.
+    """
+    qs = PageSection.objects.active().filter(page_id=get_page_id(slug))
+    return list_response(request, qs, SectionSerializer)
+
+
+@require_safe
+def file_list(request, slug):
+    """
+    The public files of one active page.
+    """
+    qs = PageFile.objects.public().filter(page_id=get_page_id(slug))
+    return list_response(request, qs, FileSerializer)
+
+
+#######################################################################
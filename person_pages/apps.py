@@ -10,6 +10,100 @@ class PersonPagesConfig(AppConfig):
     name = "person_pages"
     verbose_name = _("Personal Pages")
 
+    def ready(self):
+        """
+        Register the signals which are always required.
+        """
+        from django.apps import apps
+        from django.core.signals import request_finished, request_started
+        from django.db.models.signals import (
+            m2m_changed,
+            post_delete,
+            post_init,
+            post_save,
+            pre_delete,
+            pre_save,
+        )
+        from people.models import Person
+        from .handlers import (
+            enqueue_page_for_indexing,
+            enqueue_page_for_indexing_m2m,
+            invalidate_calendar_cache,
+            invalidate_calendar_cache_m2m,
+            invalidate_old_calendar_slug,
+            invalidate_old_page_slug,
+            invalidate_page_cache,
+            invalidate_page_cache_m2m,
+            invalidate_rendered_file_links,
+            release_deleted_files,
+            release_replaced_files,
+            remember_file_names,
+            touch_page,
+            update_search_document,
+            update_search_document_m2m,
+        )
+        from .models import PageFile, PageInfo, PageSection, PersonPage
+        from .templatetags.person_pages_tags import (
+            begin_request_file_urls,
+            clear_request_file_urls,
+            end_request_file_urls,
+        )
+
+        # Pre-rendered page text depends on PageFile urls.
+        post_save.connect(invalidate_rendered_file_links, sender=PageFile)
+        post_delete.connect(invalidate_rendered_file_links, sender=PageFile)
+
+        # personalfile_url lookups are memoized for each request.
+        request_started.connect(begin_request_file_urls)
+        request_finished.connect(end_request_file_urls)
+        post_save.connect(clear_request_file_urls, sender=PageFile)
+        post_delete.connect(clear_request_file_urls, sender=PageFile)
+
+        # Cached page responses.
+        for model in [Person, PersonPage, PageInfo, PageSection, PageFile]:
+            post_save.connect(invalidate_page_cache, sender=model)
+            post_delete.connect(invalidate_page_cache, sender=model)
+        pre_save.connect(invalidate_old_page_slug, sender=Person)
+        m2m_changed.connect(invalidate_page_cache_m2m, sender=Person.flags.through)
+
+        # Page content changes update the page (for search indexing and
+        # the page validators).
+        for model in [PageInfo, PageSection, PageFile]:
+            post_save.connect(touch_page, sender=model)
+            post_delete.connect(touch_page, sender=model)
+
+        # Incremental search indexing.
+        for model in [Person, PersonPage, PageInfo, PageSection]:
+            post_save.connect(enqueue_page_for_indexing, sender=model)
+            post_delete.connect(enqueue_page_for_indexing, sender=model)
+        m2m_changed.connect(enqueue_page_for_indexing_m2m, sender=Person.flags.through)
+
+        # Built-in full text search.
+        for model in [Person, PersonPage, PageInfo, PageSection]:
+            post_save.connect(update_search_document, sender=model)
+            post_delete.connect(update_search_document, sender=model)
+        m2m_changed.connect(update_search_document_m2m, sender=Person.flags.through)
+
+        # Unused content addressed uploads are deleted.
+        for model in [PageInfo, PageFile]:
+            post_init.connect(remember_file_names, sender=model)
+            post_save.connect(release_replaced_files, sender=model)
+            post_delete.connect(release_deleted_files, sender=model)
+
+        # Cached calendar feeds.
+        calendar_models = []
+        if apps.is_installed("webcal"):
+            calendar_models = list(apps.get_app_config("webcal").get_models())
+        for model in [Person, PersonPage] + calendar_models:
+            post_save.connect(invalidate_calendar_cache, sender=model)
+            pre_delete.connect(invalidate_calendar_cache, sender=model)
+        pre_save.connect(invalidate_old_calendar_slug, sender=Person)
+        for model in calendar_models:
+            for field in model._meta.local_many_to_many:
+                m2m_changed.connect(
+                    invalidate_calendar_cache_m2m, sender=field.remote_field.through
+                )
+
 
 #########################################################################
 
@@ -20,6 +114,7 @@ class PersonPagesConfigAutoCreateWithSlug(PersonPagesConfig):
         Any app specific startup code, e.g., register signals,
         should go here.
         """
+        super(PersonPagesConfigAutoCreateWithSlug, self).ready()
         from django.db.models.signals import post_save
         from people.models import Person
         from .handlers import create_personal_page
@@ -37,10 +132,16 @@ class PersonPagesConfigAutoCreateWithDirectoryFlag(PersonPagesConfig):
         Any app specific startup code, e.g., register signals,
         should go here.
         """
-        from django.db.models.signals import m2m_changed
+        super(PersonPagesConfigAutoCreateWithDirectoryFlag, self).ready()
+        from django.db.models.signals import m2m_changed, pre_save
         from people.models import Person
-        from .handlers import create_personal_page_if_directory_flag_loaddata_safe
+        from .handlers import (
+            create_personal_page_if_directory_flag_loaddata_safe,
+            mark_raw_save,
+        )
 
+        # Flag changes of people loaded from fixtures are ignored.
+        pre_save.connect(mark_raw_save, sender=Person)
         # Automatically create personal pages (when a person has a slug AND the directory flag)
         m2m_changed.connect(
             create_personal_page_if_directory_flag_loaddata_safe,
@@ -0,0 +1,178 @@
+"""
+Microbenchmarks for the Person Pages application.
+
+Run with:
+    ./manage.py person_pages_benchmark [name ...]
+"""
+#######################################################################
+from __future__ import print_function, unicode_literals
+
+import timeit
+from collections import OrderedDict
+
+#######################################################################
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(func):
+    """
+    Register a benchmark function.  Benchmark functions take a ``repeat``
+    argument and return a list of ``(label, seconds)`` pairs,
+    where seconds is the time for a single operation.
+    """
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def best_of(func, number, repeat=3):
+    """
+    Return the best per-call time of ``func`` in seconds.
+    """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+#######################################################################
+
+SAMPLE_SECTIONS = [
+    """Office hours
+============
+
+Monday and Wednesday, 10:30 - 11:30, or by appointment.
+""",
+    """* STAT 1000: Basic Statistical Analysis
+* STAT 2000: Statistical Analysis II
+
+Course materials are available from the course pages.
+""",
+    """{% if 1 %}Current graduate students{% endif %}
+--------------------------
+
+* {{ "Jane Doe" }} (PhD)
+* {{ "John Smith" }} (MSc)
+""",
+]
+
+
+@benchmark
+def prerender(repeat=1000):
+    """
+    Per-section cost of the prerender filter: compiling a new template
+    every call (the previous behaviour) versus the cached/fast path.
+    """
+    from django.template import Context, Template
+
+    from . import rendering
+
+    def uncached():
+        for text in SAMPLE_SECTIONS:
+            Template(rendering.TEMPLATE_PREAMBLE + text).render(Context({}))
+
+    def cached():
+        for text in SAMPLE_SECTIONS:
+            rendering.prerender(text)
+
+    n = len(SAMPLE_SECTIONS)
+    cached()  # warm the template cache
+    return [
+        ("prerender, no cache (per section)", best_of(uncached, repeat) / n),
+        ("prerender, cached (per section)", best_of(cached, repeat) / n),
+    ]
+
+
+#######################################################################
+
+
+@benchmark
+def index_documents(repeat=1, limit=200):
+    """
+    Search document preparation (``full_prepare``) per page, for (up to)
+    ``limit`` active pages: one page at a time without prefetching (the
+    previous behaviour) versus the prefetching index queryset.
+    Requires haystack, and pages in the database.
+    """
+    from haystack import connections
+
+    from .models import PersonPage
+
+    index = connections["default"].get_unified_index().get_index(PersonPage)
+    pk_list = list(
+        PersonPage.objects.active().order_by("pk").values_list("pk", flat=True)[:limit]
+    )
+    if not pk_list:
+        return []
+
+    def plain():
+        for page in PersonPage.objects.filter(pk__in=pk_list):
+            index.full_prepare(page)
+
+    def prefetched():
+        for page in index.index_queryset().filter(pk__in=pk_list):
+            index.full_prepare(page)
+
+    n = len(pk_list)
+    return [
+        ("index document, no prefetch (per document)", best_of(plain, repeat) / n),
+        ("index document, prefetched (per document)", best_of(prefetched, repeat) / n),
+    ]
+
+
+#######################################################################
+
+
+@benchmark
+def flag_changes(repeat=1, count=10000):
+    """
+    Overhead of the loaddata guard on ``count`` Person flag changes
+    (``m2m_changed`` signals): walking the stack with ``inspect.stack()``
+    (the previous behaviour) versus the context variable and raw save
+    checks of ``disable_for_loaddata``.
+    The handler itself does nothing, so only the guard is measured.
+    """
+    import inspect
+
+    from .handlers import disable_for_loaddata
+
+    def handler(sender, instance, action, reverse, model, **kwargs):
+        pass
+
+    def stack_walk(*args, **kwargs):
+        for fr in inspect.stack():
+            if inspect.getmodulename(fr[1]) == "loaddata":
+                return
+        handler(*args, **kwargs)
+
+    guarded = disable_for_loaddata(handler)
+
+    class Instance(object):
+        pass
+
+    instance = Instance()
+
+    def changes(receiver):
+        def run():
+            for i in range(count):
+                receiver(
+                    sender=None,
+                    instance=instance,
+                    action="post_add",
+                    reverse=False,
+                    model=None,
+                    pk_set={i},
+                )
+
+        return run
+
+    return [
+        (
+            "{} flag changes, inspect.stack()".format(count),
+            best_of(changes(stack_walk), repeat),
+        ),
+        (
+            "{} flag changes, suppress_autocreate".format(count),
+            best_of(changes(guarded), repeat),
+        ),
+    ]
+
+
+#######################################################################
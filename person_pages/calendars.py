@@ -0,0 +1,236 @@
+"""
+Cached personal calendar feeds.
+
+Calendar clients poll the feed of every subscribed person every few
+minutes, so the generated iCalendar bytes are kept in a django cache,
+per person slug, with an ``ETag`` and ``Last-Modified`` time; repeated
+polls are answered from the cache (or with 304 Not Modified) without
+generating the feed or querying the database.
+
+Cached feeds are dropped by signal handlers when the events of the
+person change (see ``handlers.invalidate_calendar_cache``).  A change
+which cannot be traced to particular people drops all the feeds.
+
+With the ``calendar_past_days`` setting, events which ended more than
+that many days ago are left out of the feed.
+"""
+#######################################################################
+from __future__ import print_function, unicode_literals
+
+import datetime
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.http import http_date, quote_etag
+
+from . import conf
+
+#######################################################################
+
+KEY_PREFIX = "person_pages:calendar:"
+
+# headers which are recomputed for cached feeds.
+SKIPPED_HEADERS = ("content-length", "etag", "last-modified")
+
+#######################################################################
+
+
+def is_enabled():
+    """
+    Is calendar caching turned on?
+    """
+    return conf.get("calendar_cache_enabled")
+
+
+def get_cache():
+    """
+    The django cache used for calendar feeds.
+    """
+    return caches[conf.get("calendar_cache_backend")]
+
+
+def get_generation():
+    """
+    The current generation of all cached feeds (see ``invalidate()``).
+    """
+    cache = get_cache()
+    key = KEY_PREFIX + "generation"
+    generation = cache.get(key)
+    if generation is None:
+        # start from the clock, so a lost generation never collides with
+        # feeds cached under an earlier one.
+        cache.add(key, int(time.time() * 1000), None)
+        generation = cache.get(key, 0)
+    return generation
+
+
+def get_since():
+    """
+    The date of the oldest events in the feeds; None for all events.
+    """
+    days = conf.get("calendar_past_days")
+    if days is None:
+        return None
+    return datetime.date.today() - datetime.timedelta(days=days)
+
+
+def feed_key(slug):
+    """
+    The cache key for the feed of the person ``slug``.
+    """
+    since = get_since()
+    return "{}feed:{}:{}:{}".format(
+        KEY_PREFIX, get_generation(), since.isoformat() if since else "all", slug
+    )
+
+
+def invalidate(slug=None):
+    """
+    Drop the cached feed of the person ``slug``; or all the cached feeds.
+    """
+    if slug is None:
+        cache = get_cache()
+        try:
+            cache.incr(KEY_PREFIX + "generation")
+        except ValueError:
+            get_generation()
+    else:
+        get_cache().delete(feed_key(slug))
+
+
+#######################################################################
+
+
+def _event_end(lines):
+    """
+    The (last) date of the event with the content ``lines``; None when
+    it cannot be told (e.g., a recurring event).
+    """
+    values = {}
+    for line in lines:
+        name = line.split(":", 1)[0].split(";", 1)[0].upper()
+        if name in ("DTSTART", "DTEND", "RRULE", "RDATE"):
+            values[name] = line.rsplit(":", 1)[-1].strip()
+    if "RRULE" in values or "RDATE" in values:
+        return None
+    value = values.get("DTEND", values.get("DTSTART"))
+    try:
+        return datetime.datetime.strptime(value[:8], "%Y%m%d").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def filter_past_events(data, since):
+    """
+    Return the iCalendar ``data`` (bytes) without the events which ended
+    before the date ``since``.
+    """
+    result = []
+    event = None
+    for line in data.decode("utf-8").splitlines(True):
+        tag = line.strip().upper()
+        if tag == "BEGIN:VEVENT":
+            event = [line]
+        elif event is None:
+            result.append(line)
+        else:
+            event.append(line)
+            if tag == "END:VEVENT":
+                end = _event_end(event)
+                if end is None or end >= since:
+                    result.extend(event)
+                event = None
+    if event is not None:
+        result.extend(event)
+    return "".join(result).encode("utf-8")
+
+
+#######################################################################
+
+
+def get_cached_feed(slug):
+    """
+    Return the cached feed of the person ``slug``, or None.
+    """
+    if not is_enabled():
+        return None
+    return get_cache().get(feed_key(slug))
+
+
+def store_feed(slug, response):
+    """
+    Return the feed (a dictionary) for the generated ``response``,
+    keeping it in the cache.
+    """
+    content = response.content
+    since = get_since()
+    if since is not None:
+        content = filter_past_events(content, since)
+    feed = {
+        "content": content,
+        "headers": [
+            (name, value)
+            for name, value in response.items()
+            if name.lower() not in SKIPPED_HEADERS
+        ],
+        "etag": quote_etag(hashlib.md5(content).hexdigest()),
+        "last_modified": int(time.time()),
+    }
+    if is_enabled():
+        get_cache().set(feed_key(slug), feed, conf.get("calendar_cache_timeout"))
+    return feed
+
+
+def feed_response(feed):
+    """
+    The response for a feed (from ``store_feed()``).
+    """
+    response = HttpResponse(feed["content"])
+    for name, value in feed["headers"]:
+        response[name] = value
+    response["ETag"] = feed["etag"]
+    response["Last-Modified"] = http_date(feed["last_modified"])
+    return response
+
+
+#######################################################################
+
+
+def related_person_ids(instance):
+    """
+    Return the ids of the people related to ``instance`` (a calendar
+    model object): by a foreign key, many to many field or generic
+    foreign key to ``Person``.  Returns None when ``instance`` has no
+    such relation (so the people cannot be told).
+    """
+    from django.contrib.contenttypes.fields import GenericForeignKey
+    from people.models import Person
+
+    if isinstance(instance, Person):
+        return [instance.pk]
+    found = False
+    id_list = []
+    for field in instance._meta.get_fields():
+        if isinstance(field, GenericForeignKey):
+            content_type = getattr(instance, field.ct_field, None)
+            if content_type is not None and content_type.model_class() is Person:
+                found = True
+                id_list.append(getattr(instance, field.fk_field))
+        elif not field.is_relation or field.related_model is not Person:
+            continue
+        elif field.concrete and (field.many_to_one or field.one_to_one):
+            found = True
+            id_list.append(getattr(instance, field.attname))
+        elif field.many_to_many:
+            found = True
+            if instance.pk is not None:
+                name = field.get_accessor_name() if field.auto_created else field.name
+                id_list.extend(getattr(instance, name).values_list("pk", flat=True))
+    if not found:
+        return None
+    return [pk for pk in id_list if pk is not None]
+
+
+#######################################################################
@@ -12,11 +12,130 @@ DEFAULT = {
     # where personal files are loaded -- note that these are not
     # broken out for individuals.
     "upload_path": "personal/%Y/%m/%d",
+    # "dated" (uploads are stored under upload_path), or "content": uploads
+    # are stored once under content_upload_path by a hash of their content,
+    # and deleted when no longer used.
+    "upload_storage_mode": "dated",
+    "content_upload_path": "personal/content",
+    # content addressed files never change, so their downloads can be
+    # cached for this long (seconds).
+    "content_download_max_age": 365 * 24 * 60 * 60,
     "restructuredtext_help": """This will be processed as
 <a href="http://docutils.sourceforge.net/docs/user/rst/quickref.html" target="_blank">
 ReStructuredText</a>.""",
     "photo_help": """This should be a picture of yourself,
 between 250 and 400 pixels wide (no more).""",
+    # downscaled variants of each photo are made at these widths (pixels)
+    # when it is uploaded, and the photo is shown this wide (at most).
+    "photo_variant_widths": [200, 400, 800],
+    "photo_display_width": 400,
+    # in-process cache of rendered ReStructuredText, keyed by a hash of
+    # the source and RESTRUCTUREDTEXT_FILTER_SETTINGS.
+    # Bounded by the number of entries and the total size (in bytes).
+    "restructuredtext_cache_size": 1000,
+    "restructuredtext_cache_bytes": 8 * 1024 * 1024,
+    # optionally share rendered ReStructuredText between workers through
+    # this django cache alias (e.g., "default"); None to disable.
+    "restructuredtext_cache_backend": None,
+    "restructuredtext_cache_timeout": 24 * 60 * 60,
+    # ReStructuredText is rendered "inprocess", or in a pool of
+    # restructuredtext_workers processes ("process"), which gives up after
+    # restructuredtext_timeout seconds.  Longer text (in characters) is not
+    # rendered.  Text which cannot be rendered is shown as plain text.
+    "restructuredtext_backend": "inprocess",
+    "restructuredtext_workers": 2,
+    "restructuredtext_timeout": 5,
+    "restructuredtext_max_size": 200 * 1000,
+    # the plain text shown for text which could not be rendered is kept
+    # (in process) for this long (seconds) before rendering is retried.
+    "restructuredtext_fallback_timeout": 60,
+    # number of compiled templates kept for the prerender filter.
+    "prerender_template_cache_size": 500,
+    # number of pages per page of the list view; None for no pagination.
+    "list_paginate_by": None,
+    # the ordering of the list view; the last field must be unique.
+    "list_ordering": ["person__cn", "pk"],
+    # cache the page list and detail responses (for anonymous users).
+    # Cached responses are invalidated when the page or person changes.
+    "page_cache_enabled": False,
+    "page_cache_backend": "default",
+    "page_cache_list_timeout": 10 * 60,
+    "page_cache_detail_timeout": 60 * 60,
+    # the detail page validators (ETag and Last-Modified) change at least
+    # this often (seconds), so that changes they cannot see (e.g., to a
+    # directory entry's office) are shown within this time.
+    "page_validator_lifetime": 60 * 60,
+    # cache the generated personal calendar feeds (in this django cache).
+    # Cached feeds are dropped by the signals of the webcal models, so
+    # bulk changes (e.g., queryset update()) are only seen when the feed
+    # expires; only enable this when events are changed through save().
+    "calendar_cache_enabled": False,
+    "calendar_cache_backend": "default",
+    "calendar_cache_timeout": 24 * 60 * 60,
+    # leave out events which ended more than this many days ago; None
+    # for all events.
+    "calendar_past_days": None,
+    # the JSON api: rows per page (by default, and at most with the
+    # ``limit`` parameter), and rows fetched per query while streaming.
+    "api_page_size": 100,
+    "api_max_page_size": 1000,
+    "api_chunk_size": 500,
+    # the number of urls in each sitemap page (at most 50000).
+    "sitemap_limit": 50000,
+    # cache the generated sitemap xml (in the page_cache_backend)
+    # until any page changes.
+    "sitemap_cache_enabled": False,
+    "sitemap_cache_timeout": 24 * 60 * 60,
+    # incremental search indexing: changes to pages queue the page for
+    # reindexing by the ``update_person_pages_index`` command.
+    "search_index_queue": False,
+    # queued pages are indexed once they have been unchanged this long
+    # (seconds), and the command checks the queue this often (seconds).
+    "search_index_queue_delay": 30,
+    "search_index_queue_interval": 60,
+    "search_index_queue_batch_size": 500,
+    # built-in full text search (no search server required).
+    # Documents are kept current by signals when this is enabled.
+    "search_enabled": False,
+    # "inverted" (BM25 over an inverted index table), "fts5" (SQLite only)
+    # or "auto" (fts5 when available).
+    "search_engine": "auto",
+    # how much more a term in the page title counts.
+    "search_title_boost": 5,
+    "search_results_limit": 50,
+    # the number of pages created at once by ``sync_person_pages``.
+    "sync_batch_size": 1000,
+    # background jobs (mugshot face detection): a "thread" or "process"
+    # pool of jobs_workers, or "inprocess" (run at once; e.g., for tests).
+    "jobs_backend": "thread",
+    "jobs_workers": 2,
+    # a job which has not finished after this many seconds has failed.
+    "jobs_timeout": 60,
+    # job records are kept in this cache: results for jobs_result_timeout
+    # seconds, failures for jobs_failure_timeout seconds.  With more than
+    # one server process, this must be a shared cache (not locmem), or
+    # jobs are not found when polled through another process.
+    "jobs_cache_backend": "default",
+    "jobs_result_timeout": 24 * 60 * 60,
+    "jobs_failure_timeout": 60,
+    # derived mugshot images (previews and crops) are stored under this
+    # path, by photo hash and size.
+    "mugshot_derived_path": "person_pages/mugshots",
+    # the face detector for mugshots: "face_detect", or "opencv" (a Haar
+    # cascade; requires cv2 and numpy), which crops with the margin below.
+    "mugshot_detector": "face_detect",
+    # the margin around a face detected by OpenCV in a crop (a fraction
+    # of the face size).
+    "mugshot_crop_margin": 0.5,
+    # how PageFile urls are served: None (the storage url), or through the
+    # download view by "stream" (django sends the file, with range and
+    # conditional requests), "x-sendfile" or "x-accel-redirect" (the
+    # front end server sends the file).
+    "pagefile_download": None,
+    "pagefile_download_chunk_size": 64 * 1024,
+    "pagefile_download_max_age": 60 * 60,
+    # the internal nginx location of the storage root, for x-accel-redirect.
+    "pagefile_accel_redirect_prefix": "/protected/",
 }
 
 
@@ -0,0 +1,242 @@
+"""
+The download view for ``PageFile`` objects.
+
+The ``pagefile_download`` setting chooses how files are sent:
+
+* ``"stream"``: read by django in chunks, with single byte range
+  requests (resuming), ``ETag``, ``Last-Modified`` and conditional
+  requests.
+* ``"x-sendfile"``: the front end server sends the file named by the
+  ``X-Sendfile`` header (Apache mod_xsendfile, lighttpd).
+* ``"x-accel-redirect"``: the front end server sends the file at the
+  internal location ``pagefile_accel_redirect_prefix`` + name (nginx).
+
+With no ``pagefile_download`` setting, ``PageFile`` urls are the storage
+urls and this view is not used.
+"""
+######################################################################
+from __future__ import print_function, unicode_literals
+
+import hashlib
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+from . import conf
+from .models import PageFile, PersonPage
+from .storage import content_hash
+
+######################################################################
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# the length of the content hash in the ``v`` parameter of download urls.
+VERSION_LENGTH = 16
+
+######################################################################
+
+
+def file_validators(pagefile):
+    """
+    Return ``(size, etag, last_modified)`` for the stored file.
+    ``last_modified`` is None when the storage cannot tell.
+    """
+    storage, name = pagefile.the_file.storage, pagefile.the_file.name
+    size = storage.size(name)
+    try:
+        modified = storage.get_modified_time(name)
+    except (NotImplementedError, AttributeError):
+        modified = None
+    timestamp = int(modified.timestamp()) if modified is not None else None
+    data = "{}:{}:{}".format(name, size, timestamp)
+    etag = quote_etag(hashlib.md5(data.encode("utf-8")).hexdigest())
+    return size, etag, timestamp
+
+
+def parse_range(header, size):
+    """
+    Return ``(start, end)`` (inclusive) for a single byte range
+    ``header``; None for a header which should be ignored (so the whole
+    file is sent); or raise ``ValueError`` when it is unsatisfiable.
+    """
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None  # malformed, or several ranges
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:  # a suffix: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def iter_file(f, start, length, chunk_size):
+    """
+    Yield ``length`` bytes of ``f`` from ``start``, in chunks; closing
+    the file at the end.
+    """
+    try:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(chunk_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+######################################################################
+
+
+def download_url(pagefile):
+    """
+    The download view url for ``pagefile``.  Content addressed files get
+    the content hash in the url, so that it can be cached indefinitely.
+    """
+    url = reverse(
+        "person-page-file",
+        kwargs={"slug": pagefile.page.person.slug, "file_slug": pagefile.slug},
+    )
+    digest = content_hash(pagefile.the_file.name)
+    if digest is not None:
+        url += "?v=" + digest[:VERSION_LENGTH]
+    return url
+
+
+def _file_headers(request, response, pagefile):
+    name = pagefile.the_file.name
+    digest = content_hash(name)
+    if digest is None:
+        filename = os.path.basename(name)
+    else:
+        # (the stored name is the hash)
+        filename = pagefile.slug + os.path.splitext(name)[1]
+    content_type, encoding = mimetypes.guess_type(filename)
+    response["Content-Type"] = content_type or "application/octet-stream"
+    response["Content-Disposition"] = "inline; filename*=UTF-8''{}".format(
+        quote(filename)
+    )
+    if digest is not None and request.GET.get("v") == digest[:VERSION_LENGTH]:
+        # this url is for this content only.
+        patch_cache_control(
+            response,
+            public=True,
+            immutable=True,
+            max_age=conf.get("content_download_max_age"),
+        )
+    else:
+        patch_cache_control(response, max_age=conf.get("pagefile_download_max_age"))
+    return response
+
+
+def stream_response(request, pagefile):
+    """
+    Send the file from django, honouring conditional and range requests.
+    """
+    try:
+        size, etag, last_modified = file_validators(pagefile)
+    except (IOError, OSError):
+        raise Http404("File not found")
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+
+    byte_range = None
+    header = request.META.get("HTTP_RANGE")
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if header and (if_range is None or if_range == etag):
+        try:
+            byte_range = parse_range(header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = "bytes */{}".format(size)
+            return response
+
+    start, end = byte_range or (0, size - 1)
+    length = max(end - start + 1, 0)
+    f = pagefile.the_file.storage.open(pagefile.the_file.name, "rb")
+    response = StreamingHttpResponse(
+        iter_file(f, start, length, conf.get("pagefile_download_chunk_size"))
+    )
+    if byte_range is not None:
+        response.status_code = 206
+        response["Content-Range"] = "bytes {}-{}/{}".format(start, end, size)
+    response["Content-Length"] = str(length)
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    return _file_headers(request, response, pagefile)
+
+
+def sendfile_response(request, pagefile):
+    """
+    Hand the file to the front end server (``X-Sendfile``); files in a
+    storage without local paths (e.g., S3) are streamed instead.
+    """
+    try:
+        path = pagefile.the_file.path
+    except NotImplementedError:
+        return stream_response(request, pagefile)
+    response = HttpResponse()
+    response["X-Sendfile"] = path
+    return _file_headers(request, response, pagefile)
+
+
+def accel_redirect_response(request, pagefile):
+    """
+    Hand the file to the front end server (``X-Accel-Redirect``).
+    """
+    response = HttpResponse()
+    response["X-Accel-Redirect"] = conf.get("pagefile_accel_redirect_prefix") + quote(
+        pagefile.the_file.name
+    )
+    return _file_headers(request, response, pagefile)
+
+
+DOWNLOAD_RESPONSES = {
+    "stream": stream_response,
+    "x-sendfile": sendfile_response,
+    "x-accel-redirect": accel_redirect_response,
+}
+
+######################################################################
+
+
+@require_safe
+def pagefile_download(request, slug, file_slug):
+    """
+    Send the file ``file_slug`` from the page of the person ``slug``.
+    """
+    mode = conf.get("pagefile_download")
+    if mode not in DOWNLOAD_RESPONSES:
+        raise Http404("File downloads are not enabled")
+    pagefile = get_object_or_404(
+        PageFile,
+        page__in=PersonPage.objects.active().values("pk"),
+        page__person__slug=slug,
+        slug=file_slug,
+    )
+    if not pagefile.the_file:
+        raise Http404("No file")
+    return DOWNLOAD_RESPONSES[mode](request, pagefile)
+
+
+######################################################################
@@ -13,17 +13,92 @@ from django.db.utils import IntegrityError
 from django.forms.models import inlineformset_factory
 from django.forms.utils import ErrorDict
 from django.template.defaultfilters import slugify
-from markuphelpers.forms import (
-    LinedTextAreaMediaMixin,
-    LinedTextareaWidget,
-    ReStructuredTextFormMixin,
-)
+from django.utils import timezone
+from markuphelpers.forms import LinedTextAreaMediaMixin, LinedTextareaWidget
 
+from . import rendering
+from .handlers import pages_changed
 from .models import PageFile, PageInfo, PageSection, PersonPage
 
 #######################
 
 
+#######################################################################
+
+_formset_classes = {}
+
+
+def _inline_formset_class(model, form, formset, **kwargs):
+    """
+    ``inlineformset_factory()`` for ``PersonPage`` and ``model``; the
+    classes are built once for each set of (hashable) arguments.
+    """
+    try:
+        key = (model, form, formset, tuple(sorted(kwargs.items())))
+        hash(key)
+    except TypeError:
+        return inlineformset_factory(PersonPage, model, form, formset, **kwargs)
+    if key not in _formset_classes:
+        _formset_classes[key] = inlineformset_factory(
+            PersonPage, model, form, formset, **kwargs
+        )
+    return _formset_classes[key]
+
+
+class ChangedFormsInlineFormSet(forms.BaseInlineFormSet):
+    """
+    The forms for existing objects are only cleaned (and saved) when
+    their data has changed.
+    """
+
+    def _construct_form(self, i, **kwargs):
+        form = super(ChangedFormsInlineFormSet, self)._construct_form(i, **kwargs)
+        if self.is_bound and i < self.initial_form_count():
+            # Form.full_clean() skips an unchanged form when this is set.
+            # (Set after construction, so the html required attributes
+            # are kept.)
+            form.empty_permitted = True
+        return form
+
+
+class PageSectionInlineFormSet(ChangedFormsInlineFormSet):
+    """
+    The changed sections are saved together, with ``bulk_update()``.
+    """
+
+    def save_existing_objects(self, commit=True):
+        if not commit:
+            return super(PageSectionInlineFormSet, self).save_existing_objects(commit)
+        self.changed_objects = []
+        self.deleted_objects = []
+        model_fields = set(f.name for f in self.model._meta.concrete_fields)
+        update_fields = set()
+        obj_list = []
+        for form in self.initial_forms:
+            obj = form.instance
+            if obj.pk is None:
+                continue
+            if form in self.deleted_forms:
+                self.deleted_objects.append(obj)
+                self.delete_existing(obj, commit=commit)
+            elif form.has_changed():
+                self.changed_objects.append((obj, form.changed_data))
+                update_fields.update(model_fields.intersection(form.changed_data))
+                obj_list.append(obj)
+        if obj_list:
+            now = timezone.now()
+            for obj in obj_list:
+                update_fields.update(obj.refresh_rendered())
+                obj.modified = now
+            update_fields.add("modified")
+            self.model.objects.bulk_update(obj_list, sorted(update_fields))
+            # bulk_update() sends no signals (see handlers.touch_page).
+            PersonPage.objects.filter(pk=self.instance.pk).update(modified=now)
+            self.instance.modified = now
+            pages_changed([self.instance.pk])
+        return obj_list
+
+
 #######################################################################
 
 
@@ -52,6 +127,34 @@ class PersonPageForm(forms.ModelForm):
 #######################################################################
 
 
+class ReStructuredTextFormMixin(object):
+    """
+    Validates the page text fields through the rendering service (so
+    that a pathological document cannot hold the request worker).
+
+    ``restructuredtext_fields`` is a list of ``(name, strict)`` pairs;
+    markup errors in a ``strict`` field are validation errors.  Text which
+    is too long, or which cannot be checked in time, is always rejected.
+    """
+
+    restructuredtext_fields = []
+
+    def clean(self):
+        cleaned_data = super(ReStructuredTextFormMixin, self).clean()
+        for name, strict in self.restructuredtext_fields:
+            value = cleaned_data.get(name)
+            if not value:
+                continue
+            try:
+                errors = rendering.check_markup(value)
+            except rendering.RenderError as e:
+                self.add_error(name, "{}".format(e))
+                continue
+            if errors and strict:
+                self.add_error(name, errors)
+        return cleaned_data
+
+
 class AdminPageInfoForm(ReStructuredTextFormMixin, forms.ModelForm):
     """
     The form for page info.
@@ -90,13 +193,13 @@ PageInfoFormset = inlineformset_factory(
 
 
 def get_pageinfo_formset_class(
-    form=PageInfoForm, formset=forms.BaseInlineFormSet, **kwargs
+    form=PageInfoForm, formset=ChangedFormsInlineFormSet, **kwargs
 ):
     if "can_delete" not in kwargs:
         kwargs["can_delete"] = False
     if "max_num" not in kwargs:
         kwargs["max_num"] = 1
-    return inlineformset_factory(PersonPage, PageInfo, form, formset, **kwargs)
+    return _inline_formset_class(PageInfo, form, formset, **kwargs)
 
 
 #######################################################################
@@ -120,13 +223,13 @@ class PageSectionForm(ReStructuredTextFormMixin, forms.ModelForm):
 
 
 def get_pagesection_formset_class(
-    form=PageSectionForm, formset=forms.BaseInlineFormSet, **kwargs
+    form=PageSectionForm, formset=PageSectionInlineFormSet, **kwargs
 ):
     if "can_delete" not in kwargs:
         kwargs["can_delete"] = True
     if "extra" not in kwargs:
         kwargs["extra"] = 0
-    return inlineformset_factory(PersonPage, PageSection, form, formset, **kwargs)
+    return _inline_formset_class(PageSection, form, formset, **kwargs)
 
 
 #######################################################################
@@ -144,13 +247,13 @@ class PageFileForm(forms.ModelForm):
 
 
 def get_pagefile_formset_class(
-    form=PageFileForm, formset=forms.BaseInlineFormSet, **kwargs
+    form=PageFileForm, formset=ChangedFormsInlineFormSet, **kwargs
 ):
     if "can_delete" not in kwargs:
         kwargs["can_delete"] = True
     if "extra" not in kwargs:
         kwargs["extra"] = 0
-    return inlineformset_factory(PersonPage, PageFile, form, formset, **kwargs)
+    return _inline_formset_class(PageFile, form, formset, **kwargs)
 
 
 #######################################################################
@@ -0,0 +1,264 @@
+"""
+Built-in full text search for person pages, without an external search
+service.
+
+Each listed page has a ``SearchDocument`` holding its text, kept current
+by signal handlers (when ``search_enabled`` is set).  Documents are
+searched with one of two engines:
+
+* ``"inverted"``: an inverted index (``SearchTerm``) ranked by BM25.
+* ``"fts5"``: an SQLite FTS5 virtual table, ranked by its ``bm25()``.
+
+The ``search_engine`` setting chooses one of these, or ``"auto"`` uses
+FTS5 when the database is SQLite with FTS5 available.
+"""
+#######################################################################
+from __future__ import print_function, unicode_literals
+
+import math
+import re
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import Avg, Count
+from django.template.loader import render_to_string
+
+from . import conf
+from .models import PersonPage, SearchDocument, SearchTerm
+
+#######################################################################
+
+FTS_TABLE = "person_pages_searchdocument_fts"
+
+TERM_RE = re.compile(r"\w+", re.UNICODE)
+TERM_MAX_LENGTH = 64
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+#######################################################################
+
+
+def tokenize(text):
+    """
+    Split ``text`` into a list of lowercase search terms.
+    """
+    return [
+        term[:TERM_MAX_LENGTH]
+        for term in TERM_RE.findall(text.lower())
+        if len(term) > 1 or term.isdigit()
+    ]
+
+
+def document_text(page):
+    """
+    Return the ``(title, text)`` of the search document for ``page``.
+    (This is the same text as the haystack index.)
+    """
+    title = "{}".format(page)
+    text = render_to_string(
+        "search/indexes/person_pages/personpage_text.txt", {"object": page}
+    )
+    return title, text
+
+
+#######################################################################
+
+
+class InvertedIndexEngine(object):
+    """
+    Search the ``SearchTerm`` inverted index, ranking with BM25.
+    Title terms count ``search_title_boost`` times.
+    """
+
+    name = "inverted"
+
+    def index(self, document):
+        title_terms = tokenize(document.title)
+        counts = Counter(tokenize(document.text))
+        for term in title_terms:
+            counts[term] += conf.get("search_title_boost")
+        document.length = sum(counts.values())
+        document.save(update_fields=["length"])
+        SearchTerm.objects.filter(document=document).delete()
+        SearchTerm.objects.bulk_create(
+            [
+                SearchTerm(document=document, term=term, frequency=frequency)
+                for term, frequency in counts.items()
+            ]
+        )
+
+    def remove(self, page_id_list):
+        # SearchTerm rows are deleted with their documents.
+        pass
+
+    def search(self, terms, limit):
+        stats = SearchDocument.objects.aggregate(n=Count("pk"), avgdl=Avg("length"))
+        n, avgdl = stats["n"], stats["avgdl"] or 1.0
+        postings = SearchTerm.objects.filter(term__in=terms).values_list(
+            "document__page_id", "term", "frequency", "document__length"
+        )
+        posting_list = list(postings)
+        df = Counter(term for page_id, term, frequency, length in posting_list)
+        scores = Counter()
+        for page_id, term, frequency, length in posting_list:
+            idf = math.log(1.0 + (n - df[term] + 0.5) / (df[term] + 0.5))
+            norm = frequency + K1 * (1.0 - B + B * length / avgdl)
+            scores[page_id] += idf * frequency * (K1 + 1.0) / norm
+        return scores.most_common(limit)
+
+
+class FTS5Engine(object):
+    """
+    Search an SQLite FTS5 table of the documents (rowid is the page id).
+    """
+
+    name = "fts5"
+
+    _available = None
+
+    @classmethod
+    def is_available(cls):
+        """
+        Is the FTS5 table present in the (SQLite) database?
+        """
+        if cls._available is None:
+            cls._available = (
+                connection.vendor == "sqlite"
+                and FTS_TABLE in connection.introspection.table_names()
+            )
+        return cls._available
+
+    def index(self, document):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM {} WHERE rowid = %s".format(FTS_TABLE),
+                [document.page_id],
+            )
+            cursor.execute(
+                "INSERT INTO {} (rowid, title, text) VALUES (%s, %s, %s)".format(
+                    FTS_TABLE
+                ),
+                [document.page_id, document.title, document.text],
+            )
+
+    def remove(self, page_id_list):
+        with connection.cursor() as cursor:
+            for page_id in page_id_list:
+                cursor.execute(
+                    "DELETE FROM {} WHERE rowid = %s".format(FTS_TABLE), [page_id]
+                )
+
+    def search(self, terms, limit):
+        # quote each term, so user input is never FTS5 query syntax.
+        match = " OR ".join('"{}"'.format(term) for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT rowid, bm25({0}, %s, 1.0) FROM {0} WHERE {0} MATCH %s "
+                "ORDER BY 2 LIMIT %s".format(FTS_TABLE),
+                [float(conf.get("search_title_boost")), match, limit],
+            )
+            # bm25() is smaller for better matches.
+            return [(page_id, -score) for page_id, score in cursor.fetchall()]
+
+
+def get_engine():
+    """
+    Return the configured search engine.
+    """
+    name = conf.get("search_engine")
+    if name == "auto":
+        name = "fts5" if FTS5Engine.is_available() else "inverted"
+    if name == "fts5":
+        return FTS5Engine()
+    if name == "inverted":
+        return InvertedIndexEngine()
+    raise ValueError("Unknown search engine: {!r}".format(name))
+
+
+#######################################################################
+
+
+def update_pages(page_id_list, engine=None):
+    """
+    Bring the search documents for the given pages up to date: listed
+    pages are (re)indexed, and documents for all others are removed.
+    """
+    engine = engine or get_engine()
+    page_id_list = set(page_id_list)
+    page_list = list(
+        PersonPage.objects.active().for_index().filter(pk__in=page_id_list)
+    )
+    with transaction.atomic():
+        for page in page_list:
+            title, text = document_text(page)
+            document, created = SearchDocument.objects.update_or_create(
+                page=page, defaults={"title": title, "text": text}
+            )
+            engine.index(document)
+        removed = page_id_list - set(page.pk for page in page_list)
+        if removed:
+            SearchDocument.objects.filter(page_id__in=removed).delete()
+            engine.remove(removed)
+    return len(page_list), len(removed)
+
+
+def rebuild(chunk_size=500):
+    """
+    Rebuild the documents for all pages.
+    Returns the number of pages indexed.
+    """
+    engine = get_engine()
+    stale = SearchDocument.objects.exclude(
+        page__in=PersonPage.objects.active().values("pk")
+    )
+    update_pages(list(stale.values_list("page_id", flat=True)), engine)
+    count = 0
+    pk_list = list(PersonPage.objects.active().values_list("pk", flat=True))
+    for i in range(0, len(pk_list), chunk_size):
+        indexed, removed = update_pages(pk_list[i : i + chunk_size], engine)
+        count += indexed
+    return count
+
+
+#######################################################################
+
+
+class SearchResult(object):
+    """
+    One search result: the page (``object``) and its ``score``.
+    """
+
+    def __init__(self, page, score):
+        self.object = page
+        self.score = score
+
+    def __repr__(self):
+        return "<SearchResult: {} ({:.3f})>".format(self.object, self.score)
+
+
+def search(query, limit=20):
+    """
+    Return a list of (at most ``limit``) ``SearchResult`` objects for the
+    best matches to the text ``query``.
+    """
+    terms = list(set(tokenize(query)))
+    if not terms:
+        return []
+    ranked = get_engine().search(terms, limit)
+    # (documents of pages which are no longer listed may be stale.)
+    page_map = (
+        PersonPage.objects.active()
+        .select_related("person")
+        .with_listing()
+        .in_bulk([page_id for page_id, score in ranked])
+    )
+    return [
+        SearchResult(page_map[page_id], score)
+        for page_id, score in ranked
+        if page_id in page_map
+    ]
+
+
+#######################################################################
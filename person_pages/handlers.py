@@ -2,24 +2,107 @@
 Signal handlers for PersonPages application.
 """
 #######################################################################
-# Source: https://code.djangoproject.com/ticket/8399
-# Retreived: 2017-May-9
-# Reason: disable m2m changed handling in loaddata/raw scenarios.
+# Automatic page creation can be suppressed, either explicitly with
+# ``suppress_autocreate()`` (e.g., for bulk imports), or for raw saves
+# (e.g., ``loaddata``).
+# Originally based on: https://code.djangoproject.com/ticket/8399
+
+from contextlib import ContextDecorator
+from functools import wraps
 
 try:
-    from functools import wraps
-except ImportError:
-    from django.utils.functional import wraps
+    from contextvars import ContextVar
+except ImportError:  # Python < 3.7
+    ContextVar = None
+
+if ContextVar is not None:
+    _autocreate_suppressed = ContextVar(
+        "person_pages_autocreate_suppressed", default=False
+    )
+else:
+    import threading
+
+    class _ThreadLocalVar(threading.local):
+        value = False
+
+        def get(self):
+            return self.value
+
+        def set(self, value):
+            token = self.value
+            self.value = value
+            return token
+
+        def reset(self, token):
+            self.value = token
+
+    _autocreate_suppressed = _ThreadLocalVar()
+
+# set on a Person instance which has been saved with ``raw=True``.
+RAW_SAVE_ATTR = "_person_pages_raw_save"
+
+
+class suppress_autocreate(ContextDecorator):
+    """
+    A context manager (or decorator) which disables the automatic
+    creation of person pages within its scope.  E.g.::
+
+        with suppress_autocreate():
+            for person in imported_people:
+                person.flags.add(directory_flag)
+
+    The scope follows the current context (thread, or asyncio task).
+    """
 
-import inspect
+    def __init__(self):
+        self._tokens = []
+
+    def _recreate_cm(self):
+        # a decorated function gets a new instance for each call, so that
+        # concurrent calls (in other threads) do not share the tokens.
+        return self.__class__()
+
+    def __enter__(self):
+        self._tokens.append(_autocreate_suppressed.set(True))
+        return self
+
+    def __exit__(self, *exc_info):
+        _autocreate_suppressed.reset(self._tokens.pop())
+        return False
+
+
+def autocreate_suppressed():
+    """
+    Is automatic page creation currently suppressed?
+    """
+    return _autocreate_suppressed.get()
+
+
+def mark_raw_save(sender, instance, raw=False, **kwargs):
+    """
+    A signal for remembering that ``instance`` is being saved raw (i.e.,
+    loaded from a fixture), so that the following ``m2m_changed`` signals
+    for the same object can be ignored.
+
+    Register with:
+    models.signals.pre_save.connect(handlers.mark_raw_save, sender=Person)
+    """
+    setattr(instance, RAW_SAVE_ATTR, raw)
 
 
 def disable_for_loaddata(signal_handler):
+    """
+    Wrap ``signal_handler`` so that it is not called for raw saves, for
+    m2m changes of raw saved instances, or when automatic page creation
+    is suppressed.
+    """
+
     @wraps(signal_handler)
     def wrapper(*args, **kwargs):
-        for fr in inspect.stack():
-            if inspect.getmodulename(fr[1]) == "loaddata":
-                return
+        if autocreate_suppressed() or kwargs.get("raw", False):
+            return
+        if getattr(kwargs.get("instance"), RAW_SAVE_ATTR, False):
+            return
         signal_handler(*args, **kwargs)
 
     return wrapper
@@ -40,7 +123,7 @@ def create_personal_page(sender, instance, created, raw, **kwargs):
     
     NOTE: Only one of the create_person_page handlers should be registered.
     """
-    if raw:
+    if raw or autocreate_suppressed():
         return
     person = instance
     if not person.slug:
@@ -86,3 +169,467 @@ create_personal_page_if_directory_flag_loaddata_safe = disable_for_loaddata(
 )
 
 #######################################################################
+
+
+def invalidate_rendered_file_links(sender, instance, **kwargs):
+    """
+    A signal for marking pre-rendered page text which uses the
+    ``personalfile_url`` tag as stale when a ``PageFile`` changes.
+
+    Register with:
+    models.signals.post_save.connect(handlers.invalidate_rendered_file_links, sender=PageFile)
+    models.signals.post_delete.connect(handlers.invalidate_rendered_file_links, sender=PageFile)
+    """
+    from .models import PageInfo, PageSection
+
+    PageInfo.objects.filter(introduction__contains="personalfile_url").update(
+        introduction_hash=""
+    )
+    PageSection.objects.filter(content__contains="personalfile_url").update(
+        content_hash=""
+    )
+
+
+#######################################################################
+
+
+def invalidate_page_cache(sender, instance, **kwargs):
+    """
+    A signal for invalidating cached page responses when a page, its
+    content or its person changes.
+
+    Register with:
+    models.signals.post_save.connect(handlers.invalidate_page_cache, sender=...)
+    models.signals.post_delete.connect(handlers.invalidate_page_cache, sender=...)
+    for each of Person, PersonPage, PageInfo, PageSection and PageFile.
+    """
+    from people.models import Person
+    from . import pagecache
+    from .models import PersonPage
+
+    if not pagecache.versions_in_use():
+        return
+    pagecache.bump_version(pagecache.ALL_PAGES)
+    if isinstance(instance, PersonPage):
+        slug_list = Person.objects.filter(pk=instance.person_id).values_list(
+            "slug", flat=True
+        )
+        pagecache.bump_version()
+    elif hasattr(instance, "page_id"):
+        slug_list = PersonPage.objects.filter(pk=instance.page_id).values_list(
+            "person__slug", flat=True
+        )
+    else:  # Person
+        slug_list = [instance.slug]
+        pagecache.bump_version()
+    for slug in slug_list:
+        if slug:
+            pagecache.bump_version(slug)
+
+
+def _bump_person_versions(slug_list):
+    from . import pagecache
+
+    pagecache.bump_version(pagecache.ALL_PAGES)
+    pagecache.bump_version()
+    for slug in slug_list:
+        if slug:
+            pagecache.bump_version(slug)
+
+
+def invalidate_page_cache_m2m(sender, instance, action, model, pk_set, **kwargs):
+    """
+    A signal for invalidating cached page responses when a person's
+    flags change (e.g., the directory flag, which lists the page).
+
+    Register with:
+    models.signals.m2m_changed.connect(handlers.invalidate_page_cache_m2m, sender=Person.flags.through)
+    """
+    from people.models import Person
+    from . import pagecache
+
+    if not pagecache.versions_in_use():
+        return
+    if isinstance(instance, Person):
+        if action in ("post_add", "post_remove", "post_clear"):
+            _bump_person_versions([instance.slug])
+        return
+    # a flag, with the people added or removed.
+    if action in ("post_add", "post_remove"):
+        people = Person.objects.filter(pk__in=pk_set or [])
+    elif action == "pre_clear":
+        people = Person.objects.filter(flags=instance)
+    else:
+        return
+    _bump_person_versions(people.values_list("slug", flat=True))
+
+
+def invalidate_old_page_slug(sender, instance, raw=False, **kwargs):
+    """
+    A signal for invalidating the cached responses of a person's old
+    slug, when the slug changes (responses are versioned by slug).
+
+    Register with:
+    models.signals.pre_save.connect(handlers.invalidate_old_page_slug, sender=Person)
+    """
+    from . import pagecache
+
+    if raw or instance.pk is None or not pagecache.versions_in_use():
+        return
+    old_slug = (
+        type(instance)
+        ._base_manager.filter(pk=instance.pk)
+        .values_list("slug", flat=True)
+        .first()
+    )
+    if old_slug and old_slug != instance.slug:
+        pagecache.bump_version(old_slug)
+
+
+#######################################################################
+
+
+def _invalidate_calendars(person_id_list):
+    from people.models import Person
+    from . import calendars
+
+    if person_id_list is None:
+        calendars.invalidate()
+        return
+    slug_list = Person.objects.filter(pk__in=person_id_list).values_list(
+        "slug", flat=True
+    )
+    for slug in slug_list:
+        if slug:
+            calendars.invalidate(slug)
+
+
+def invalidate_calendar_cache(sender, instance, **kwargs):
+    """
+    A signal for dropping the cached calendar feeds of the people
+    related to a changed calendar object (or person, or page).
+
+    Register with:
+    models.signals.post_save.connect(handlers.invalidate_calendar_cache, sender=...)
+    models.signals.pre_delete.connect(handlers.invalidate_calendar_cache, sender=...)
+    for Person, PersonPage and each webcal model.
+    """
+    from . import calendars
+    from .models import PersonPage
+
+    if not calendars.is_enabled():
+        return
+    if isinstance(instance, PersonPage):
+        person_id_list = [instance.person_id]
+    else:
+        person_id_list = calendars.related_person_ids(instance)
+    _invalidate_calendars(person_id_list)
+
+
+def invalidate_old_calendar_slug(sender, instance, raw=False, **kwargs):
+    """
+    A signal for dropping the cached calendar feed of a person's old
+    slug, when the slug changes (the feed is cached by slug).
+
+    Register with:
+    models.signals.pre_save.connect(handlers.invalidate_old_calendar_slug, sender=Person)
+    """
+    from . import calendars
+
+    if raw or instance.pk is None or not calendars.is_enabled():
+        return
+    old_slug = (
+        type(instance)
+        ._base_manager.filter(pk=instance.pk)
+        .values_list("slug", flat=True)
+        .first()
+    )
+    if old_slug and old_slug != instance.slug:
+        calendars.invalidate(old_slug)
+
+
+def invalidate_calendar_cache_m2m(sender, instance, action, model, pk_set, **kwargs):
+    """
+    A signal for dropping cached calendar feeds when a many to many
+    relation of a calendar object changes.
+
+    Register with:
+    models.signals.m2m_changed.connect(handlers.invalidate_calendar_cache_m2m, sender=...)
+    for the through model of each webcal many to many field.
+    """
+    from people.models import Person
+    from . import calendars
+
+    if not calendars.is_enabled():
+        return
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if isinstance(instance, Person):
+        person_id_list = [instance.pk]
+    elif model is Person and pk_set is not None:
+        person_id_list = list(pk_set)
+    else:
+        person_id_list = calendars.related_person_ids(instance)
+    _invalidate_calendars(person_id_list)
+
+
+#######################################################################
+
+
+def touch_page(sender, instance, raw=False, **kwargs):
+    """
+    A signal for updating the ``modified`` time of the page when its
+    content changes (so that incremental search indexing and the page
+    ``Last-Modified`` see it).
+
+    Register with:
+    models.signals.post_save.connect(handlers.touch_page, sender=PageInfo)
+    models.signals.post_delete.connect(handlers.touch_page, sender=PageInfo)
+    (and likewise for PageSection and PageFile).
+    """
+    if raw:
+        return
+    from django.utils import timezone
+    from .models import PersonPage
+
+    PersonPage.objects.filter(pk=instance.page_id).update(modified=timezone.now())
+
+
+#######################################################################
+
+
+def get_page_id_list(instance):
+    """
+    The ids of the pages affected by a change to ``instance``: a
+    ``PersonPage``, a ``Person``, or an object with a ``page`` foreign key.
+    """
+    from .models import PersonPage
+
+    if isinstance(instance, PersonPage):
+        return [instance.pk]
+    if hasattr(instance, "page_id"):
+        return [instance.page_id]
+    # Person
+    return list(PersonPage.objects.filter(person=instance).values_list("pk", flat=True))
+
+
+def get_flag_change_page_ids(instance, action, pk_set):
+    """
+    The ids of the pages of the people whose flags changed, for an
+    ``m2m_changed`` signal of ``Person.flags.through``; None when
+    ``action`` is not after the change.  (The people a flag is cleared
+    from are found before the change, and kept on the flag.)
+    """
+    from people.models import Person
+    from .models import PersonPage
+
+    if isinstance(instance, Person):
+        if action not in ("post_add", "post_remove", "post_clear"):
+            return None
+        person_id_list = [instance.pk]
+    elif action == "pre_clear":
+        instance._person_pages_cleared = list(
+            Person.objects.filter(flags=instance).values_list("pk", flat=True)
+        )
+        return None
+    elif action == "post_clear":
+        person_id_list = getattr(instance, "_person_pages_cleared", [])
+    elif action in ("post_add", "post_remove"):
+        person_id_list = list(pk_set or [])
+    else:
+        return None
+    return list(
+        PersonPage.objects.filter(person_id__in=person_id_list).values_list(
+            "pk", flat=True
+        )
+    )
+
+
+def enqueue_page_for_indexing(sender, instance, raw=False, **kwargs):
+    """
+    A signal for queueing the page for incremental search indexing.
+
+    Register with:
+    models.signals.post_save.connect(handlers.enqueue_page_for_indexing, sender=...)
+    models.signals.post_delete.connect(handlers.enqueue_page_for_indexing, sender=...)
+    for each of Person, PersonPage, PageInfo and PageSection.
+    """
+    from . import conf
+    from .models import PageIndexQueue
+
+    if raw or not conf.get("search_index_queue"):
+        return
+    PageIndexQueue.objects.enqueue(get_page_id_list(instance))
+
+
+def enqueue_page_for_indexing_m2m(sender, instance, action, pk_set, **kwargs):
+    """
+    A signal for queueing the pages of people whose flags change (e.g.,
+    unlisted people are removed from the search index).
+
+    Register with:
+    models.signals.m2m_changed.connect(handlers.enqueue_page_for_indexing_m2m, sender=Person.flags.through)
+    """
+    from . import conf
+    from .models import PageIndexQueue
+
+    if not conf.get("search_index_queue"):
+        return
+    page_id_list = get_flag_change_page_ids(instance, action, pk_set)
+    if page_id_list:
+        PageIndexQueue.objects.enqueue(page_id_list)
+
+
+#######################################################################
+
+
+def update_search_document(sender, instance, raw=False, **kwargs):
+    """
+    A signal for keeping the built-in full text search documents current.
+
+    Register with:
+    models.signals.post_save.connect(handlers.update_search_document, sender=...)
+    models.signals.post_delete.connect(handlers.update_search_document, sender=...)
+    for each of Person, PersonPage, PageInfo and PageSection.
+    """
+    from . import conf, fulltext
+
+    if raw or not conf.get("search_enabled"):
+        return
+    fulltext.update_pages(get_page_id_list(instance))
+
+
+def update_search_document_m2m(sender, instance, action, pk_set, **kwargs):
+    """
+    A signal for updating the search documents of people whose flags
+    change (e.g., unlisted people are removed from the search).
+
+    Register with:
+    models.signals.m2m_changed.connect(handlers.update_search_document_m2m, sender=Person.flags.through)
+    """
+    from . import conf, fulltext
+
+    if not conf.get("search_enabled"):
+        return
+    page_id_list = get_flag_change_page_ids(instance, action, pk_set)
+    if page_id_list:
+        fulltext.update_pages(page_id_list)
+
+
+#######################################################################
+
+
+def pages_changed(page_id_list):
+    """
+    Do the work of the page cache and search signal handlers for bulk
+    changes (e.g., ``bulk_create()`` or ``update()``), which send no
+    signals.
+    """
+    from . import calendars, conf, fulltext, pagecache
+    from .models import PageIndexQueue, PersonPage
+
+    page_id_list = list(page_id_list)
+    if not page_id_list:
+        return
+    if pagecache.versions_in_use():
+        pagecache.bump_version(pagecache.ALL_PAGES)
+        pagecache.bump_version()
+        slug_list = PersonPage.objects.filter(pk__in=page_id_list).values_list(
+            "person__slug", flat=True
+        )
+        for slug in slug_list:
+            if slug:
+                pagecache.bump_version(slug)
+    if calendars.is_enabled():
+        for slug in PersonPage.objects.filter(pk__in=page_id_list).values_list(
+            "person__slug", flat=True
+        ):
+            if slug:
+                calendars.invalidate(slug)
+    if conf.get("search_index_queue"):
+        PageIndexQueue.objects.enqueue(page_id_list)
+    if conf.get("search_enabled"):
+        fulltext.update_pages(page_id_list)
+
+
+#######################################################################
+
+
+def _file_names(instance):
+    """
+    The stored names of the (loaded) file fields of ``instance``.
+    """
+    from django.db.models import FileField
+
+    names = {}
+    for field in instance._meta.concrete_fields:
+        if isinstance(field, FileField) and field.attname in instance.__dict__:
+            value = instance.__dict__[field.attname]
+            names[field.attname] = getattr(value, "name", value) or ""
+    return names
+
+
+def remember_file_names(sender, instance, **kwargs):
+    """
+    A signal for remembering the stored file names of a loaded object,
+    so that replaced files can be released when it is saved.
+
+    Register with:
+    models.signals.post_init.connect(handlers.remember_file_names, sender=PageFile)
+    (and likewise for PageInfo).
+    """
+    instance._person_pages_file_names = _file_names(instance)
+
+
+def _release_files(instance, name_list):
+    from django.db import transaction
+    from .storage import content_hash
+
+    for attname, name in name_list:
+        if content_hash(name) is None:
+            continue  # only content addressed files are released.
+        storage = instance._meta.get_field(attname).storage
+        transaction.on_commit(lambda storage=storage, name=name: storage.delete(name))
+
+
+def release_replaced_files(sender, instance, raw=False, **kwargs):
+    """
+    A signal for deleting content addressed files which are replaced,
+    once nothing else uses them.
+
+    Register with:
+    models.signals.post_save.connect(handlers.release_replaced_files, sender=PageFile)
+    (and likewise for PageInfo).
+    """
+    if raw:
+        return
+    old_names = getattr(instance, "_person_pages_file_names", {})
+    new_names = _file_names(instance)
+    _release_files(
+        instance,
+        [
+            (attname, name)
+            for attname, name in old_names.items()
+            if name and new_names.get(attname, name) != name
+        ],
+    )
+    instance._person_pages_file_names = new_names
+
+
+def release_deleted_files(sender, instance, **kwargs):
+    """
+    A signal for deleting the content addressed files of a deleted
+    object (and the variants of a photo), once nothing else uses them.
+
+    Register with:
+    models.signals.post_delete.connect(handlers.release_deleted_files, sender=PageFile)
+    (and likewise for PageInfo).
+    """
+    _release_files(
+        instance, [item for item in _file_names(instance).items() if item[1]]
+    )
+    if hasattr(instance, "release_photo_variants"):
+        instance.release_photo_variants()
+
+
+#######################################################################
@@ -0,0 +1,239 @@
+"""
+Background jobs for the Person Pages application (e.g., mugshot face
+detection), so that slow work does not hold a request worker.
+
+A job is identified by a key chosen by the caller (e.g., a hash of its
+inputs).  Submitting a job which is pending or finished returns the
+existing job, so repeated requests are served from the stored result.
+Job records are kept in a django cache (``jobs_cache_backend``), which
+must be shared by all the server processes (e.g., memcached or redis;
+not the default ``LocMemCache``), since a job may be polled through a
+different process than the one which runs it.
+
+Backends (the ``jobs_backend`` setting):
+
+* ``"thread"``: a bounded thread pool.
+* ``"process"``: a bounded process pool.  Job functions and their
+  arguments must be picklable.
+* ``"inprocess"``: run the job immediately, in the calling thread
+  (e.g., for tests).
+"""
+#######################################################################
+from __future__ import print_function, unicode_literals
+
+import hashlib
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.cache import caches
+
+from . import conf
+
+#######################################################################
+
+KEY_PREFIX = "person_pages:job:"
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+TIMEOUT = "timeout"
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+#######################################################################
+
+
+def job_key(*parts):
+    """
+    Return a job key (a hex digest) for the given parts.
+    """
+    h = hashlib.sha1()
+    for part in parts:
+        h.update("{}".format(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def get_cache():
+    return caches[conf.get("jobs_cache_backend")]
+
+
+class Job(object):
+    """
+    The record of one job: its ``status``, and its ``result`` (when
+    done) or ``error`` (when failed); ``info`` is a dictionary from the
+    caller (e.g., what the job belongs to).
+    """
+
+    def __init__(self, key, status=PENDING, created=None, timeout=None, **kwargs):
+        self.key = key
+        self.status = status
+        self.created = created if created is not None else time.time()
+        self.timeout = timeout
+        self.result = kwargs.get("result")
+        self.error = kwargs.get("error")
+        self.info = kwargs.get("info") or {}
+
+    def __repr__(self):
+        return "<Job: {} ({})>".format(self.key, self.status)
+
+    @property
+    def pending(self):
+        return self.status == PENDING
+
+    @property
+    def done(self):
+        return self.status == DONE
+
+    def expired(self):
+        """
+        Has this pending job run past its timeout?
+        """
+        if not self.pending or self.timeout is None:
+            return False
+        return time.time() - self.created > self.timeout
+
+    def as_dict(self):
+        return {
+            "key": self.key,
+            "status": self.status,
+            "created": self.created,
+            "timeout": self.timeout,
+            "result": self.result,
+            "error": self.error,
+            "info": self.info,
+        }
+
+    def get_cache_timeout(self):
+        # failed jobs are kept for a shorter time, after which they can
+        # be submitted again.
+        if self.status in (FAILED, TIMEOUT):
+            return conf.get("jobs_failure_timeout")
+        return conf.get("jobs_result_timeout")
+
+    def save(self):
+        """
+        Store the job record.
+        """
+        get_cache().set(KEY_PREFIX + self.key, self.as_dict(), self.get_cache_timeout())
+
+    def add(self):
+        """
+        Store the job record, unless there is one already.
+        Returns True when the record was stored.
+        """
+        return get_cache().add(
+            KEY_PREFIX + self.key, self.as_dict(), self.get_cache_timeout()
+        )
+
+
+def get_job(key):
+    """
+    Return the job with the given key, or None.
+    Pending jobs which have run past their timeout are marked as such.
+    """
+    data = get_cache().get(KEY_PREFIX + key)
+    if data is None:
+        return None
+    job = Job(**data)
+    if job.expired():
+        job.status = TIMEOUT
+        job.error = "The job did not finish in {} seconds".format(job.timeout)
+        job.save()
+    return job
+
+
+def _record(job, call):
+    """
+    Record the result of ``call()`` (or its exception) on ``job``.
+    """
+    try:
+        job.result = call()
+    except Exception as e:
+        job.status = FAILED
+        job.error = "{}: {}".format(e.__class__.__name__, e)
+    else:
+        # (a result which arrives after the timeout is still kept.)
+        job.status = DONE
+    job.save()
+
+
+#######################################################################
+
+
+class InProcessBackend(object):
+    """
+    Run each job immediately, in the calling thread.
+    """
+
+    def submit(self, job, func, args):
+        _record(job, lambda: func(*args))
+
+
+def _init_worker():
+    import django
+
+    django.setup()
+
+
+class PoolBackend(object):
+    """
+    Run jobs on a bounded pool of ``workers`` threads or processes.
+    The result is recorded in this process, when the job finishes.
+    """
+
+    def __init__(self, executor_class, workers):
+        kwargs = {"max_workers": workers}
+        if executor_class is ProcessPoolExecutor:
+            kwargs["initializer"] = _init_worker
+        self.executor = executor_class(**kwargs)
+
+    def submit(self, job, func, args):
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(lambda future: _record(job, future.result))
+
+
+def get_backend():
+    """
+    Return the configured job backend.
+    """
+    name = conf.get("jobs_backend")
+    with _backends_lock:
+        if name not in _backends:
+            if name == "inprocess":
+                backend = InProcessBackend()
+            elif name == "thread":
+                backend = PoolBackend(ThreadPoolExecutor, conf.get("jobs_workers"))
+            elif name == "process":
+                backend = PoolBackend(ProcessPoolExecutor, conf.get("jobs_workers"))
+            else:
+                raise ValueError("Unknown jobs backend: {!r}".format(name))
+            _backends[name] = backend
+        return _backends[name]
+
+
+#######################################################################
+
+
+def submit(key, func, *args, info=None):
+    """
+    Run ``func(*args)`` as the job ``key``, unless that job is already
+    pending or done; returns the ``Job``.  ``info`` is stored with the
+    job record.
+    Failed jobs are run again once their record expires
+    (``jobs_failure_timeout``).
+    """
+    job = get_job(key)
+    if job is not None:
+        return job
+    job = Job(key, timeout=conf.get("jobs_timeout"), info=info)
+    if not job.add():
+        # submitted by another request in the meantime.
+        return get_job(key) or job
+    get_backend().submit(job, func, args)
+    return get_job(key) or job
+
+
+#######################################################################
@@ -0,0 +1,108 @@
+"""
+A small bounded LRU cache for the Person Pages application.
+"""
+#######################################################################
+
+import threading
+import time
+from collections import OrderedDict
+
+#######################################################################
+
+
+class LRUCache(object):
+    """
+    A thread safe least-recently-used cache, bounded by the number of
+    entries and (optionally) by the total size of the values.
+
+    ``sizeof`` is used to measure values for the byte budget.
+    Entries may be given a ``timeout`` (seconds), after which they are
+    dropped.  Hit, miss and eviction counts are available from ``stats()``.
+    """
+
+    def __init__(self, maxsize=128, maxbytes=None, sizeof=len):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """
+        Return the cached value for ``key``, or ``default``.
+        """
+        with self._lock:
+            try:
+                size, value, expires = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= time.time():
+                self._bytes -= size
+                self.misses += 1
+                return default
+            self._data[key] = (size, value, expires)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, timeout=None):
+        """
+        Store ``value`` for ``key`` (for ``timeout`` seconds, if given),
+        evicting the least recently used entries as required.  Values
+        larger than the whole byte budget are not stored.
+        """
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        expires = time.time() + timeout if timeout is not None else None
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[0]
+            if self.maxsize is not None and self.maxsize <= 0:
+                return
+            if self.maxbytes is not None and size > self.maxbytes:
+                return
+            self._data[key] = (size, value, expires)
+            self._bytes += size
+            while (self.maxsize is not None and len(self._data) > self.maxsize) or (
+                self.maxbytes is not None and self._bytes > self.maxbytes
+            ):
+                evicted_size = self._data.popitem(last=False)[1][0]
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Empty the cache and reset the counters.
+        """
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Return a dictionary of the cache counters.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "maxsize": self.maxsize,
+                "maxbytes": self.maxbytes,
+            }
+
+
+#######################################################################
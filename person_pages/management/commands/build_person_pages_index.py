@@ -0,0 +1,44 @@
+"""
+Rebuild the search index documents for all active person pages,
+in bounded-memory chunks and optionally with a pool of processes.
+"""
+#######################################################################
+
+from django.core.management.base import BaseCommand
+
+from ...search_indexes import build_index
+
+#######################################################################
+
+
+class Command(BaseCommand):
+    help = "Index all active person pages"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="The number of pages to load and index at once",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=0,
+            help="The number of worker processes (default: none)",
+        )
+        parser.add_argument(
+            "--using", default=None, help="The haystack connection to update"
+        )
+
+    def handle(self, *args, **options):
+        count = build_index(
+            chunk_size=options["chunk_size"],
+            workers=options["workers"],
+            using=options["using"],
+        )
+        if options["verbosity"] > 0:
+            self.stdout.write("Indexed {} page(s)".format(count))
+
+
+#######################################################################
@@ -0,0 +1,43 @@
+"""
+Make the responsive variants of existing page photos.
+(New photos get their variants when they are uploaded.)
+"""
+#######################################################################
+
+from django.core.management.base import BaseCommand
+
+from ...models import PageInfo
+
+#######################################################################
+
+
+class Command(BaseCommand):
+    help = "Make the responsive variants of the person page photos"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            default=False,
+            help="Remake the variants of every photo (e.g., after changing "
+            "photo_variant_widths)",
+        )
+
+    def handle(self, *args, **options):
+        count = 0
+        for info in PageInfo.objects.exclude(photo="").iterator():
+            if not info.photo_width:
+                info.refresh_photo_dimensions(force=True)
+                if not info.photo_width:
+                    self.stderr.write("{}: cannot be read".format(info.photo.name))
+                    continue
+                PageInfo.objects.filter(pk=info.pk).update(
+                    photo_width=info.photo_width, photo_height=info.photo_height
+                )
+            info.refresh_photo_variants(force=options["force"])
+            count += 1
+        if options["verbosity"] > 0:
+            self.stdout.write("Checked {} photo(s)".format(count))
+
+
+#######################################################################
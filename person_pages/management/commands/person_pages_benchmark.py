@@ -0,0 +1,48 @@
+"""
+Run the Person Pages microbenchmarks.
+"""
+#######################################################################
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...benchmarks import BENCHMARKS
+
+#######################################################################
+
+
+class Command(BaseCommand):
+    help = "Run the Person Pages microbenchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "name",
+            nargs="*",
+            help="The benchmarks to run (default: all).  Available: "
+            + ", ".join(BENCHMARKS),
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=None,
+            help="The number of iterations for each measurement",
+        )
+
+    def handle(self, *args, **options):
+        name_list = options["name"] or list(BENCHMARKS)
+        for name in name_list:
+            if name not in BENCHMARKS:
+                raise CommandError("Unknown benchmark: {}".format(name))
+        for name in name_list:
+            kwargs = {}
+            if options["repeat"] is not None:
+                kwargs["repeat"] = options["repeat"]
+            self.stdout.write(name)
+            for label, seconds in BENCHMARKS[name](**kwargs):
+                self.stdout.write(
+                    "    {0:<50} {1:>12.1f} us {2:>12.1f}/s".format(
+                        label, seconds * 1e6, 1.0 / seconds if seconds else 0
+                    )
+                )
+
+
+#######################################################################
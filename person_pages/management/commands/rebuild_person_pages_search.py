@@ -0,0 +1,30 @@
+"""
+Rebuild the documents of the built-in full text search.
+"""
+#######################################################################
+
+from django.core.management.base import BaseCommand
+
+from ... import fulltext
+
+#######################################################################
+
+
+class Command(BaseCommand):
+    help = "Rebuild the built-in person pages search documents"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="The number of pages to index in each transaction",
+        )
+
+    def handle(self, *args, **options):
+        count = fulltext.rebuild(chunk_size=options["chunk_size"])
+        if options["verbosity"] > 0:
+            self.stdout.write("Indexed {} page(s)".format(count))
+
+
+#######################################################################
@@ -0,0 +1,60 @@
+"""
+Create the missing person pages for every eligible person, in bulk.
+"""
+
+#######################################################################
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import conf
+from ...handlers import suppress_autocreate
+from ...models import PersonPage
+
+#######################################################################
+
+
+class Command(BaseCommand):
+    help = "Create the missing person pages for every eligible person"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--slug-only",
+            action="store_false",
+            dest="require_flag",
+            default=True,
+            help="People with a slug are eligible, and get the directory flag "
+            "(by default, people must also be listed in the directory)",
+        )
+        parser.add_argument(
+            "--deactivate",
+            action="store_true",
+            default=False,
+            help="Deactivate the pages of people who are no longer eligible",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=conf.get("sync_batch_size"),
+            help="The number of pages to create at once",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with suppress_autocreate():
+                counts = PersonPage.objects.sync_from_people(
+                    require_flag=options["require_flag"],
+                    deactivate=options["deactivate"],
+                    batch_size=options["batch_size"],
+                )
+        except ValueError as e:
+            raise CommandError("{}".format(e))
+        if options["verbosity"] > 0:
+            self.stdout.write(
+                "{missing} eligible people without a page: "
+                "created {created} page(s), deactivated {deactivated} page(s)".format(
+                    **counts
+                )
+            )
+
+
+#######################################################################
@@ -0,0 +1,67 @@
+"""
+Incrementally reindex the person pages queued by page changes.
+(Enable queueing with the ``search_index_queue`` setting.)
+"""
+#######################################################################
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from ... import conf
+from ...search_indexes import flush_index_queue
+
+#######################################################################
+
+
+class Command(BaseCommand):
+    help = "Reindex the queued person pages"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            default=False,
+            help="Keep checking the queue (every search_index_queue_interval seconds)",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=conf.get("search_index_queue_interval"),
+            help="Seconds between checks of the queue (with --loop)",
+        )
+        parser.add_argument(
+            "--delay",
+            type=int,
+            default=conf.get("search_index_queue_delay"),
+            help="Only index pages which have been unchanged for this many seconds",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=conf.get("search_index_queue_batch_size"),
+            help="The number of pages to index at once",
+        )
+        parser.add_argument(
+            "--using", default=None, help="The haystack connection to update"
+        )
+
+    def flush(self, options):
+        updated, removed = flush_index_queue(
+            delay=options["delay"],
+            batch_size=options["batch_size"],
+            using=options["using"],
+        )
+        if (updated or removed) and options["verbosity"] > 0:
+            self.stdout.write(
+                "Indexed {} page(s), removed {} page(s)".format(updated, removed)
+            )
+
+    def handle(self, *args, **options):
+        self.flush(options)
+        while options["loop"]:
+            time.sleep(options["interval"])
+            self.flush(options)
+
+
+#######################################################################
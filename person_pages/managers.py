@@ -6,7 +6,12 @@ Managers for the Person Pages application.
 from django.db.models import Manager
 from django.db.models.query import QuerySet
 
-from .querysets import PageFileQuerySet, PageSectionQuerySet, PersonPageQuerySet
+from .querysets import (
+    PageFileQuerySet,
+    PageIndexQueueQuerySet,
+    PageSectionQuerySet,
+    PersonPageQuerySet,
+)
 
 #######################################################################
 #######################################################################
@@ -71,3 +76,17 @@ class PageFileManager(CustomQuerySetManager):
 PageFileManager = PageFileManager.from_queryset(PageFileQuerySet)
 
 #######################################################################
+
+
+class PageIndexQueueManager(CustomQuerySetManager):
+    """
+    Manager for PageIndexQueue objects.  Essentially just proxies
+    back to the custom QuerySet.
+    """
+
+    queryset_class = PageIndexQueueQuerySet
+
+
+PageIndexQueueManager = PageIndexQueueManager.from_queryset(PageIndexQueueQuerySet)
+
+#######################################################################
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("person_pages", "0003_auto_20170602_1055")]
+
+    operations = [
+        migrations.AddField(
+            model_name="pageinfo",
+            name="introduction_hash",
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+        migrations.AddField(
+            model_name="pageinfo",
+            name="introduction_html",
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name="pagesection",
+            name="content_hash",
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+        migrations.AddField(
+            model_name="pagesection",
+            name="content_html",
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# The personalfile_url template tag looks people up by slug, case
+# insensitively.  On PostgreSQL ``slug__iexact`` compiles to
+# ``UPPER(slug::text) = UPPER(%s)``, which needs a functional index.
+# (Other backends either compare case insensitively by collation or cannot
+# index the comparison, so nothing is done there.)
+#
+# NOTE: this index is on the table of the *people* app, whose migrations
+# do not know about it.  Unapplying this migration drops it (on every
+# backend this is the reverse of the forward step: PostgreSQL creates and
+# drops the index, others do nothing).  A people migration which rebuilds
+# the table or the slug column drops the index; apply
+# ``migrate person_pages 0004`` and ``migrate person_pages`` afterwards
+# to recreate it.
+
+INDEX_NAME = "person_pages_person_slug_upper"
+
+
+def create_index(apps, schema_editor):
+    """
+    Create the index on the people app's table (PostgreSQL only).
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    Person = apps.get_model("people", "Person")
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS {} ON {} (UPPER({}::text))".format(
+            schema_editor.quote_name(INDEX_NAME),
+            schema_editor.quote_name(Person._meta.db_table),
+            schema_editor.quote_name(Person._meta.get_field("slug").column),
+        )
+    )
+
+
+def drop_index(apps, schema_editor):
+    """
+    The reverse of ``create_index()``.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "DROP INDEX IF EXISTS {}".format(schema_editor.quote_name(INDEX_NAME))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("people", "0001_initial"),
+        ("person_pages", "0004_rendered_markup"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, reverse_code=drop_index, elidable=False)
+    ]
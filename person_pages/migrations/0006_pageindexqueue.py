@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("person_pages", "0005_person_slug_upper_index")]
+
+    operations = [
+        migrations.CreateModel(
+            name="PageIndexQueue",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("page_id", models.PositiveIntegerField(unique=True)),
+                (
+                    "queued",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "page index queue entry",
+                "verbose_name_plural": "page index queue",
+                "ordering": ["queued"],
+                "base_manager_name": "objects",
+            },
+        )
+    ]
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.utils import OperationalError
+
+# The FTS5 table for the built-in search is only created on SQLite, and
+# only when SQLite was built with FTS5.  (Otherwise the inverted index
+# tables are used.)
+
+FTS_TABLE = "person_pages_searchdocument_fts"
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    try:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS {} "
+                "USING fts5(title, text)".format(FTS_TABLE)
+            )
+    except OperationalError:
+        pass  # no FTS5
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS {}".format(FTS_TABLE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("person_pages", "0006_pageindexqueue")]
+
+    operations = [
+        migrations.CreateModel(
+            name="SearchDocument",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("title", models.CharField(max_length=250)),
+                ("text", models.TextField()),
+                (
+                    "length",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="The number of (weighted) terms in the document",
+                    ),
+                ),
+                ("updated", models.DateTimeField(auto_now=True)),
+                (
+                    "page",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="person_pages.PersonPage",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="SearchTerm",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("term", models.CharField(db_index=True, max_length=64)),
+                ("frequency", models.PositiveIntegerField()),
+                (
+                    "document",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="person_pages.SearchDocument",
+                    ),
+                ),
+            ],
+            options={"unique_together": {("document", "term")}},
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("person_pages", "0007_search")]
+
+    operations = [
+        migrations.AddField(
+            model_name="pageinfo",
+            name="face_detection",
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name="pageinfo",
+            name="photo_hash",
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+    ]
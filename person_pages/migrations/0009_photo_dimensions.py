@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_photo_dimensions(apps, schema_editor):
+    """
+    Store the dimensions of existing photos.
+    (Responsive variants are made by the ``make_person_page_photo_variants``
+    command.)
+    """
+    PageInfo = apps.get_model("person_pages", "PageInfo")
+    for info in PageInfo.objects.exclude(photo=""):
+        try:
+            width, height = info.photo.width, info.photo.height
+        except (IOError, OSError, ValueError):
+            continue  # missing or broken file
+        PageInfo.objects.filter(pk=info.pk).update(
+            photo_width=width, photo_height=height
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("person_pages", "0008_pageinfo_face_detection")]
+
+    operations = [
+        migrations.AddField(
+            model_name="pageinfo",
+            name="photo_height",
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="pageinfo",
+            name="photo_variants",
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name="pageinfo",
+            name="photo_width",
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(set_photo_dimensions, migrations.RunPython.noop),
+        # (after the data migration, so that loading rows with a broken
+        # photo does not fail.)
+        migrations.AlterField(
+            model_name="pageinfo",
+            name="photo",
+            field=models.ImageField(
+                blank=True,
+                height_field="photo_height",
+                help_text="This should be a picture of yourself,\nbetween 250 and 400 pixels wide (no more).",
+                upload_to="personal/%Y/%m/%d",
+                width_field="photo_width",
+            ),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import person_pages.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("person_pages", "0009_photo_dimensions")]
+
+    operations = [
+        migrations.AlterField(
+            model_name="pagefile",
+            name="the_file",
+            field=models.FileField(
+                help_text="The file.",
+                storage=person_pages.storage.UploadStorage(),
+                upload_to="personal/%Y/%m/%d",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="pageinfo",
+            name="photo",
+            field=models.ImageField(
+                blank=True,
+                height_field="photo_height",
+                help_text="This should be a picture of yourself,\nbetween 250 and 400 pixels wide (no more).",
+                storage=person_pages.storage.UploadStorage(),
+                upload_to="personal/%Y/%m/%d",
+                width_field="photo_width",
+            ),
+        ),
+    ]
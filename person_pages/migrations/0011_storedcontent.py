@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("person_pages", "0010_upload_storage")]
+
+    operations = [
+        migrations.CreateModel(
+            name="StoredContent",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+            ],
+            options={
+                "verbose_name": "stored content",
+                "verbose_name_plural": "stored content",
+            },
+        )
+    ]
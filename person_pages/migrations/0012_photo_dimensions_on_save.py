@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import person_pages.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("person_pages", "0011_storedcontent")]
+
+    operations = [
+        # the dimensions are stored by PageInfo.save(), rather than read on
+        # every load (see ImageField.update_dimension_fields()).
+        migrations.AlterField(
+            model_name="pageinfo",
+            name="photo",
+            field=models.ImageField(
+                blank=True,
+                help_text="This should be a picture of yourself,\nbetween 250 and 400 pixels wide (no more).",
+                storage=person_pages.storage.UploadStorage(),
+                upload_to="personal/%Y/%m/%d",
+            ),
+        )
+    ]
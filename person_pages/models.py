@@ -3,14 +3,24 @@ Department Person Pages models.
 """
 from __future__ import print_function, unicode_literals
 
+import json
+
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
+from django.utils.safestring import mark_safe
 from people.models import Person  # people app is required.
 
-from . import conf, handlers
-from .managers import PageFileManager, PageSectionManager, PersonPageManager
+from . import conf, handlers, rendering
+from .managers import (
+    PageFileManager,
+    PageIndexQueueManager,
+    PageSectionManager,
+    PersonPageManager,
+)
+from .storage import upload_storage
 
 #######################################################################
 
@@ -62,20 +72,109 @@ class PersonPage(models.Model):
         return "{}".format(self.person)
 
     def get_absolute_url(self):
-        if not self.person.active:
-            return None
-        if not self.person.has_flag("directory"):
-            return None
-        if not self.person.slug:
+        # ``directory_listed`` is annotated by PersonPageQuerySet.with_listing()
+        listed = getattr(self, "directory_listed", None)
+        if listed is None:
+            if not self.person.active:
+                return None
+            if not self.person.slug:
+                return None
+            if not self.person.has_flag("directory"):
+                return None
+        elif not listed:
             return None
         return reverse("person-page-detail", kwargs={"slug": self.person.slug})
 
+    def get_active_sections(self):
+        """
+        The active sections; prefetched by ``for_detail()``/``for_index()``.
+        """
+        if hasattr(self, "active_sections"):
+            return self.active_sections
+        return self.pagesection_set.active()
+
+    def get_research_list(self):
+        """
+        The person's active research interests (when the directory app is
+        installed); prefetched by ``for_detail()``/``for_index()``.
+        """
+        if hasattr(self.person, "research_list"):
+            return self.person.research_list
+        if hasattr(self.person, "persontaggedentry_set"):
+            return self.person.persontaggedentry_set.active()
+        return []
+
+
+#######################################################################
+
+
+class RenderedMarkupMixin(object):
+    """
+    Keeps pre-rendered HTML for markup fields.
+
+    ``rendered_fields`` is a list of ``(source, html, hash)`` field name
+    triples.  The html is rendered when the object is saved and re-rendered
+    lazily (by ``get_rendered()``) when the stored hash no longer matches
+    the source text and docutils settings.  Text which could not be
+    rendered is stored as the plain text fallback, with an empty hash.
+    """
+
+    rendered_fields = []
+
+    def refresh_rendered(self, force=False):
+        """
+        Re-render any stale markup fields.
+        Returns the list of fields which were updated.
+        """
+        updated = []
+        for source_field, html_field, hash_field in self.rendered_fields:
+            source = getattr(self, source_field)
+            digest = rendering.source_hash(source)
+            if not force and digest == getattr(self, hash_field):
+                continue
+            html = rendering.render_markup(source) if source else ""
+            if isinstance(html, rendering.PlainTextFallback):
+                # keep the source stale, so rendering is tried again;
+                # but only store the fallback once.
+                digest = ""
+                if html == getattr(self, html_field) and not getattr(self, hash_field):
+                    continue
+            setattr(self, html_field, html)
+            setattr(self, hash_field, digest)
+            updated.extend([html_field, hash_field])
+        return updated
+
+    def get_rendered(self, source_field):
+        """
+        Return the HTML for the given source field, rendering and storing
+        it first if it is stale.
+        """
+        for field_names in self.rendered_fields:
+            if field_names[0] == source_field:
+                break
+        else:
+            raise ValueError("{!r} is not a rendered field".format(source_field))
+        html_field = field_names[1]
+        updated = self.refresh_rendered()
+        if updated and self.pk is not None:
+            values = dict((f, getattr(self, f)) for f in updated)
+            # Bypass save(): this is a cache fill, not a modification.
+            type(self)._base_manager.filter(pk=self.pk).update(**values)
+        return mark_safe(getattr(self, html_field))
+
+    def save(self, *args, **kwargs):
+        updated = self.refresh_rendered()
+        update_fields = kwargs.get("update_fields")
+        if updated and update_fields is not None:
+            kwargs["update_fields"] = set(update_fields) | set(updated)
+        return super(RenderedMarkupMixin, self).save(*args, **kwargs)
+
 
 #######################################################################
 
 
 @python_2_unicode_compatible
-class PageInfo(models.Model):
+class PageInfo(RenderedMarkupMixin, models.Model):
     """
     Core information for a single PersonPage -- user editiable.
     """
@@ -92,21 +191,162 @@ class PageInfo(models.Model):
     )
 
     photo = models.ImageField(
-        upload_to=PERSON_PAGE_UPLOAD_PATH, help_text=PHOTO_HELP, blank=True
+        upload_to=PERSON_PAGE_UPLOAD_PATH,
+        storage=upload_storage,
+        help_text=PHOTO_HELP,
+        blank=True,
     )
+    # set by save() when the photo changes (None when it cannot be read).
+    photo_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    photo_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    # the photo the variants were made from, and [width, name] pairs.
+    photo_variants = models.TextField(blank=True, editable=False)
     introduction = models.TextField(
         blank=True, help_text="Page introduction. " + RST_HELP
     )
+    introduction_html = models.TextField(blank=True, editable=False)
+    introduction_hash = models.CharField(max_length=40, blank=True, editable=False)
+    # the hash of the photo bytes (set when the photo is saved), and the
+    # face detected in the photo (see mugshot.get_detection()).
+    photo_hash = models.CharField(max_length=40, blank=True, editable=False)
+    face_detection = models.TextField(blank=True, editable=False)
+
+    rendered_fields = [("introduction", "introduction_html", "introduction_hash")]
 
     def __str__(self):
         return "PageInfo for " + "{}".format(self.page.person)
 
+    def save(self, *args, **kwargs):
+        # atomic, so the lock taken when an upload is stored holds until
+        # this row refers to it (see storage.UploadStorage.save()).
+        with transaction.atomic():
+            self.refresh_photo_dimensions()
+            result = super(PageInfo, self).save(*args, **kwargs)
+            self.refresh_photo_hash()
+            self.refresh_photo_variants()
+        return result
+
+    def get_photo_variants(self):
+        """
+        The stored photo variants: ``{"source": name, "variants": [...]}``.
+        """
+        if not self.photo_variants:
+            return {"source": "", "variants": []}
+        return json.loads(self.photo_variants)
+
+    def refresh_photo_dimensions(self, force=False):
+        """
+        Set the photo dimensions (not saved), when the photo has changed
+        since the variants were made; None when the photo cannot be read.
+        """
+        source = self.photo.name or ""
+        if not force and self.get_photo_variants()["source"] == source:
+            return
+        width = height = None
+        if source:
+            try:
+                width, height = self.photo.width, self.photo.height
+            except (IOError, OSError, ValueError):
+                pass  # missing or broken file
+        self.photo_width, self.photo_height = width, height
+
+    def refresh_photo_hash(self, force=False):
+        """
+        Store the hash of the photo bytes, when the photo has changed
+        since the variants were made (or there is no hash yet).
+        """
+        from . import photos
+
+        source = self.photo.name or ""
+        if (
+            not force
+            and self.photo_hash
+            and self.get_photo_variants()["source"] == source
+        ):
+            return
+        value = photos.content_hash(self.photo) if source else ""
+        if value != self.photo_hash:
+            self.photo_hash = value
+            PageInfo.objects.filter(pk=self.pk).update(photo_hash=value)
+
+    def refresh_photo_variants(self, force=False):
+        """
+        Generate the responsive variants of the photo, when the photo
+        has changed since they were made.
+        """
+        from . import photos
+
+        stored = self.get_photo_variants()
+        source = self.photo.name or ""
+        if not force and stored["source"] == source:
+            return
+        variants = []
+        if source and self.photo_width and self.photo_height:
+            variants = photos.generate_variants(
+                self.photo, self.photo_width, self.photo_height
+            )
+        self.photo_variants = json.dumps({"source": source, "variants": variants})
+        PageInfo.objects.filter(pk=self.pk).update(photo_variants=self.photo_variants)
+        replaced = [v for v in stored["variants"] if v not in variants]
+        if replaced:
+            transaction.on_commit(
+                lambda: self._release_photo_variants(stored["source"], replaced)
+            )
+
+    def release_photo_variants(self):
+        """
+        Delete the stored variants, once the change is committed (e.g.,
+        when this object is deleted).
+        """
+        stored = self.get_photo_variants()
+        if stored["variants"]:
+            transaction.on_commit(
+                lambda: self._release_photo_variants(
+                    stored["source"], stored["variants"]
+                )
+            )
+
+    def _release_photo_variants(self, source, variants):
+        """
+        Delete replaced variants (once the change is committed), unless
+        another page still uses the same photo (photos stored by content
+        may be shared, along with their variants).
+        """
+        from . import photos
+
+        shared = PageInfo.objects.filter(photo=source).exclude(pk=self.pk).exists()
+        if not shared:
+            photos.delete_variants(self.photo.storage, variants)
+
+    @property
+    def photo_display(self):
+        from . import photos
+
+        return photos.display(
+            self.photo,
+            self.photo_width,
+            self.photo_height,
+            self.get_photo_variants()["variants"],
+        )
+
+    def get_face_detection(self):
+        """
+        The stored face detection result (a dictionary), or None.
+        """
+        if not self.face_detection:
+            return None
+        return json.loads(self.face_detection)
+
+    @property
+    def rendered_introduction(self):
+        return self.get_rendered("introduction")
+
 
 #######################################################################
 
 
 @python_2_unicode_compatible
-class PageSection(models.Model):
+class PageSection(RenderedMarkupMixin, models.Model):
     """
     A section of one persons page -- user editable.
     """
@@ -134,9 +374,13 @@ class PageSection(models.Model):
     )
     title = models.CharField(max_length=250, help_text="The title for the section")
     content = models.TextField(help_text="The text for this section. " + RST_HELP)
+    content_html = models.TextField(blank=True, editable=False)
+    content_hash = models.CharField(max_length=40, blank=True, editable=False)
 
     objects = PageSectionManager()
 
+    rendered_fields = [("content", "content_html", "content_hash")]
+
     class Meta:
         ordering = ["ordering"]
         base_manager_name = "objects"
@@ -144,6 +388,10 @@ class PageSection(models.Model):
     def __str__(self):
         return self.title
 
+    @property
+    def rendered_content(self):
+        return self.get_rendered("content")
+
 
 #######################################################################
 
@@ -164,7 +412,7 @@ class PageFile(models.Model):
         help_text="(Optional) A short description of the file",
     )
     the_file = models.FileField(
-        upload_to=PERSON_PAGE_UPLOAD_PATH, help_text="The file."
+        upload_to=PERSON_PAGE_UPLOAD_PATH, storage=upload_storage, help_text="The file."
     )
     show_link = models.BooleanField(
         default=False,
@@ -179,6 +427,11 @@ class PageFile(models.Model):
         unique_together = ("page", "slug")
         base_manager_name = "objects"
 
+    def save(self, *args, **kwargs):
+        # atomic, as for PageInfo.save().
+        with transaction.atomic():
+            return super(PageFile, self).save(*args, **kwargs)
+
     def __str__(self):
         result = "PageFile"
         if self.description:
@@ -188,10 +441,102 @@ class PageFile(models.Model):
 
     def get_absolute_url(self):
         """
-        Return the url for this object
+        Return the url for this object: the download view when the
+        ``pagefile_download`` setting is used, otherwise the storage url.
         """
+        if conf.get("pagefile_download"):
+            from .downloads import download_url
+
+            return download_url(self)
         return self.the_file.url
 
 
+#######################################################################
+
+
+@python_2_unicode_compatible
+class StoredContent(models.Model):
+    """
+    A content addressed upload (see ``storage``).  The row is locked
+    while a new reference to the file is saved, and while the file is
+    deleted, so that a file is never deleted under a new reference.
+    """
+
+    name = models.CharField(max_length=255, unique=True)
+
+    class Meta:
+        verbose_name = "stored content"
+        verbose_name_plural = "stored content"
+
+    def __str__(self):
+        return self.name
+
+
+#######################################################################
+
+
+@python_2_unicode_compatible
+class PageIndexQueue(models.Model):
+    """
+    Pages waiting to be reindexed by the search engine.
+    This is a plain id (not a foreign key) so that deleted pages can still
+    be removed from the index.
+    """
+
+    page_id = models.PositiveIntegerField(unique=True)
+    queued = models.DateTimeField(default=timezone.now, db_index=True)
+
+    objects = PageIndexQueueManager()
+
+    class Meta:
+        ordering = ["queued"]
+        base_manager_name = "objects"
+        verbose_name = "page index queue entry"
+        verbose_name_plural = "page index queue"
+
+    def __str__(self):
+        return "PersonPage {}".format(self.page_id)
+
+
+#######################################################################
+
+
+@python_2_unicode_compatible
+class SearchDocument(models.Model):
+    """
+    The denormalized text of one PersonPage, for the built-in full text
+    search (see ``fulltext``).
+    """
+
+    page = models.OneToOneField(PersonPage, on_delete=models.CASCADE)
+    title = models.CharField(max_length=250)
+    text = models.TextField()
+    length = models.PositiveIntegerField(
+        default=0, help_text="The number of (weighted) terms in the document"
+    )
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.title
+
+
+@python_2_unicode_compatible
+class SearchTerm(models.Model):
+    """
+    One entry of the inverted index: how often a term occurs in a
+    document.
+    """
+
+    document = models.ForeignKey(SearchDocument, on_delete=models.CASCADE)
+    term = models.CharField(max_length=64, db_index=True)
+    frequency = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ("document", "term")
+
+    def __str__(self):
+        return self.term
+
+
 #######################################################################
 ####
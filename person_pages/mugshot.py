@@ -1,23 +1,349 @@
 """
 Special routines for saving mugshot files using facial detection.
+
+Face detection is slow, so it runs as a background job (see ``jobs``);
+the views return at once, and the pages poll the job status url until
+the job has finished.  Results are kept, keyed by the photo, so repeated
+previews are served immediately.
 """
 ######################################################################
+import base64
+import json
 import os
+from io import BytesIO
 
 import face_detect
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.http import Http404, HttpResponseRedirect
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image, ImageDraw
+
+from . import conf, jobs
+from .models import PageInfo, PersonPage
+from .views import PersonPageDetailView, forbidden_response, permission_check
+
+try:
+    import cv2
+    import numpy
+except ImportError:
+    cv2 = None
+
+######################################################################
+
+# PIL format names for photo file extensions.
+IMAGE_FORMATS = {"JPG": "JPEG", "TIF": "TIFF"}
+
+HAARCASCADE = "haarcascade_frontalface_default.xml"
+
+
+def photo_format(photo):
+    """
+    The PIL image format for the photo (from its file extension).
+    """
+    ext = os.path.splitext(photo.name)[-1][1:].upper()
+    return IMAGE_FORMATS.get(ext, ext)
+
+
+def read_photo(photo):
+    """
+    Return the bytes of the photo.
+    """
+    photo.open("rb")
+    try:
+        return photo.read()
+    finally:
+        photo.close()
+
+
+def use_opencv():
+    """
+    Is the face detector OpenCV (the ``mugshot_detector`` setting)?
+    """
+    name = conf.get("mugshot_detector")
+    if name == "face_detect":
+        return False
+    if name != "opencv":
+        raise ValueError("Unknown face detector: {!r}".format(name))
+    if cv2 is None:
+        raise ValueError("The opencv face detector requires cv2 and numpy.")
+    return True
+
+
+def detector_version():
+    """
+    Identifies the face detector: a stored detection from a different
+    detector is redone.
+    """
+    if use_opencv():
+        return "opencv-{}".format(cv2.__version__)
+    return "face_detect-{}".format(getattr(face_detect, "__version__", ""))
+
+
+def _detect_box(data):
+    """
+    Return the bounding box ``[x, y, width, height]`` and confidence of
+    the most likely face in the image ``data``, or ``(None, None)``.
+    """
+    im = cv2.imdecode(numpy.frombuffer(data, numpy.uint8), cv2.IMREAD_GRAYSCALE)
+    classifier = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, HAARCASCADE))
+    rects, levels, weights = classifier.detectMultiScale3(
+        im, scaleFactor=1.1, minNeighbors=5, outputRejectLevels=True
+    )
+    if len(rects) == 0:
+        return None, None
+    best = max(range(len(rects)), key=lambda i: float(weights[i]))
+    return [int(v) for v in rects[best]], float(weights[best])
+
+
+def get_detection(pageinfo):
+    """
+    Return the face detection result for the photo, as stored on
+    ``pageinfo``: a dictionary with the photo ``hash``, the detector
+    ``version``, whether a face was ``found``, and the face ``box`` and
+    ``confidence``.  Detection only runs again when the photo hash
+    (stored when the photo is saved) or the detector change.
+
+    With the (default) ``face_detect`` detector, which only provides
+    finished images, ``box`` is None, ``found`` is None until the first
+    derived image, and the derived images come from ``face_detect``.
+    With OpenCV (``mugshot_detector``), the images are cropped around
+    the detected ``box`` with ``mugshot_crop_margin``.
+    """
+    if not pageinfo.photo_hash:
+        # (pages saved before the hash was stored.)
+        pageinfo.refresh_photo_hash(force=True)
+    digest = pageinfo.photo_hash
+    version = detector_version()
+    detection = pageinfo.get_face_detection()
+    if (
+        detection is not None
+        and detection["hash"] == digest
+        and detection["version"] == version
+    ):
+        return detection
+    if use_opencv():
+        box, confidence = _detect_box(read_photo(pageinfo.photo))
+        found = box is not None
+    else:
+        box, confidence, found = None, None, None
+    detection = {
+        "hash": digest,
+        "version": version,
+        "found": found,
+        "box": box,
+        "confidence": confidence,
+    }
+    save_detection(pageinfo, detection)
+    return detection
+
+
+def save_detection(pageinfo, detection):
+    """
+    Store the face detection result on ``pageinfo``.
+    """
+    pageinfo.face_detection = json.dumps(detection)
+    # update() rather than save(): this is not an edit of the page.
+    PageInfo.objects.filter(pk=pageinfo.pk).update(
+        face_detection=pageinfo.face_detection
+    )
+
+
+def crop_box(box, image_size):
+    """
+    The crop around the face ``box``, with ``mugshot_crop_margin``,
+    within the image.
+    """
+    x, y, w, h = box
+    margin = conf.get("mugshot_crop_margin")
+    dx, dy = int(w * margin), int(h * margin)
+    width, height = image_size
+    return (
+        max(x - dx, 0),
+        max(y - dy, 0),
+        min(x + w + dx, width),
+        min(y + h + dy, height),
+    )
+
+
+def _derive_from_box(data, kind, box):
+    im = Image.open(BytesIO(data))
+    box = crop_box(box, im.size)
+    if kind == "preview":
+        im = im.convert("RGB")
+        ImageDraw.Draw(im).rectangle(box, outline=(255, 0, 0))
+        return im
+    return im.crop(box)
+
+
+def _derive_with_face_detect(pageinfo, kind):
+    if kind == "preview":
+        return face_detect.detect_face_preview(pageinfo.photo)
+    return face_detect.detect_face_crop(pageinfo.photo)
+
+
+def derived_path(detection, kind, size, format):
+    """
+    The storage path for a derived image.
+    """
+    key = jobs.job_key(detection["hash"], detection["version"])
+    name = "{}-{}.{}".format(kind, size or "full", format.lower())
+    return "/".join([conf.get("mugshot_derived_path"), key, name])
+
+
+def derived_image(pageinfo, kind, size=None):
+    """
+    Return the ``kind`` (``"preview"`` or ``"crop"``) image for the
+    photo, scaled to fit within ``size`` pixels (if given), as a
+    dictionary with the image ``format``, ``mimetype`` and ``data``
+    (bytes); or None when no face is detected.
+    Encoded images are kept in storage, keyed by the photo hash and size.
+    """
+    detection = get_detection(pageinfo)
+    if detection["found"] is False:
+        return None
+    format = photo_format(pageinfo.photo)
+    path = derived_path(detection, kind, size, format)
+    result = {"format": format, "mimetype": "image/{}".format(format.lower())}
+    if default_storage.exists(path):
+        with default_storage.open(path, "rb") as f:
+            result["data"] = f.read()
+        return result
+
+    if detection["box"] is not None:
+        im = _derive_from_box(read_photo(pageinfo.photo), kind, detection["box"])
+    elif size is not None:
+        full = derived_image(pageinfo, kind)
+        im = Image.open(BytesIO(full["data"])) if full is not None else None
+    else:
+        im = _derive_with_face_detect(pageinfo, kind)
+        if im is None:
+            detection["found"] = False
+            save_detection(pageinfo, detection)
+    if im is None:
+        return None
+    if size is not None:
+        im.thumbnail((size, size))
+    buf = BytesIO()
+    im.save(buf, format=format)
+    result["data"] = buf.getvalue()
+    default_storage.save(path, ContentFile(result["data"]))
+    return result
+
+
+def detect_face(kind, pageinfo_pk, size=None):
+    """
+    The face detection job: see ``derived_image()``.
+    """
+    return derived_image(PageInfo.objects.get(pk=pageinfo_pk), kind, size)
+
+
+def submit_detection(kind, pageinfo):
+    """
+    Submit (or find) the face detection job for the current photo.
+    """
+    key = jobs.job_key(
+        "face", kind, pageinfo.pk, pageinfo.photo.name, pageinfo.modified
+    )
+    return jobs.submit(
+        key, detect_face, kind, pageinfo.pk, info={"page_id": pageinfo.page_id}
+    )
+
+
+def job_context(job):
+    """
+    Template context for a detection job.
+    """
+    context = {"job": job}
+    if job.pending:
+        context["job_status_url"] = reverse(
+            "person-page-mugshot-job", kwargs={"key": job.key}
+        )
+    if job.done and job.result is not None:
+        context["preview"] = {
+            "mimetype": job.result["mimetype"],
+            "base64": base64.b64encode(job.result["data"]).decode("ascii"),
+        }
+    return context
+
+
+def set_mugshots(entry_list, filename, data):
+    """
+    Set the mugshot of every directory entry in ``entry_list`` to the
+    image ``data``: the file is written to storage once, and the entries
+    are all updated in one statement (in a transaction).
+    The entries are not saved, so only ``auto_now`` fields are updated
+    along with the mugshot.
+    """
+    model = entry_list[0].__class__
+    field = model._meta.get_field("mugshot")
+    name = field.generate_filename(entry_list[0], filename)
+    name = field.storage.save(name, ContentFile(data), max_length=field.max_length)
+    values = {field.attname: name}
+    for f in model._meta.concrete_fields:
+        if getattr(f, "auto_now", False):
+            values[f.attname] = timezone.now()
+    try:
+        with transaction.atomic():
+            model._base_manager.filter(pk__in=[e.pk for e in entry_list]).update(
+                **values
+            )
+    except Exception:
+        field.storage.delete(name)
+        raise
+    for entry in entry_list:
+        entry.mugshot = name
+
+
+######################################################################
+
+
+@login_required
+def job_status(request, key):
+    """
+    The status of a face detection job, as JSON (for users with
+    permission on the page the job belongs to).
+    """
+    job = jobs.get_job(key)
+    if job is None or "page_id" not in job.info:
+        raise Http404("No such job")
+    page = get_object_or_404(PersonPage, pk=job.info["page_id"])
+    if not permission_check(request, page):
+        return forbidden_response(
+            request, "You do not have permission to access this page."
+        )
+    return JsonResponse({"key": job.key, "status": job.status, "error": job.error})
 
-from .models import PageInfo
-from .views import PersonPageDetailView, permission_check
 
 ######################################################################
 
-preview = login_required(
-    PersonPageDetailView.as_view(template_name="person_pages/mugshot_preview.html")
-)
+
+class MugshotPreviewView(PersonPageDetailView):
+    """
+    The page with the mugshot preview (once detection has finished).
+    """
+
+    template_name = "person_pages/mugshot_preview.html"
+
+    def get_response(self, request, *args, **kwargs):
+        # The page changes when the detection job finishes, so skip the
+        # conditional response of the detail view.
+        return super(PersonPageDetailView, self).get_response(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super(MugshotPreviewView, self).get_context_data(**kwargs)
+        pageinfo = getattr(self.object, "pageinfo", None)
+        if pageinfo is not None and pageinfo.photo:
+            context.update(job_context(submit_detection("preview", pageinfo)))
+        return context
+
+
+preview = login_required(MugshotPreviewView.as_view())
 
 
 ######################################################################
@@ -32,19 +358,30 @@ def preview_img(request, slug):
             request, "You do not have permission to access this page."
         )
 
-    if pageinfo.photo is None:
+    if not pageinfo.photo:
         msg = "Image not found"
         messages.error(request, msg, fail_silently=True)
         raise Http404(msg)
 
-    im = face_detect.detect_face_preview(pageinfo.photo)
-    if im is None:
-        msg = "No face detected in this image"
-        # messages.error(request, msg, fail_silently=True)
+    job = submit_detection("preview", pageinfo)
+    if job.pending:
+        response = JsonResponse(
+            {
+                "key": job.key,
+                "status": job.status,
+                "status_url": reverse(
+                    "person-page-mugshot-job", kwargs={"key": job.key}
+                ),
+            },
+            status=202,
+        )
+        response["Retry-After"] = "2"
+        return response
+    if job.result is None:
+        # No face detected (or detection failed)
         return HttpResponseRedirect(pageinfo.photo.url)
-        raise Http404(msg)
 
-    return face_detect.HttpImageResponse(im)
+    return HttpResponse(job.result["data"], content_type=job.result["mimetype"])
 
 
 ######################################################################
@@ -79,23 +416,24 @@ def save(
         messages.error(request, context["error"], fail_silently=True)
         return render(request, template_name, context)
 
-    if pageinfo.photo is None:
+    if not pageinfo.photo:
         context["error"] = "There is no image to crop."
         messages.error(request, context["error"], fail_silently=True)
         return render(request, template_name, context)
 
-    im = face_detect.detect_face_crop(pageinfo.photo)
-    if im is None:
+    job = submit_detection("crop", pageinfo)
+    if job.pending:
+        # the page reloads (and saves) when the job has finished.
+        context.update(job_context(job))
+        return render(request, template_name, context)
+    if job.result is None:
         # context['error'] = "No face detected in this image"
         context["error"] = "There was a problem automatically detecting a mugshot."
         messages.error(request, context["error"], fail_silently=True)
         return render(request, template_name, context)
 
-    format = os.path.splitext(pageinfo.photo.name)[-1][1:].upper()
-    image = face_detect.image_as_djangofile(im, basename=person.slug, format=format)
-    for entry in entry_list:
-        entry.mugshot = image
-        entry.save()
+    ext = os.path.splitext(pageinfo.photo.name)[-1]
+    set_mugshots(entry_list, person.slug + ext, job.result["data"])
 
     if len(entry_list) == 1:
         msg = "Mugshot updated"
@@ -0,0 +1,104 @@
+"""
+Response caching for the Person Pages views.
+
+Cached responses are keyed by a version number, per page (by the person
+slug), for the page list and for all pages (used by the sitemap).  Versions are bumped by signal handlers
+whenever a page, its content or its person changes, so stale responses
+are never served; they simply expire.
+"""
+#######################################################################
+from __future__ import print_function, unicode_literals
+
+import hashlib
+import time
+
+from django.core.cache import caches
+
+from . import conf
+
+#######################################################################
+
+KEY_PREFIX = "person_pages:pagecache:"
+LIST_SLUG = None
+ALL_PAGES = "*"
+
+#######################################################################
+
+
+def is_enabled():
+    """
+    Is response caching turned on?
+    """
+    return conf.get("page_cache_enabled")
+
+
+def versions_in_use():
+    """
+    Is anything keyed by the page versions?
+    """
+    return is_enabled() or conf.get("sitemap_cache_enabled")
+
+
+def get_cache():
+    """
+    The django cache used for responses.
+    """
+    return caches[conf.get("page_cache_backend")]
+
+
+def _version_key(slug):
+    if slug is LIST_SLUG:
+        return KEY_PREFIX + "version:list"
+    if slug == ALL_PAGES:
+        return KEY_PREFIX + "version:all"
+    return KEY_PREFIX + "version:page:" + slug
+
+
+def get_version(slug=LIST_SLUG):
+    """
+    Return the current version for the page with the given slug; for
+    the page list; or for ``ALL_PAGES``.
+    """
+    cache = get_cache()
+    key = _version_key(slug)
+    version = cache.get(key)
+    if version is None:
+        # start from the clock, so a lost version can never collide with
+        # responses cached under an earlier one.
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def bump_version(slug=LIST_SLUG):
+    """
+    Invalidate all responses for the page with the given slug; for
+    the page list; or for ``ALL_PAGES``.
+    """
+    cache = get_cache()
+    key = _version_key(slug)
+    try:
+        cache.incr(key)
+    except ValueError:
+        get_version(slug)
+
+
+def response_key(request, slug=LIST_SLUG):
+    """
+    The cache key for a response to ``request`` (by scheme, host and
+    path, since responses contain absolute urls).
+    """
+    url = request.build_absolute_uri()
+    path_hash = hashlib.md5(url.encode("utf-8")).hexdigest()
+    if slug is LIST_SLUG:
+        name = "list"
+    elif slug == ALL_PAGES:
+        name = "all"
+    else:
+        name = "page:" + slug
+    return "{}response:{}:{}:{}".format(
+        KEY_PREFIX, name, get_version(slug), path_hash
+    )
+
+
+#######################################################################
@@ -0,0 +1,157 @@
+"""
+Keyset pagination for the Person Pages application.
+
+Rather than counting and using ``OFFSET``, each page continues after the
+ordering values of the last row of the previous page, so every page costs
+the same no matter how deep into the list it is.
+"""
+#######################################################################
+from __future__ import print_function, unicode_literals
+
+import base64
+import binascii
+import json
+from functools import reduce
+
+from django.db.models import Q
+
+#######################################################################
+
+
+class InvalidCursor(ValueError):
+    """
+    The cursor could not be decoded.
+    """
+
+
+def encode_cursor(values):
+    """
+    Encode a list of ordering values as an url-safe string.
+    """
+    data = json.dumps(list(values), default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, length):
+    """
+    Decode a cursor produced by ``encode_cursor()``.
+    """
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor(cursor)
+    return values
+
+
+#######################################################################
+
+
+class KeysetPage(object):
+    """
+    One page of results.
+    """
+
+    def __init__(self, object_list, next_cursor, cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator(object):
+    """
+    Paginate ``queryset`` by the ``ordering`` fields.
+    The last ordering field must be unique (e.g., ``"pk"``) so that the
+    ordering is total.  Descending fields are prefixed with ``"-"``.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.per_page = per_page
+
+    def _fields(self):
+        return [(f.lstrip("-"), f.startswith("-")) for f in self.ordering]
+
+    def get_values(self, obj):
+        """
+        Return the ordering values for ``obj``.
+        """
+        values = []
+        for name, descending in self._fields():
+            value = obj
+            for attr in name.split("__"):
+                value = getattr(value, attr)
+            values.append(value)
+        return values
+
+    def after(self, values):
+        """
+        Return a Q object selecting the rows after ``values``.
+        """
+        clauses = []
+        fields = self._fields()
+        for i, (name, descending) in enumerate(fields):
+            lookup = "lt" if descending else "gt"
+            conditions = dict((fields[j][0], values[j]) for j in range(i))
+            conditions["{}__{}".format(name, lookup)] = values[i]
+            clauses.append(Q(**conditions))
+        return reduce(lambda a, b: a | b, clauses)
+
+    def get_queryset(self, cursor=None):
+        """
+        Return the ordered queryset starting after ``cursor``.
+        """
+        qs = self.queryset.order_by(*self.ordering)
+        if cursor:
+            values = decode_cursor(cursor, len(self.ordering))
+            qs = qs.filter(self.after(values))
+        return qs
+
+    def iterator(self, cursor=None, chunk_size=None):
+        """
+        Iterate over all rows after ``cursor``, fetching one page of rows
+        per query.
+        """
+        chunk_size = chunk_size or self.per_page
+        qs = self.queryset.order_by(*self.ordering)
+        values = decode_cursor(cursor, len(self.ordering)) if cursor else None
+        while True:
+            chunk_qs = qs if values is None else qs.filter(self.after(values))
+            chunk = list(chunk_qs[:chunk_size])
+            for obj in chunk:
+                yield obj
+            if len(chunk) < chunk_size:
+                return
+            values = self.get_values(chunk[-1])
+
+    def page(self, cursor=None):
+        """
+        Return the page of results following ``cursor``.
+        """
+        object_list = list(self.get_queryset(cursor)[: self.per_page + 1])
+        next_cursor = None
+        if len(object_list) > self.per_page:
+            object_list = object_list[: self.per_page]
+            next_cursor = encode_cursor(self.get_values(object_list[-1]))
+        return KeysetPage(object_list, next_cursor, cursor)
+
+
+#######################################################################
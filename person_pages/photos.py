@@ -0,0 +1,107 @@
+"""
+Responsive variants of the page photos.
+
+Downscaled copies of each photo (at the ``photo_variant_widths``) are
+generated once, when the photo is uploaded, and offered to browsers
+with ``srcset`` so that large originals are not sent for display.
+"""
+#######################################################################
+from __future__ import print_function, unicode_literals
+
+import hashlib
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image
+
+from . import conf
+
+#######################################################################
+
+
+def variant_name(name, width):
+    """
+    The storage name for the ``width`` pixel variant of the photo ``name``.
+    """
+    base, ext = os.path.splitext(name)
+    return "{}-{}w{}".format(base, width, ext)
+
+
+def content_hash(photo):
+    """
+    A hex digest of the bytes of ``photo`` (e.g., to tell whether a face
+    detection result is for the current photo).
+    """
+    h = hashlib.sha1()
+    photo.open("rb")
+    try:
+        for chunk in photo.chunks():
+            h.update(chunk)
+    finally:
+        photo.close()
+    return h.hexdigest()
+
+
+def generate_variants(photo, width, height):
+    """
+    Store the variants of ``photo`` (of the given dimensions) narrower
+    than the original.  Returns a list of ``[width, name]`` pairs.
+    """
+    photo.open("rb")
+    try:
+        im = Image.open(BytesIO(photo.read()))
+        im.load()
+    finally:
+        photo.close()
+    format = im.format
+    variants = []
+    for variant_width in sorted(conf.get("photo_variant_widths")):
+        if variant_width >= width:
+            break
+        variant_height = max(1, int(round(height * variant_width / float(width))))
+        variant = im.resize((variant_width, variant_height), Image.LANCZOS)
+        buf = BytesIO()
+        variant.save(buf, format=format)
+        name = photo.storage.save(
+            variant_name(photo.name, variant_width), ContentFile(buf.getvalue())
+        )
+        variants.append([variant_width, name])
+    return variants
+
+
+def delete_variants(storage, variants):
+    """
+    Remove stored variants (from ``generate_variants()``).
+    """
+    for width, name in variants:
+        storage.delete(name)
+
+
+def display(photo, width, height, variants):
+    """
+    Return how to show the photo: a dictionary with the ``url`` of the
+    best variant for the ``photo_display_width``, the ``srcset`` of all
+    variants, and the display ``width`` and ``height`` (None when the
+    dimensions are not known).
+    """
+    result = {"url": photo.url, "srcset": "", "width": width, "height": height}
+    if not width or not height:
+        return result
+    display_width = min(width, conf.get("photo_display_width"))
+    result["width"] = display_width
+    result["height"] = max(1, int(round(height * display_width / float(width))))
+    candidates = [(w, photo.storage.url(name)) for w, name in variants]
+    if not candidates:
+        return result
+    if width <= max(conf.get("photo_variant_widths")):
+        candidates.append((width, photo.url))
+    result["srcset"] = ", ".join("{} {}w".format(url, w) for w, url in candidates)
+    for w, url in candidates:
+        if w >= display_width:
+            result["url"] = url
+            break
+    return result
+
+
+#######################################################################
@@ -3,7 +3,139 @@ QuerySets for the Person Pages application.
 """
 #######################################################################
 
+import datetime
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    Count,
+    DateTimeField,
+    Exists,
+    IntegerField,
+    Max,
+    OuterRef,
+    Prefetch,
+    Subquery,
+)
 from django.db.models.query import QuerySet
+from django.utils import timezone
+from people.models import Person  # people app is required.
+
+#######################################################################
+
+
+def person_relation_model(relation_name):
+    """
+    Return the model on the other side of a ``Person`` relation
+    (e.g., ``"directoryentry_set"``), or None when the app providing it
+    is not installed.
+    """
+    descriptor = getattr(Person, relation_name, None)
+    if descriptor is None:
+        return None
+    return descriptor.field.model
+
+
+def listed_people():
+    """
+    The people whose pages are shown: active, with a slug, and with
+    the directory flag.
+    """
+    return Person.objects.filter(
+        active=True, slug__isnull=False, flags__slug="directory"
+    )
+
+
+# the person relations shown on the detail page (when installed).
+DETAIL_PERSON_RELATIONS = [
+    "directoryentry_set",
+    "persontaggedentry_set",
+    "publication_set",
+]
+
+
+def _relation_aggregates(relation_name):
+    """
+    Subquery aggregates of a ``Person`` relation, for the page person:
+    ``<name>_count``, ``<name>_max_id`` and ``<name>_<field>`` (the
+    latest value) for each ``auto_now`` field of the related model.
+    Returns an empty dictionary when the relation is not installed.
+    """
+    descriptor = getattr(Person, relation_name, None)
+    if descriptor is None:
+        return {}
+    model = descriptor.field.model
+    name = relation_name[: -len("_set")]
+    rows = (
+        model._base_manager.filter(**{descriptor.field.name: OuterRef("person_id")})
+        .order_by()
+        .values(descriptor.field.name)
+    )
+
+    def aggregate(value, output_field):
+        return Subquery(
+            rows.annotate(value=value).values("value"), output_field=output_field
+        )
+
+    result = {
+        name + "_count": aggregate(Count("pk"), IntegerField()),
+        name + "_max_id": aggregate(Max("pk"), IntegerField()),
+    }
+    for f in model._meta.concrete_fields:
+        if isinstance(f, DateTimeField) and f.auto_now:
+            result["{}_{}".format(name, f.name)] = aggregate(Max(f.name), DateTimeField())
+    return result
+
+
+def _select_relations(qs, *names):
+    """
+    ``select_related()`` for those of ``names`` which are relations on the
+    queryset model.
+    """
+    related = []
+    for name in names:
+        try:
+            field = qs.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if field.is_relation and not field.many_to_many:
+            related.append(name)
+    if related:
+        qs = qs.select_related(*related)
+    return qs
+
+
+def get_directory_flag():
+    """
+    Return the ``directory`` flag; raises ``ValueError`` when there is
+    no such flag (so people cannot be listed).
+    """
+    flag_model = Person._meta.get_field("flags").remote_field.model
+    try:
+        return flag_model.objects.get(slug="directory")
+    except flag_model.DoesNotExist:
+        raise ValueError("There is no directory flag.")
+
+
+def _add_directory_flag(person_id_list, flag):
+    """
+    Add the directory ``flag`` to the given people, in bulk.
+    """
+    field = Person._meta.get_field("flags")
+    through = field.remote_field.through
+    through.objects.bulk_create(
+        [
+            through(
+                **{
+                    "{}_id".format(field.m2m_field_name()): person_id,
+                    "{}_id".format(field.m2m_reverse_field_name()): flag.pk,
+                }
+            )
+            for person_id in person_id_list
+        ],
+        ignore_conflicts=True,
+    )
+
 
 #######################################################################
 
@@ -29,11 +161,206 @@ class PersonPageQuerySet(BaseCustomQuerySet):
     """
 
     def active(self):
-        return self.filter(
-            active=True,
-            person__active=True,
-            person__slug__isnull=False,
-            person__flags__slug="directory",
+        """
+        Active pages for people who are listed in the directory.
+        The person conditions are a subquery (rather than a join on the
+        flags) so that each page is returned at most once.
+        """
+        return self.filter(active=True, person__in=listed_people().values("pk"))
+
+    def sync_from_people(self, require_flag=True, deactivate=False, batch_size=None):
+        """
+        Create the missing pages for every eligible person, in bulk.
+        Eligible people have a slug and (when ``require_flag``) are listed
+        in the directory; without ``require_flag``, the directory flag is
+        added to people who get a page, like ``create_personal_page``.
+        With ``deactivate``, active pages of people who are no longer
+        eligible are deactivated.
+        Raises ``ValueError`` without ``require_flag`` when there is no
+        directory flag.
+
+        Returns a dictionary of counts: ``missing`` (eligible people
+        without a page), ``created`` and ``deactivated``.
+        """
+        from . import conf
+        from .handlers import pages_changed
+
+        if batch_size is None:
+            batch_size = conf.get("sync_batch_size")
+        if require_flag:
+            eligible = listed_people()
+        else:
+            eligible = Person.objects.filter(slug__isnull=False).exclude(slug="")
+        flag = None if require_flag else get_directory_flag()
+        missing = list(
+            eligible.filter(personpage__isnull=True)
+            .order_by()
+            .values_list("pk", flat=True)
+            .distinct()
+        )
+        created = 0
+        for i in range(0, len(missing), batch_size):
+            batch = missing[i : i + batch_size]
+            created += self._create_pages(batch)
+            if flag is not None:
+                _add_directory_flag(batch, flag)
+            pages_changed(self.filter(person_id__in=batch).values_list("pk", flat=True))
+
+        deactivated = 0
+        if deactivate:
+            lost = self.filter(active=True).exclude(person__in=eligible.values("pk"))
+            page_id_list = list(lost.values_list("pk", flat=True))
+            deactivated = self.filter(pk__in=page_id_list).update(active=False)
+            pages_changed(page_id_list)
+        return {"missing": len(missing), "created": created, "deactivated": deactivated}
+
+    def _create_pages(self, person_id_list):
+        """
+        Create the pages of the given people, in bulk; returns the number
+        of pages created.  People who got a page in the meantime (e.g.,
+        from a concurrent sync) are skipped.
+        """
+        try:
+            with transaction.atomic():
+                self.bulk_create(
+                    [self.model(person_id=person_id) for person_id in person_id_list]
+                )
+        except IntegrityError:
+            existing = set(
+                self.filter(person_id__in=person_id_list).values_list(
+                    "person_id", flat=True
+                )
+            )
+            remaining = [pk for pk in person_id_list if pk not in existing]
+            if len(remaining) == len(person_id_list):
+                raise
+            return self._create_pages(remaining) if remaining else 0
+        return len(person_id_list)
+
+    def with_listing(self):
+        """
+        Annotate each page with ``directory_listed``: whether the person
+        is active, has a slug and has the directory flag.
+        ``PersonPage.get_absolute_url()`` uses this when it is present,
+        rather than checking the person's flags with another query.
+        """
+        listed = listed_people().filter(pk=OuterRef("person_id"))
+        return self.annotate(directory_listed=Exists(listed.values("pk")))
+
+    def for_list(self, only_fields=None):
+        """
+        The pages, with the person, as needed for listing.
+        ``only_fields`` optionally limits the columns loaded.
+        """
+        qs = self.select_related("person").with_listing()
+        if only_fields:
+            qs = qs.only(*only_fields)
+        return qs
+
+    def validator_values(self):
+        """
+        One row per page, with the person's fields and aggregates of the
+        page content, suitable for computing HTTP validators:
+        ``modified``, ``info_modified``, ``section_modified``,
+        ``section_count``, ``section_max_id``, ``file_count`` and
+        ``file_max_id``, as well as ``person__<field>`` for each of the
+        person's fields, and the aggregates of the person relations shown
+        on the detail page (see ``_relation_aggregates()``).
+        """
+        person_fields = [
+            "person__" + f.attname
+            for f in Person._meta.concrete_fields
+            if not f.is_relation
+        ]
+        qs = self.order_by().values("pk", "modified", *person_fields)
+        qs = qs.annotate(
+            info_modified=Max("pageinfo__modified"),
+            section_modified=Max("pagesection__modified"),
+            section_count=Count("pagesection", distinct=True),
+            section_max_id=Max("pagesection__id"),
+            file_count=Count("pagefile", distinct=True),
+            file_max_id=Max("pagefile__id"),
+        )
+        for relation_name in DETAIL_PERSON_RELATIONS:
+            qs = qs.annotate(**_relation_aggregates(relation_name))
+        return qs
+
+    def _section_prefetch(self):
+        from .models import PageSection
+
+        return Prefetch(
+            "pagesection_set",
+            queryset=PageSection.objects.active(),
+            to_attr="active_sections",
+        )
+
+    def _research_prefetch_list(self):
+        tagged_model = person_relation_model("persontaggedentry_set")
+        if tagged_model is None:
+            return []
+        tagged = _select_relations(tagged_model._default_manager.active(), "tag")
+        return [
+            Prefetch(
+                "person__persontaggedentry_set",
+                queryset=tagged,
+                to_attr="research_list",
+            )
+        ]
+
+    def for_detail(self):
+        """
+        The pages, with everything the detail page shows fetched up front
+        by a fixed number of queries:
+
+        * ``page.active_sections``, ``page.public_files``
+        * ``page.person.directoryentry_list`` (all entries) and
+          ``page.person.active_directoryentry_list``
+        * ``page.person.research_list``
+
+        The person relations are only prefetched when the directory app
+        is installed.
+        """
+        from .models import PageFile
+
+        prefetch_list = [
+            self._section_prefetch(),
+            Prefetch(
+                "pagefile_set",
+                queryset=PageFile.objects.public(),
+                to_attr="public_files",
+            ),
+        ]
+        entry_model = person_relation_model("directoryentry_set")
+        if entry_model is not None:
+            manager = entry_model._default_manager
+            prefetch_list += [
+                Prefetch(
+                    "person__directoryentry_set",
+                    queryset=_select_relations(manager.all(), "office"),
+                    to_attr="directoryentry_list",
+                ),
+                Prefetch(
+                    "person__directoryentry_set",
+                    queryset=_select_relations(manager.active(), "office"),
+                    to_attr="active_directoryentry_list",
+                ),
+            ]
+        prefetch_list += self._research_prefetch_list()
+        return (
+            self.select_related("person", "pageinfo")
+            .with_listing()
+            .prefetch_related(*prefetch_list)
+        )
+
+    def for_index(self):
+        """
+        The pages, with everything the search index document uses
+        (``page.active_sections`` and ``page.person.research_list``)
+        fetched up front.
+        """
+        prefetch_list = [self._section_prefetch()] + self._research_prefetch_list()
+        return self.select_related("person", "pageinfo").prefetch_related(
+            *prefetch_list
         )
 
 
@@ -62,5 +389,52 @@ class PageFileQuerySet(QuerySet):
         """
         return self.filter(show_link=True)
 
+    def url_map(self, person_slug):
+        """
+        Returns a dictionary of lowercased slug -> url for all files on
+        the (active) page of the given person.
+        The person slug is matched case insensitively.
+        """
+        qs = self.filter(page__active=True, page__person__slug__iexact=person_slug)
+        qs = qs.select_related("page__person").only(
+            "id", "page_id", "slug", "the_file", "page__person__slug"
+        )
+        return dict((f.slug.lower(), f.get_absolute_url()) for f in qs)
+
+
+#######################################################################
+
+
+class PageIndexQueueQuerySet(QuerySet):
+    """
+    Custom QuerySet for PageIndexQueue objects.
+    """
+
+    def enqueue(self, page_id_list):
+        """
+        Queue the given pages for reindexing.  A page which is already
+        queued stays queued once, with its time reset (so that a burst of
+        changes is indexed once, after it is over).
+        """
+        page_id_list = set(page_id_list)
+        if not page_id_list:
+            return
+        now = timezone.now()
+        self.filter(page_id__in=page_id_list).update(queued=now)
+        self.bulk_create(
+            [self.model(page_id=page_id, queued=now) for page_id in page_id_list],
+            ignore_conflicts=True,
+        )
+
+    def settled(self, delay, now=None):
+        """
+        Returns the entries which have not been changed for ``delay``
+        seconds (before ``now``, by default the current time).
+        """
+        if now is None:
+            now = timezone.now()
+        cutoff = now - datetime.timedelta(seconds=delay)
+        return self.filter(queued__lte=cutoff)
+
 
 #######################################################################
@@ -0,0 +1,431 @@
+"""
+Markup rendering for the Person Pages application.
+
+Page text is first evaluated as a django template (``prerender``) and then
+processed as ReStructuredText.  The template filters in
+``person_pages_tags`` and the stored HTML columns on ``PageInfo`` and
+``PageSection`` both go through these functions.
+"""
+#######################################################################
+from __future__ import print_function, unicode_literals
+
+import hashlib
+import multiprocessing
+import queue
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template import Context, Template, TemplateSyntaxError
+from django.utils.encoding import force_text, smart_str
+from django.utils.html import escape
+from django.utils.safestring import SafeText, mark_safe
+from docutils.core import publish_parts
+from docutils.utils import SystemMessage
+
+from . import conf
+from .lrucache import LRUCache
+
+#######################################################################
+
+TEMPLATE_PREAMBLE = "{% load person_pages_tags %}\n"
+
+TEMPLATE_MARKERS = ("{{", "{%", "{#")
+
+RST_CACHE_KEY_PREFIX = "person_pages:rst:"
+
+_template_cache = None
+_rst_cache = None
+_renderer = None
+_rst_backend_counts = {"backend_hits": 0, "backend_misses": 0}
+
+#######################################################################
+
+
+def get_docutils_settings():
+    """
+    The docutils settings overrides used for ReStructuredText.
+    """
+    return getattr(settings, "RESTRUCTUREDTEXT_FILTER_SETTINGS", {})
+
+
+def source_hash(text):
+    """
+    Return a hex digest identifying ``text`` as rendered with the
+    current docutils settings.
+    """
+    docutils_settings = get_docutils_settings()
+    h = hashlib.sha1()
+    h.update(repr(sorted(docutils_settings.items())).encode("utf-8"))
+    h.update(b"\0")
+    h.update(force_text(text).encode("utf-8"))
+    return h.hexdigest()
+
+
+#######################################################################
+
+
+def _text_bytes(value):
+    return len(value.encode("utf-8"))
+
+
+def get_restructuredtext_cache():
+    """
+    Return the in-process cache of rendered ReStructuredText.
+    """
+    global _rst_cache
+    if _rst_cache is None:
+        _rst_cache = LRUCache(
+            maxsize=conf.get("restructuredtext_cache_size"),
+            maxbytes=conf.get("restructuredtext_cache_bytes"),
+            sizeof=_text_bytes,
+        )
+    return _rst_cache
+
+
+def get_template_cache():
+    """
+    Return the in-process cache of compiled prerender templates.
+    """
+    global _template_cache
+    if _template_cache is None:
+        _template_cache = LRUCache(maxsize=conf.get("prerender_template_cache_size"))
+    return _template_cache
+
+
+def get_restructuredtext_backend():
+    """
+    Return the shared django cache for rendered ReStructuredText, if
+    one is configured.
+    """
+    alias = conf.get("restructuredtext_cache_backend")
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def cache_stats():
+    """
+    Return the rendering cache counters (for this process).
+    """
+    result = {}
+    result.update(get_restructuredtext_cache().stats())
+    result.update(_rst_backend_counts)
+    return {"restructuredtext": result, "prerender": get_template_cache().stats()}
+
+
+def reset_caches():
+    """
+    Discard the in-process rendering caches and backend (e.g., after a
+    change to the application configuration).
+    """
+    global _renderer, _rst_cache, _template_cache
+    _rst_cache = None
+    _template_cache = None
+    if hasattr(_renderer, "close"):
+        _renderer.close()
+    _renderer = None
+    for key in _rst_backend_counts:
+        _rst_backend_counts[key] = 0
+
+
+#######################################################################
+
+
+class RenderError(Exception):
+    """
+    The text could not be rendered.
+    """
+
+
+class PlainTextFallback(SafeText):
+    """
+    The html for text which could not be rendered.
+    """
+
+
+class InProcessRenderer(object):
+    """
+    Render in the calling thread (no timeout).
+    """
+
+    def call(self, func, *args):
+        return func(*args)
+
+
+def _serve(conn):
+    """
+    The loop of a rendering worker process: run ``(func, args)`` tasks
+    from ``conn`` and send back ``(ok, result or error message)``.
+    """
+    while True:
+        try:
+            func, args = conn.recv()
+        except EOFError:
+            return
+        try:
+            conn.send((True, func(*args)))
+        except Exception as e:
+            conn.send((False, "{}: {}".format(e.__class__.__name__, e)))
+
+
+class RenderWorker(object):
+    """
+    One rendering process, with its own pipe.
+    """
+
+    # workers are replaced after this many tasks (as with maxtasksperchild).
+    max_tasks = 100
+
+    def __init__(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_serve, args=(child_conn,), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def call(self, func, args, timeout):
+        """
+        Return ``(ok, result)`` for ``func(*args)``; raises ``RenderError``
+        when the worker does not answer within ``timeout`` seconds (the
+        worker is then unusable).
+        """
+        self.tasks += 1
+        try:
+            self.conn.send((func, args))
+            if not self.conn.poll(timeout):
+                raise RenderError(
+                    "Rendering took more than {} seconds.".format(timeout)
+                )
+            return self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise RenderError("The rendering worker failed: {}".format(e))
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+
+class ProcessPoolRenderer(object):
+    """
+    Render in at most ``workers`` processes at a time, waiting at most
+    ``timeout`` seconds.  Each call has a worker to itself, so a worker
+    which times out is killed (and later replaced) without affecting
+    other renders.
+    """
+
+    def __init__(self, workers, timeout):
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers)
+        self._idle = queue.LifoQueue()
+
+    def call(self, func, *args):
+        with self._slots:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                worker = RenderWorker()
+            try:
+                ok, result = worker.call(func, args, self.timeout)
+            except RenderError:
+                worker.stop()
+                raise
+            if worker.tasks < worker.max_tasks:
+                self._idle.put(worker)
+            else:
+                worker.stop()
+        if not ok:
+            raise RenderError(result)
+        return result
+
+    def close(self):
+        """
+        Stop the idle workers.
+        """
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                return
+
+
+def get_renderer():
+    """
+    Return the configured rendering backend.
+    """
+    global _renderer
+    if _renderer is None:
+        name = conf.get("restructuredtext_backend")
+        if name == "inprocess":
+            _renderer = InProcessRenderer()
+        elif name == "process":
+            _renderer = ProcessPoolRenderer(
+                conf.get("restructuredtext_workers"),
+                conf.get("restructuredtext_timeout"),
+            )
+        else:
+            raise ValueError("Unknown rendering backend: {!r}".format(name))
+    return _renderer
+
+
+#######################################################################
+
+
+def has_template_syntax(text):
+    """
+    Return True if ``text`` might contain django template markup.
+    """
+    return any(marker in text for marker in TEMPLATE_MARKERS)
+
+
+def get_template(text):
+    """
+    Return the compiled template for ``text``, reusing a cached one
+    when possible.
+    """
+    key = hashlib.sha1(force_text(text).encode("utf-8")).hexdigest()
+    cache = get_template_cache()
+    t = cache.get(key)
+    if t is None:
+        t = Template(TEMPLATE_PREAMBLE + text)
+        cache.set(key, t)
+    return t
+
+
+def prerender(text):
+    """
+    Evaluate ``text`` as a django template, with the person pages
+    template tags loaded.
+    Text without any template markup is returned as is.
+    """
+    if not has_template_syntax(text):
+        return mark_safe(text)
+    return get_template(text).render(Context({}))
+
+
+def publish_fragment(source, settings_overrides):
+    """
+    Render ReST ``source`` to an html fragment.
+    (Run by the rendering backend; possibly in another process.)
+    Copied from django.contrib.markup.templatetags.markup
+    """
+    parts = publish_parts(
+        source=source, writer_name="html4css1", settings_overrides=settings_overrides
+    )
+    return force_text(parts["fragment"])
+
+
+def check_source(source, settings_overrides):
+    """
+    Return a list of the ReST errors in ``source``.
+    (Run by the rendering backend; possibly in another process.)
+    """
+    overrides = dict(settings_overrides)
+    # stop at the first error, without reporting to stderr.
+    overrides.update({"halt_level": 3, "report_level": 5, "warning_stream": False})
+    try:
+        publish_parts(
+            source=source, writer_name="html4css1", settings_overrides=overrides
+        )
+    except SystemMessage as e:
+        return [force_text(e)]
+    return []
+
+
+def _check_size(source):
+    max_size = conf.get("restructuredtext_max_size")
+    if max_size is not None and len(source) > max_size:
+        raise RenderError(
+            "The text is too long ({} characters; at most {}).".format(
+                len(source), max_size
+            )
+        )
+
+
+def _publish_restructuredtext(value):
+    source = smart_str(value)
+    _check_size(source)
+    return get_renderer().call(publish_fragment, source, get_docutils_settings())
+
+
+def fallback_html(value):
+    """
+    The html shown when ``value`` cannot be rendered: escaped plain text.
+    """
+    return PlainTextFallback(
+        '<pre class="markup-fallback">{}</pre>'.format(escape(value))
+    )
+
+
+def check_markup(text):
+    """
+    Return a list of the errors in page ``text`` (template and ReST),
+    for form validation.
+    Raises ``RenderError`` when the text cannot be checked (e.g., it is
+    too long, or checking it times out).
+    """
+    try:
+        source = prerender(text)
+    except TemplateSyntaxError as e:
+        return [force_text(e)]
+    source = smart_str(source)
+    _check_size(source)
+    return get_renderer().call(check_source, source, get_docutils_settings())
+
+
+def restructuredtext(value):
+    """
+    Render ``value`` as ReStructuredText.
+    Results are memoized by a hash of the source and docutils settings;
+    first in process, then in the shared cache backend (if any).
+    Text which cannot be rendered (an error, a timeout, or too long) is
+    shown as escaped plain text (a ``PlainTextFallback``).
+    """
+    key = source_hash(value)
+    local_cache = get_restructuredtext_cache()
+    html = local_cache.get(key)
+    if html is not None:
+        return mark_safe(html)
+
+    backend = get_restructuredtext_backend()
+    if backend is not None:
+        html = backend.get(RST_CACHE_KEY_PREFIX + key)
+        if html is not None:
+            _rst_backend_counts["backend_hits"] += 1
+        else:
+            _rst_backend_counts["backend_misses"] += 1
+
+    if html is None:
+        try:
+            html = _publish_restructuredtext(value)
+        except Exception:
+            # The failure may be transient (e.g., a timeout on a busy
+            # server), so the fallback is only kept briefly, in process.
+            html = fallback_html(value)
+            local_cache.set(key, html, conf.get("restructuredtext_fallback_timeout"))
+            return html
+        if backend is not None:
+            backend.set(
+                RST_CACHE_KEY_PREFIX + key,
+                html,
+                conf.get("restructuredtext_cache_timeout"),
+            )
+    local_cache.set(key, html)
+    return mark_safe(html)
+
+
+def render_markup(text):
+    """
+    The full pipeline for page text: ``prerender`` then ReST.
+    """
+    try:
+        source = prerender(text)
+    except TemplateSyntaxError:
+        return fallback_html(text)
+    return restructuredtext(source)
+
+
+#######################################################################
@@ -3,9 +3,14 @@ Haystack search indexes for PersonPages application.
 """
 ###############################################################
 
-from haystack import indexes
+from concurrent.futures import ProcessPoolExecutor
 
-from .models import PersonPage
+import django
+from django.db import connections as db_connections
+from django.utils import timezone
+from haystack import connection_router, connections, indexes
+
+from .models import PageIndexQueue, PersonPage
 
 ###############################################################
 
@@ -19,9 +24,20 @@ class PersonPageIndex(indexes.SearchIndex, indexes.Indexable):
     def get_model(self):
         return PersonPage
 
+    def get_updated_field(self):
+        """
+        Page content changes update ``PersonPage.modified``, so
+        ``update_index --age`` picks them up.
+        """
+        return "modified"
+
     def index_queryset(self, using=None):
         """Used when the entire index for model is updated."""
-        return self.get_model().objects.active()
+        return self.get_model().objects.active().for_index()
+
+    def read_queryset(self, using=None):
+        """Used when loading search result objects."""
+        return self.get_model().objects.select_related("person").with_listing()
 
     def prepare(self, obj):
         """
@@ -33,3 +49,143 @@ class PersonPageIndex(indexes.SearchIndex, indexes.Indexable):
 
 
 ###############################################################
+
+
+def flush_index_queue(delay=0, batch_size=500, using=None):
+    """
+    Reindex the queued pages which have settled for ``delay`` seconds,
+    ``batch_size`` pages at a time.  Queued pages which are no longer
+    active are removed from the index.
+    Queue entries are only deleted once their pages have been indexed
+    (so a search backend error leaves them queued); pages queued again
+    while they are indexed stay queued.
+    Returns ``(updated, removed)`` counts.
+    """
+    updated = removed = 0
+    now = timezone.now()
+    entries = PageIndexQueue.objects.settled(delay, now=now).order_by("page_id")
+    last_page_id = None
+    while True:
+        batch = entries
+        if last_page_id is not None:
+            batch = batch.filter(page_id__gt=last_page_id)
+        page_id_list = list(batch.values_list("page_id", flat=True)[:batch_size])
+        if not page_id_list:
+            break
+        u, r = reindex_pages(page_id_list, using=using)
+        entries.filter(page_id__in=page_id_list).delete()
+        updated += u
+        removed += r
+        if len(page_id_list) < batch_size:
+            break
+        last_page_id = page_id_list[-1]
+    return updated, removed
+
+
+def remove_pages(backend, page_id_list):
+    """
+    Remove the given pages from the index of ``backend``.
+    (Haystack backends have no bulk delete, so the deletes are sent
+    uncommitted and committed once, with the last one.)
+    """
+    identifier_list = [get_identifier_for_pk(pk) for pk in sorted(page_id_list)]
+    for i, identifier in enumerate(identifier_list):
+        backend.remove(identifier, commit=(i == len(identifier_list) - 1))
+
+
+def reindex_pages(page_id_list, using=None):
+    """
+    Update the index for the given pages: active pages are (re)indexed,
+    and all others are removed.
+    Returns ``(updated, removed)`` counts, summed over the search
+    connections.
+    """
+    page_id_list = set(page_id_list)
+    updated = removed = 0
+    alias_list = [using] if using else connection_router.for_write()
+    for alias in alias_list:
+        index = connections[alias].get_unified_index().get_index(PersonPage)
+        backend = connections[alias].get_backend()
+        page_list = list(index.index_queryset(using=alias).filter(pk__in=page_id_list))
+        removed_id_list = page_id_list - set(p.pk for p in page_list)
+        if page_list:
+            backend.update(index, page_list)
+        if removed_id_list:
+            remove_pages(backend, removed_id_list)
+        updated += len(page_list)
+        removed += len(removed_id_list)
+    return updated, removed
+
+
+def get_identifier_for_pk(pk):
+    """
+    The search index identifier for the page with the given pk.
+    """
+    return "{}.{}".format(PersonPage._meta.label_lower, pk)
+
+
+###############################################################
+
+
+def iter_pk_chunks(queryset, chunk_size):
+    """
+    Yield lists of (at most ``chunk_size``) primary keys from ``queryset``.
+    Only the keys are streamed from the database.
+    """
+    chunk = []
+    pk_iter = queryset.order_by("pk").values_list("pk", flat=True)
+    for pk in pk_iter.iterator(chunk_size=chunk_size):
+        chunk.append(pk)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def index_pk_chunk(alias, pk_list):
+    """
+    Prepare and send the documents for the given pages to the search
+    backend.  Returns the number of documents.
+    """
+    index = connections[alias].get_unified_index().get_index(PersonPage)
+    backend = connections[alias].get_backend()
+    page_list = list(index.index_queryset(using=alias).filter(pk__in=pk_list))
+    if page_list:
+        backend.update(index, page_list)
+    return len(page_list)
+
+
+def _init_worker():
+    # Needed when worker processes are spawned (rather than forked).
+    django.setup()
+
+
+def build_index(chunk_size=500, workers=0, using=None):
+    """
+    (Re)index every active page; ``chunk_size`` pages at a time so that
+    memory use is bounded.  With ``workers`` > 1, chunks are prepared and
+    sent by a pool of that many processes.
+    Returns the number of documents indexed.
+    """
+    count = 0
+    alias_list = [using] if using else connection_router.for_write()
+    for alias in alias_list:
+        index = connections[alias].get_unified_index().get_index(PersonPage)
+        chunks = iter_pk_chunks(index.index_queryset(using=alias), chunk_size)
+        if workers and workers > 1:
+            chunk_list = list(chunks)  # only the keys
+            # Child processes must not share the parent's connections.
+            db_connections.close_all()
+            with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+                futures = [
+                    pool.submit(index_pk_chunk, alias, pk_list)
+                    for pk_list in chunk_list
+                ]
+                count += sum(f.result() for f in futures)
+        else:
+            count += sum(index_pk_chunk(alias, pk_list) for pk_list in chunks)
+    return count
+
+
+###############################################################
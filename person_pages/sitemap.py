@@ -1,8 +1,88 @@
 """
 Sitemap for person pages app.
+
+The generated xml is cached until any page changes.  For example:
+
+    from person_pages import sitemap
+
+    url(r'^sitemap\.xml$', sitemap.index,
+        {'sitemaps': sitemap.sitemaps, 'sitemap_url_name': 'sitemaps'}),
+    url(r'^sitemap-(?P<section>.+)\.xml$', sitemap.sitemap,
+        {'sitemaps': sitemap.sitemaps}, name='sitemaps'),
+
+The index splits the urls into pages of ``sitemap_limit`` urls.
 """
-from django.contrib.sitemaps import GenericSitemap
+from functools import wraps
+
+from django.contrib.sitemaps import Sitemap
+from django.contrib.sitemaps import views as sitemap_views
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from . import conf, pagecache
+from .models import PageSection, PersonPage
+
+
+class PersonPageSitemap(Sitemap):
+    """
+    All the listed person pages.
+    ``lastmod`` is the newest modification of the page, its info and
+    its sections; each sitemap page is generated from a single query.
+    """
+
+    limit = conf.get("sitemap_limit")
+
+    def items(self):
+        newest_section = (
+            PageSection.objects.filter(page=OuterRef("pk"))
+            .order_by("-modified")
+            .values("modified")[:1]
+        )
+        return (
+            PersonPage.objects.active()
+            .select_related("person")
+            .with_listing()
+            .annotate(
+                last_modified=Greatest(
+                    "modified",
+                    Coalesce(F("pageinfo__modified"), "modified"),
+                    Coalesce(Subquery(newest_section), "modified"),
+                )
+            )
+            .order_by("pk")
+        )
+
+    def lastmod(self, obj):
+        return obj.last_modified
+
+
+PersonPage_Sitemap = PersonPageSitemap()
+
+sitemaps = {"people": PersonPage_Sitemap}
+
+
+def cached_sitemap_view(view):
+    """
+    Cache the response of a sitemap view until any page changes.
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not conf.get("sitemap_cache_enabled"):
+            return view(request, *args, **kwargs)
+        cache = pagecache.get_cache()
+        key = pagecache.response_key(request, pagecache.ALL_PAGES)
+        response = cache.get(key)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                if hasattr(response, "render"):
+                    response.render()
+                cache.set(key, response, conf.get("sitemap_cache_timeout"))
+        return response
+
+    return wrapper
 
-from .models import PersonPage
 
-PersonPage_Sitemap = GenericSitemap({"queryset": PersonPage.objects.active()})
+index = cached_sitemap_view(sitemap_views.index)
+sitemap = cached_sitemap_view(sitemap_views.sitemap)
@@ -0,0 +1,177 @@
+"""
+Upload storage for the Person Pages application.
+
+With the ``upload_storage_mode`` setting ``"content"``, uploads (page
+files and photos) are stored under a hash of their content: identical
+files are stored once, and their urls never change, so they can be
+cached forever.  A content addressed file is only deleted once no
+``PageFile`` or ``PageInfo`` refers to it (reference counts are
+queries, rather than stored counters; a ``StoredContent`` row lock
+keeps a new reference and a delete of the same file apart, when the
+reference is saved in the same transaction as the file).
+
+With the default ``"dated"`` mode, uploads are stored under
+``upload_path`` as before.
+"""
+#######################################################################
+from __future__ import print_function, unicode_literals
+
+import hashlib
+import os
+
+from django.core.files.storage import Storage, default_storage
+from django.db import transaction
+from django.utils.deconstruct import deconstructible
+
+from . import conf
+
+#######################################################################
+
+
+def is_content_mode():
+    return conf.get("upload_storage_mode") == "content"
+
+
+def content_name(digest, filename):
+    """
+    The storage name for content with the given (hex) ``digest``.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    return "/".join([conf.get("content_upload_path"), digest[:2], digest + ext])
+
+
+def content_hash(name):
+    """
+    Return the content hash from a content addressed storage ``name``,
+    or None for other names.
+    """
+    prefix = conf.get("content_upload_path") + "/"
+    if not name or not name.startswith(prefix):
+        return None
+    digest = os.path.splitext(os.path.basename(name))[0]
+    if len(digest) != 64 or name != content_name(digest, name):
+        return None
+    return digest
+
+
+def hash_content(content):
+    """
+    Return the sha256 hex digest of ``content`` (a django ``File``), read
+    in chunks.
+    """
+    h = hashlib.sha256()
+    if hasattr(content, "seek"):
+        content.seek(0)
+    for chunk in content.chunks():
+        h.update(chunk)
+    if hasattr(content, "seek"):
+        content.seek(0)
+    return h.hexdigest()
+
+
+def lock_content(name):
+    """
+    Lock the content addressed file ``name`` until the end of the
+    current transaction (see ``StoredContent``).
+    """
+    from .models import StoredContent
+
+    StoredContent.objects.select_for_update().get_or_create(name=name)
+
+
+def count_references(name):
+    """
+    The number of page files and photos using the stored file ``name``.
+    """
+    from .models import PageFile, PageInfo
+
+    return (
+        PageFile.objects.filter(the_file=name).count()
+        + PageInfo.objects.filter(photo=name).count()
+    )
+
+
+#######################################################################
+
+
+@deconstructible
+class UploadStorage(Storage):
+    """
+    A wrapper around the default storage which stores uploads by
+    content hash (in content mode).
+    """
+
+    @property
+    def backend(self):
+        return default_storage
+
+    def save(self, name, content, max_length=None):
+        """
+        Save the file; in content mode, under its content hash.
+        The stored file is locked for the rest of the transaction, so it
+        cannot be deleted before the new reference is committed.  That
+        holds for uploads saved by ``PageInfo.save()`` or
+        ``PageFile.save()`` (which are atomic), or within an outer
+        ``transaction.atomic()``; otherwise (e.g., ``FieldFile.save()``
+        in autocommit) the lock ends with this call.
+        """
+        if not is_content_mode():
+            return self.backend.save(name, content, max_length=max_length)
+        name = content_name(hash_content(content), name)
+        with transaction.atomic():
+            lock_content(name)
+            if self.backend.exists(name):
+                return name  # already stored: this is a new reference.
+            return self.backend.save(name, content, max_length=max_length)
+
+    def delete(self, name):
+        """
+        Delete the file; content addressed files only when they are no
+        longer used (checked with the file locked).
+        """
+        if content_hash(name) is None:
+            self.backend.delete(name)
+            return
+        from .models import StoredContent
+
+        with transaction.atomic():
+            lock_content(name)
+            if count_references(name) > 0:
+                return
+            self.backend.delete(name)
+            StoredContent.objects.filter(name=name).delete()
+
+    def _open(self, name, mode="rb"):
+        return self.backend.open(name, mode)
+
+    def exists(self, name):
+        return self.backend.exists(name)
+
+    def get_available_name(self, name, max_length=None):
+        return self.backend.get_available_name(name, max_length=max_length)
+
+    def listdir(self, path):
+        return self.backend.listdir(path)
+
+    def size(self, name):
+        return self.backend.size(name)
+
+    def url(self, name):
+        return self.backend.url(name)
+
+    def path(self, name):
+        return self.backend.path(name)
+
+    def get_accessed_time(self, name):
+        return self.backend.get_accessed_time(name)
+
+    def get_created_time(self, name):
+        return self.backend.get_created_time(name)
+
+    def get_modified_time(self, name):
+        return self.backend.get_modified_time(name)
+
+
+upload_storage = UploadStorage()
+
+#######################################################################
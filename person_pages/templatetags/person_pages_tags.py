@@ -19,15 +19,12 @@ import os
 
 #######################
 import re
+import threading
 
 from django import template
-from django.conf import settings
-from django.template import Context, Template
 from django.urls import reverse
-from django.utils.encoding import force_text, smart_str
-from django.utils.safestring import mark_safe
-from docutils.core import publish_parts
 
+from .. import rendering
 from ..models import PageFile
 
 #####################################################################
@@ -36,6 +33,50 @@ register = template.Library()
 
 #####################################################################
 
+_request_local = threading.local()
+
+
+def begin_request_file_urls(**kwargs):
+    """
+    Start memoizing ``personalfile_url`` lookups (for this request).
+    """
+    _request_local.file_urls = {}
+
+
+def end_request_file_urls(**kwargs):
+    """
+    Stop memoizing ``personalfile_url`` lookups.
+    """
+    _request_local.__dict__.pop("file_urls", None)
+
+
+def clear_request_file_urls(**kwargs):
+    """
+    Discard memoized ``personalfile_url`` lookups (e.g., when a
+    PageFile changes during a request).
+    """
+    if getattr(_request_local, "file_urls", None) is not None:
+        _request_local.file_urls = {}
+
+
+def get_person_file_urls(person_slug):
+    """
+    Return a dictionary of lowercased file slug -> url for the given person.
+    All of a person's files are fetched with one query, and the result is
+    memoized for the rest of the request (when there is one).
+    """
+    memo = getattr(_request_local, "file_urls", None)
+    key = person_slug.lower()
+    if memo is not None and key in memo:
+        return memo[key]
+    result = PageFile.objects.url_map(person_slug)
+    if memo is not None:
+        memo[key] = result
+    return result
+
+
+#####################################################################
+
 
 class PageFile_Url_Node(template.Node):
     def __init__(
@@ -71,15 +112,7 @@ class PageFile_Url_Node(template.Node):
         person_slug = self._resolve_slug(self.person_slug, self.person_literal, context)
         file_slug = self._resolve_slug(self.file_slug, self.file_literal, context)
 
-        try:
-            o = PageFile.objects.get(
-                page__active=True,
-                page__person__slug__iexact=person_slug,
-                slug__iexact=file_slug,
-            )
-            url = o.get_absolute_url()
-        except PageFile.DoesNotExist:
-            url = ""
+        url = get_person_file_urls(person_slug).get(file_slug.lower(), "")
 
         if self.context_name is not None:
             context[self.context_name] = url
@@ -140,12 +173,9 @@ def personalfile_url(parser, token):
 @register.filter(name="prerender")
 def render_as_template(text):
     """
+    Evaluate the text as a django template.
     """
-    this_file = os.path.splitext(os.path.split(__file__)[-1])[0]
-    template_text = "{% load " + this_file + " %}\n" + text
-    t = Template(template_text)
-    output = t.render(Context({}))
-    return output
+    return rendering.prerender(text)
 
 
 render_as_template.is_safe = True
@@ -156,15 +186,9 @@ render_as_template.is_safe = True
 
 def restructuredtext(value):
     """
-    Copied from django.contrib.markup.templatetags.markup
+    Evaluate the text as ReStructuredText.
     """
-    docutils_settings = getattr(settings, "RESTRUCTUREDTEXT_FILTER_SETTINGS", {})
-    parts = publish_parts(
-        source=smart_str(value),
-        writer_name="html4css1",
-        settings_overrides=docutils_settings,
-    )
-    return mark_safe(force_text(parts["fragment"]))
+    return rendering.restructuredtext(value)
 
 
 restructuredtext.is_safe = True
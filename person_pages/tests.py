@@ -5,7 +5,7 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 
 class SimpleTest(TestCase):
@@ -14,3 +14,1103 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class RenderedMarkupTest(TestCase):
+    def test_rendered_on_refresh(self):
+        """
+        Pre-rendered html is filled in and only re-rendered when stale.
+        """
+        from .models import PageSection
+
+        section = PageSection(title="Teaching", content="*Office hours*")
+        self.assertEqual(section.refresh_rendered(), ["content_html", "content_hash"])
+        self.assertIn("<em>Office hours</em>", section.content_html)
+        self.assertEqual(section.refresh_rendered(), [])
+
+        section.content = "**Office hours**"
+        self.assertEqual(section.refresh_rendered(), ["content_html", "content_hash"])
+        self.assertIn("<strong>Office hours</strong>", section.rendered_content)
+
+    def test_hash_includes_settings(self):
+        from . import rendering
+
+        digest = rendering.source_hash("text")
+        with self.settings(RESTRUCTUREDTEXT_FILTER_SETTINGS={"doctitle_xform": 0}):
+            self.assertNotEqual(rendering.source_hash("text"), digest)
+
+
+class LRUCacheTest(TestCase):
+    def test_bounds(self):
+        from .lrucache import LRUCache
+
+        cache = LRUCache(maxsize=2, maxbytes=10)
+        cache.set("a", "aaaa")
+        cache.set("b", "bbbb")
+        self.assertEqual(cache.get("a"), "aaaa")
+        cache.set("c", "cccc")  # over both budgets: "b" is least recent
+        self.assertNotIn("b", cache)
+        cache.set("d", "d" * 20)  # larger than the whole budget
+        self.assertNotIn("d", cache)
+        self.assertEqual(cache.get("b"), None)
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["bytes"], 8)
+
+
+class ReStructuredTextCacheTest(TestCase):
+    def setUp(self):
+        from . import rendering
+
+        rendering.reset_caches()
+
+    def test_memoized(self):
+        from . import rendering
+
+        first = rendering.restructuredtext("Office hours")
+        second = rendering.restructuredtext("Office hours")
+        self.assertEqual(first, second)
+        stats = rendering.cache_stats()["restructuredtext"]
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 1)
+
+
+class PrerenderTest(TestCase):
+    def setUp(self):
+        from . import rendering
+
+        rendering.reset_caches()
+
+    def test_no_template_fast_path(self):
+        from . import rendering
+
+        text = "Plain *text* with {braces}."
+        self.assertEqual(rendering.prerender(text), text)
+        self.assertEqual(rendering.cache_stats()["prerender"]["entries"], 0)
+
+    def test_compiled_template_reused(self):
+        from . import rendering
+
+        text = '{{ "Office" }} hours'
+        self.assertEqual(rendering.prerender(text).strip(), "Office hours")
+        self.assertEqual(rendering.prerender(text).strip(), "Office hours")
+        stats = rendering.cache_stats()["prerender"]
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 1)
+
+
+@override_settings(
+    PERSONPAGE_CONFIG={
+        "restructuredtext_backend": "inprocess",
+        "restructuredtext_max_size": 40,
+    }
+)
+class RenderingServiceTest(TestCase):
+    def setUp(self):
+        from . import rendering
+
+        rendering.reset_caches()
+
+    def test_too_long_shown_as_text(self):
+        from . import rendering
+
+        html = rendering.restructuredtext("<b>Office</b> hours " * 3)
+        self.assertIsInstance(html, rendering.PlainTextFallback)
+        self.assertIn("&lt;b&gt;Office&lt;/b&gt;", html)
+        with self.assertRaises(rendering.RenderError):
+            rendering.check_markup("Office hours " * 4)
+
+    def test_fallback_not_kept(self):
+        from . import rendering
+
+        text = "Office hours " * 4
+        with self.settings(
+            PERSONPAGE_CONFIG={
+                "restructuredtext_max_size": 40,
+                "restructuredtext_fallback_timeout": 0,
+            }
+        ):
+            html = rendering.restructuredtext(text)
+        self.assertIsInstance(html, rendering.PlainTextFallback)
+        with self.settings(PERSONPAGE_CONFIG={"restructuredtext_max_size": 100}):
+            html = rendering.restructuredtext(text)
+        self.assertNotIsInstance(html, rendering.PlainTextFallback)
+
+    def test_check_markup(self):
+        from . import rendering
+
+        self.assertEqual(rendering.check_markup("Office *hours*"), [])
+        self.assertEqual(len(rendering.check_markup(".. office:: hours")), 1)
+        self.assertEqual(len(rendering.check_markup("{% if %}")), 1)
+
+
+class PersonalFileUrlTest(TestCase):
+    def test_one_query_per_person(self):
+        from django.template import Context, Template
+
+        from .templatetags import person_pages_tags
+
+        t = Template(
+            "{% load person_pages_tags %}"
+            '{% personalfile_url "nobody" "slides" %}'
+            '{% personalfile_url "Nobody" "notes" %}'
+        )
+        person_pages_tags.begin_request_file_urls()
+        try:
+            with self.assertNumQueries(1):
+                self.assertEqual(t.render(Context({})), "")
+                self.assertEqual(t.render(Context({})), "")
+        finally:
+            person_pages_tags.end_request_file_urls()
+
+
+class KeysetPaginationTest(TestCase):
+    def test_cursor_roundtrip(self):
+        from .pagination import InvalidCursor, decode_cursor, encode_cursor
+
+        cursor = encode_cursor(["Smith, Jane", 42])
+        self.assertEqual(decode_cursor(cursor, 2), ["Smith, Jane", 42])
+        self.assertRaises(InvalidCursor, decode_cursor, cursor, 3)
+        self.assertRaises(InvalidCursor, decode_cursor, "not a cursor!", 2)
+
+    def test_after(self):
+        from django.db.models import Q
+
+        from .models import PersonPage
+        from .pagination import KeysetPaginator
+
+        paginator = KeysetPaginator(
+            PersonPage.objects.all(), ["person__cn", "-pk"], per_page=10
+        )
+        self.assertEqual(
+            str(paginator.after(["Smith", 5])),
+            str(Q(person__cn__gt="Smith") | Q(person__cn="Smith", pk__lt=5)),
+        )
+
+
+def create_person_page(slug, cn=None, sections=0):
+    """
+    Create a person with the directory flag, their page, and ``sections``
+    page sections.
+    """
+    from people.models import Person
+
+    from .models import PageInfo, PageSection, PersonPage
+
+    person = Person.objects.create(cn=cn or slug.title(), slug=slug)
+    person.add_flag_by_name("directory")
+    page, created = PersonPage.objects.get_or_create(person=person)
+    PageInfo.objects.create(page=page, introduction="An *introduction*.")
+    for i in range(sections):
+        PageSection.objects.create(
+            page=page,
+            ordering=i,
+            title="Section {}".format(i),
+            content="Some *text* for section {}.".format(i),
+        )
+    return page
+
+
+DETAIL_TEST_TEMPLATES = [
+    {
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "OPTIONS": {
+            "context_processors": [
+                "django.template.context_processors.request",
+                "django.contrib.auth.context_processors.auth",
+            ],
+            "loaders": [
+                (
+                    "django.template.loaders.locmem.Loader",
+                    {
+                        "site_base.html": "{% block breadcrumbs %}{% endblock %}"
+                        "{% block page_content_body %}{% endblock %}"
+                    },
+                ),
+                "django.template.loaders.app_directories.Loader",
+            ],
+        },
+    }
+]
+
+
+@override_settings(ROOT_URLCONF="person_pages.urls", TEMPLATES=DETAIL_TEST_TEMPLATES)
+class DetailQueryBudgetTest(TestCase):
+    # The detail view must not issue more queries than this,
+    # regardless of the number of sections on the page.
+    QUERY_BUDGET = 12
+
+    def assertWithinBudget(self, slug):
+        from django.contrib.auth.models import AnonymousUser
+        from django.db import connection
+        from django.test import RequestFactory
+        from django.test.utils import CaptureQueriesContext
+
+        from .views import PersonPageDetailView
+
+        request = RequestFactory().get("/{}/".format(slug))
+        request.user = AnonymousUser()
+        with CaptureQueriesContext(connection) as queries:
+            response = PersonPageDetailView.as_view()(request, slug=slug)
+            response.render()
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), self.QUERY_BUDGET)
+        return len(queries)
+
+    def test_query_budget(self):
+        create_person_page("small-page", sections=1)
+        create_person_page("large-page", sections=20)
+        self.assertEqual(
+            self.assertWithinBudget("small-page"),
+            self.assertWithinBudget("large-page"),
+        )
+
+
+@override_settings(ROOT_URLCONF="person_pages.urls")
+class ListingAnnotationTest(TestCase):
+    def test_get_absolute_url_uses_annotation(self):
+        from .models import PersonPage
+
+        for slug in ["first-person", "second-person", "third-person"]:
+            create_person_page(slug)
+        with self.assertNumQueries(1):
+            url_list = [
+                page.get_absolute_url()
+                for page in PersonPage.objects.active().for_list()
+            ]
+        self.assertEqual(len(url_list), 3)
+        self.assertTrue(all(url_list))
+
+
+@override_settings(
+    ROOT_URLCONF="person_pages.urls",
+    TEMPLATES=DETAIL_TEST_TEMPLATES,
+    PERSONPAGE_CONFIG={"page_cache_enabled": True},
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class PageCacheTest(TestCase):
+    def get_detail(self, slug, **headers):
+        from django.contrib.auth.models import AnonymousUser
+        from django.test import RequestFactory
+
+        from .views import PersonPageDetailView
+
+        request = RequestFactory().get("/{}/".format(slug), **headers)
+        request.user = AnonymousUser()
+        response = PersonPageDetailView.as_view()(request, slug=slug)
+        if hasattr(response, "render"):
+            response.render()
+        return response
+
+    def test_cached_until_changed(self):
+        page = create_person_page("cached-page", sections=1)
+        first = self.get_detail("cached-page")
+        with self.assertNumQueries(0):
+            second = self.get_detail("cached-page")
+        self.assertEqual(first.content, second.content)
+        with self.assertNumQueries(0):
+            response = self.get_detail("cached-page", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+        section = page.pagesection_set.get()
+        section.title = "A new title"
+        section.save()
+        third = self.get_detail("cached-page")
+        self.assertIn(b"A new title", third.content)
+
+    def test_flag_and_slug_changes(self):
+        from . import pagecache
+
+        page = create_person_page("flagged-page")
+        person = page.person
+        version = pagecache.get_version("flagged-page")
+        person.flags.clear()
+        self.assertNotEqual(pagecache.get_version("flagged-page"), version)
+
+        version = pagecache.get_version("flagged-page")
+        person.slug = "renamed-page"
+        person.save()
+        self.assertNotEqual(pagecache.get_version("flagged-page"), version)
+
+    @override_settings(ALLOWED_HOSTS=["one.example.com", "two.example.com"])
+    def test_key_by_host_and_scheme(self):
+        from django.test import RequestFactory
+
+        from . import pagecache
+
+        factory = RequestFactory()
+        key_list = [
+            pagecache.response_key(factory.get("/", HTTP_HOST="one.example.com")),
+            pagecache.response_key(factory.get("/", HTTP_HOST="two.example.com")),
+            pagecache.response_key(
+                factory.get("/", HTTP_HOST="one.example.com", secure=True)
+            ),
+        ]
+        self.assertEqual(len(set(key_list)), 3)
+
+
+@override_settings(ROOT_URLCONF="person_pages.urls", TEMPLATES=DETAIL_TEST_TEMPLATES)
+class ConditionalGetTest(TestCase):
+    def get_detail(self, slug, **headers):
+        from django.contrib.auth.models import AnonymousUser
+        from django.test import RequestFactory
+
+        from .views import PersonPageDetailView
+
+        request = RequestFactory().get("/{}/".format(slug), **headers)
+        request.user = AnonymousUser()
+        response = PersonPageDetailView.as_view()(request, slug=slug)
+        if hasattr(response, "render"):
+            response.render()
+        return response
+
+    def test_not_modified(self):
+        page = create_person_page("conditional-page", sections=2)
+        response = self.get_detail("conditional-page")
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        last_modified = response["Last-Modified"]
+
+        with self.assertNumQueries(1):
+            response = self.get_detail("conditional-page", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.assertNumQueries(1):
+            response = self.get_detail(
+                "conditional-page", HTTP_IF_MODIFIED_SINCE=last_modified
+            )
+        self.assertEqual(response.status_code, 304)
+
+        page.pagesection_set.all()[0].delete()
+        response = self.get_detail("conditional-page", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_validators_expire(self):
+        import time
+        from unittest import mock
+
+        from . import conf
+
+        create_person_page("expiring-page")
+        response = self.get_detail("expiring-page")
+        later = time.time() + conf.get("page_validator_lifetime")
+        with mock.patch("time.time", return_value=later):
+            response = self.get_detail(
+                "expiring-page",
+                HTTP_IF_NONE_MATCH=response["ETag"],
+                HTTP_IF_MODIFIED_SINCE=response["Last-Modified"],
+            )
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(ROOT_URLCONF="person_pages.urls")
+class JsonApiTest(TestCase):
+    def get_json(self, url, **params):
+        import json
+
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b"".join(response.streaming_content).decode("utf-8"))
+
+    def test_keyset_pages(self):
+        for slug in ["api-first", "api-second", "api-third"]:
+            create_person_page(slug)
+        data = self.get_json("/api/pages/", fields="slug,name", limit=2)
+        self.assertEqual(
+            data["results"],
+            [
+                {"slug": "api-first", "name": "Api-First"},
+                {"slug": "api-second", "name": "Api-Second"},
+            ],
+        )
+        data = self.get_json(data["next"])
+        self.assertEqual([p["slug"] for p in data["results"]], ["api-third"])
+        self.assertIsNone(data["next"])
+
+    def test_photo_field_query_count(self):
+        for slug in ["api-photo-1", "api-photo-2", "api-photo-3"]:
+            create_person_page(slug)
+        with self.assertNumQueries(1):
+            data = self.get_json("/api/pages/", fields="slug,photo")
+        self.assertEqual(len(data["results"]), 3)
+
+    def test_sections_and_errors(self):
+        create_person_page("api-sections", sections=3)
+        data = self.get_json("/api/pages/api-sections/sections/", fields="title")
+        self.assertEqual(
+            [s["title"] for s in data["results"]],
+            ["Section 0", "Section 1", "Section 2"],
+        )
+        response = self.client.get("/api/pages/", {"fields": "password"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/api/pages/", {"after": "not a cursor"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/api/pages/nobody/files/")
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(ROOT_URLCONF="person_pages.urls")
+class SitemapTest(TestCase):
+    def test_lastmod_is_newest_change(self):
+        from .sitemap import PersonPage_Sitemap
+
+        page = create_person_page("sitemap-page", sections=1)
+        section = page.pagesection_set.get()
+        # section changes also touch the page (see handlers.touch_page).
+        page.refresh_from_db()
+        with self.assertNumQueries(1):
+            item_list = list(PersonPage_Sitemap.items())
+        self.assertEqual(len(item_list), 1)
+        self.assertEqual(
+            PersonPage_Sitemap.lastmod(item_list[0]),
+            max(page.modified, page.pageinfo.modified, section.modified),
+        )
+
+
+CALENDAR_DATA = (
+    b"BEGIN:VCALENDAR\r\n"
+    b"BEGIN:VEVENT\r\nSUMMARY:Old\r\nDTSTART:20000101T100000Z\r\nEND:VEVENT\r\n"
+    b"BEGIN:VEVENT\r\nSUMMARY:New\r\nDTSTART;VALUE=DATE:29990101\r\nEND:VEVENT\r\n"
+    b"END:VCALENDAR\r\n"
+)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    PERSONPAGE_CONFIG={"calendar_cache_enabled": True},
+)
+class CalendarFeedTest(TestCase):
+    def test_filter_past_events(self):
+        import datetime
+        from .calendars import filter_past_events
+
+        data = filter_past_events(CALENDAR_DATA, datetime.date(2020, 1, 1))
+        self.assertNotIn(b"SUMMARY:Old", data)
+        self.assertIn(b"SUMMARY:New", data)
+        self.assertTrue(data.startswith(b"BEGIN:VCALENDAR\r\n"))
+        self.assertTrue(data.endswith(b"END:VCALENDAR\r\n"))
+
+    def test_cached_until_invalidated(self):
+        from django.http import HttpResponse
+        from . import calendars
+
+        response = HttpResponse(CALENDAR_DATA, content_type="text/calendar")
+        feed = calendars.store_feed("calendar-person", response)
+        self.assertEqual(calendars.get_cached_feed("calendar-person"), feed)
+        response = calendars.feed_response(feed)
+        self.assertEqual(response["ETag"], feed["etag"])
+        self.assertEqual(response["Content-Type"], "text/calendar")
+        calendars.invalidate("calendar-person")
+        self.assertIsNone(calendars.get_cached_feed("calendar-person"))
+        calendars.store_feed("calendar-person", response)
+        calendars.invalidate()
+        self.assertIsNone(calendars.get_cached_feed("calendar-person"))
+
+    def test_slug_change_drops_old_feed(self):
+        from django.http import HttpResponse
+        from . import calendars
+
+        page = create_person_page("old-calendar-slug")
+        calendars.store_feed("old-calendar-slug", HttpResponse(CALENDAR_DATA))
+        person = page.person
+        person.slug = "new-calendar-slug"
+        person.save()
+        self.assertIsNone(calendars.get_cached_feed("old-calendar-slug"))
+
+
+@override_settings(
+    ROOT_URLCONF="person_pages.urls",
+    PERSONPAGE_CONFIG={"pagefile_download": "stream", "search_index_queue": True},
+)
+class PageFileDownloadTest(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+
+        from django.core.files.base import ContentFile
+
+        from .models import PageFile
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = self.settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        page = create_person_page("download-page")
+        self.pagefile = PageFile(page=page, slug="notes")
+        self.pagefile.the_file.save("notes.txt", ContentFile(b"0123456789"))
+
+    def test_range_and_validators(self):
+        url = self.pagefile.get_absolute_url()
+        self.assertEqual(url, "/download-page/files/notes")
+        response = self.client.get(url)
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+        etag = response["ETag"]
+
+        response = self.client.get(url, HTTP_RANGE="bytes=2-4")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 2-4/10")
+        self.assertEqual(b"".join(response.streaming_content), b"234")
+
+        response = self.client.get(url, HTTP_RANGE="bytes=20-")
+        self.assertEqual(response.status_code, 416)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_sendfile_without_paths(self):
+        from unittest import mock
+
+        url = self.pagefile.get_absolute_url()
+        storage = self.pagefile.the_file.storage
+        with self.settings(PERSONPAGE_CONFIG={"pagefile_download": "x-sendfile"}):
+            response = self.client.get(url)
+            self.assertTrue(response.has_header("X-Sendfile"))
+            with mock.patch.object(
+                type(storage), "path", side_effect=NotImplementedError
+            ):
+                response = self.client.get(url)
+        self.assertFalse(response.has_header("X-Sendfile"))
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+
+
+@override_settings(PERSONPAGE_CONFIG={"upload_storage_mode": "content"})
+class ContentStorageTest(TestCase):
+    def test_identical_uploads_stored_once(self):
+        import shutil
+        import tempfile
+
+        from django.core.files.base import ContentFile
+
+        from .models import PageFile, StoredContent
+        from .storage import content_hash
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with self.settings(MEDIA_ROOT=media_root):
+            pagefile_list = []
+            for slug in ["first-syllabus", "second-syllabus"]:
+                pagefile = PageFile(page=create_person_page(slug), slug="syllabus")
+                pagefile.the_file.save("Syllabus.PDF", ContentFile(b"%PDF syllabus"))
+                pagefile_list.append(pagefile)
+            name = pagefile_list[0].the_file.name
+            self.assertEqual(name, pagefile_list[1].the_file.name)
+            self.assertIsNotNone(content_hash(name))
+            self.assertTrue(name.endswith(".pdf"))
+            self.assertEqual(
+                list(StoredContent.objects.values_list("name", flat=True)), [name]
+            )
+
+            storage = pagefile_list[0].the_file.storage
+            pagefile_list[0].delete()
+            storage.delete(name)
+            self.assertTrue(storage.exists(name))
+            pagefile_list[1].delete()
+            storage.delete(name)
+            self.assertFalse(storage.exists(name))
+            self.assertFalse(StoredContent.objects.filter(name=name).exists())
+
+
+def formset_post_data(formset):
+    """
+    The POST data for submitting ``formset`` unchanged.
+    """
+    from django import forms
+
+    data = {}
+    management_form = formset.management_form
+    for name in management_form.fields:
+        data[management_form.add_prefix(name)] = management_form.initial[name]
+    for form in formset.forms:
+        for name, field in form.fields.items():
+            value = form.initial.get(name, field.initial)
+            if isinstance(field, forms.BooleanField):
+                if value:
+                    data[form.add_prefix(name)] = "on"
+            elif isinstance(field, forms.FileField) or value is None:
+                continue
+            else:
+                data[form.add_prefix(name)] = value
+    return data
+
+
+@override_settings(ROOT_URLCONF="person_pages.urls")
+class PageUpdateQueryTest(TestCase):
+    def post_update(self, page):
+        from django.contrib.auth.models import User
+        from django.db import connection
+        from django.test import RequestFactory
+        from django.test.utils import CaptureQueriesContext
+
+        from .views import PersonPageUpdateView
+
+        user = User.objects.create_superuser(
+            "editor-{}".format(page.pk), "editor@example.com", "password"
+        )
+        self.client.force_login(user)
+        view = PersonPageUpdateView()
+        view.request = RequestFactory().get("/")
+        view.object = page
+        data = {}
+        for formset in view.get_formset_list():
+            data.update(formset_post_data(formset))
+        # edit one section, and swap the order of two others.
+        data["sections-0-title"] = "Changed title"
+        data["sections-1-ordering"], data["sections-2-ordering"] = (
+            data["sections-2-ordering"],
+            data["sections-1-ordering"],
+        )
+        url = "/{}/update".format(page.person.slug)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        return len(queries)
+
+    def test_queries_do_not_depend_on_sections(self):
+        from .models import PageSection, PersonPage
+
+        small = self.post_update(create_person_page("few-sections", sections=3))
+        page = create_person_page("many-sections", sections=30)
+        modified = PersonPage.objects.get(pk=page.pk).modified
+        large = self.post_update(page)
+        self.assertEqual(large, small)
+        self.assertLess(large, 30)
+        section_list = list(page.pagesection_set.order_by("pk"))
+        self.assertEqual(section_list[0].title, "Changed title")
+        self.assertEqual([s.ordering for s in section_list[1:3]], [2, 1])
+        self.assertEqual(PageSection.objects.filter(page=page).count(), 30)
+        self.assertGreater(PersonPage.objects.get(pk=page.pk).modified, modified)
+
+
+class SuppressAutocreateTest(TestCase):
+    def test_guard(self):
+        from .handlers import RAW_SAVE_ATTR, disable_for_loaddata, suppress_autocreate
+
+        calls = []
+        handler = disable_for_loaddata(lambda **kwargs: calls.append(kwargs))
+
+        class Instance(object):
+            pass
+
+        instance = Instance()
+        handler(instance=instance)
+        with suppress_autocreate():
+            handler(instance=instance)
+        handler(instance=instance, raw=True)
+        setattr(instance, RAW_SAVE_ATTR, True)
+        handler(instance=instance)
+        self.assertEqual(len(calls), 1)
+
+    def test_decorator_in_threads(self):
+        import threading
+
+        from .handlers import autocreate_suppressed, suppress_autocreate
+
+        entered = threading.Barrier(2)
+        errors = []
+
+        @suppress_autocreate()
+        def work():
+            entered.wait()
+            if not autocreate_suppressed():
+                errors.append("not suppressed")
+
+        def run():
+            try:
+                work()
+            except Exception as e:
+                errors.append(e)
+
+        thread_list = [threading.Thread(target=run) for i in range(2)]
+        for thread in thread_list:
+            thread.start()
+        for thread in thread_list:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertFalse(autocreate_suppressed())
+
+
+class SyncFromPeopleTest(TestCase):
+    def test_sync(self):
+        from people.models import Person
+
+        from .handlers import suppress_autocreate
+        from .models import PersonPage
+
+        with suppress_autocreate():
+            for i in range(5):
+                person = Person.objects.create(
+                    cn="Student {}".format(i), slug="s-{}".format(i)
+                )
+                person.add_flag_by_name("directory")
+        counts = PersonPage.objects.sync_from_people()
+        self.assertEqual(counts, {"missing": 5, "created": 5, "deactivated": 0})
+        self.assertEqual(PersonPage.objects.active().count(), 5)
+
+        modified = PersonPage.objects.get(person__slug="s-0").modified
+        Person.objects.filter(slug="s-0").update(active=False)
+        counts = PersonPage.objects.sync_from_people(deactivate=True)
+        self.assertEqual(counts, {"missing": 0, "created": 0, "deactivated": 1})
+        # the content did not change.
+        self.assertEqual(PersonPage.objects.get(person__slug="s-0").modified, modified)
+
+    def test_sync_adds_flag(self):
+        from people.models import Person
+
+        from .handlers import suppress_autocreate
+        from .models import PersonPage
+
+        with suppress_autocreate():
+            Person.objects.create(cn="Listed", slug="listed").add_flag_by_name(
+                "directory"
+            )
+            Person.objects.create(cn="Unlisted", slug="unlisted")
+        counts = PersonPage.objects.sync_from_people(require_flag=False)
+        self.assertEqual(counts, {"missing": 2, "created": 2, "deactivated": 0})
+        self.assertEqual(PersonPage.objects.active().count(), 2)
+
+        flag_model = Person._meta.get_field("flags").remote_field.model
+        flag_model.objects.filter(slug="directory").delete()
+        with self.assertRaises(ValueError):
+            PersonPage.objects.sync_from_people(require_flag=False)
+
+
+def _job_calls(calls, value):
+    calls.append(value)
+    if value is None:
+        raise ValueError("no value")
+    return value * 2
+
+
+@override_settings(PERSONPAGE_CONFIG={"jobs_backend": "inprocess"})
+class JobsTest(TestCase):
+    def test_result_is_reused(self):
+        from . import jobs
+
+        calls = []
+        key = jobs.job_key("test", "reused")
+        job = jobs.submit(key, _job_calls, calls, 21)
+        self.assertTrue(job.done)
+        self.assertEqual(job.result, 42)
+        job = jobs.submit(key, _job_calls, calls, 21)
+        self.assertEqual(job.result, 42)
+        self.assertEqual(calls, [21])
+
+    def test_failure(self):
+        from . import jobs
+
+        job = jobs.submit(jobs.job_key("test", "failure"), _job_calls, [], None)
+        self.assertEqual(job.status, jobs.FAILED)
+        self.assertIn("no value", job.error)
+
+    def test_timeout(self):
+        from . import jobs
+
+        key = jobs.job_key("test", "timeout")
+        jobs.Job(key, created=0, timeout=1).save()
+        self.assertEqual(jobs.get_job(key).status, jobs.TIMEOUT)
+
+
+@override_settings(
+    ROOT_URLCONF="person_pages.urls", PERSONPAGE_CONFIG={"jobs_backend": "inprocess"}
+)
+class MugshotTest(TestCase):
+    def test_job_status_permission(self):
+        from django.contrib.auth.models import User
+        from django.test import RequestFactory
+
+        from . import jobs, mugshot
+
+        page = create_person_page("job-page")
+        key = jobs.job_key("test", "job-status")
+        jobs.submit(key, _job_calls, [], 1, info={"page_id": page.pk})
+        request = RequestFactory().get("/")
+        request.user = User.objects.create_user("other")
+        self.assertEqual(mugshot.job_status(request, key).status_code, 403)
+        request.user = User.objects.create_superuser("admin", "", "password")
+        response = mugshot.job_status(request, key)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'"done"', response.content)
+
+    def test_detection_is_stored(self):
+        import shutil
+        import tempfile
+        import types
+        from io import BytesIO
+        from unittest import mock
+
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from PIL import Image
+
+        from . import mugshot
+        from .models import PageInfo
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        buf = BytesIO()
+        Image.new("RGB", (100, 100)).save(buf, format="PNG")
+        info = create_person_page("detection-page").pageinfo
+        cv2 = types.SimpleNamespace(__version__="test")
+        with self.settings(
+            MEDIA_ROOT=media_root, PERSONPAGE_CONFIG={"mugshot_detector": "opencv"}
+        ), mock.patch.object(mugshot, "cv2", cv2), mock.patch.object(
+            mugshot, "_detect_box", return_value=([10, 10, 20, 20], 1.0)
+        ) as detect:
+            info.photo = SimpleUploadedFile("photo.png", buf.getvalue())
+            info.save()
+            self.assertEqual(len(info.photo_hash), 40)
+            detection = mugshot.get_detection(info)
+            self.assertEqual(detection["box"], [10, 10, 20, 20])
+
+            # the stored detection is used, without reading the photo.
+            info = PageInfo.objects.get(pk=info.pk)
+            with mock.patch.object(mugshot, "read_photo") as read_photo:
+                self.assertEqual(mugshot.get_detection(info), detection)
+            read_photo.assert_not_called()
+            self.assertEqual(detect.call_count, 1)
+
+            buf = BytesIO()
+            Image.new("RGB", (100, 100), "white").save(buf, format="PNG")
+            info.photo = SimpleUploadedFile("photo.png", buf.getvalue())
+            info.save()
+            mugshot.get_detection(info)
+            self.assertEqual(detect.call_count, 2)
+
+    def create_entries(self, slug, count):
+        page = create_person_page(slug)
+        if not hasattr(page.person, "directoryentry_set"):
+            self.skipTest("The directory application is not installed.")
+        for i in range(count):
+            page.person.directoryentry_set.create()
+        return list(page.person.directoryentry_set.all())
+
+    def test_set_mugshots(self):
+        import shutil
+        import tempfile
+        from unittest import mock
+
+        from . import mugshot
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        entry_list = self.create_entries("mugshot-page", 3)
+        model = entry_list[0].__class__
+        storage = model._meta.get_field("mugshot").storage
+        with self.settings(MEDIA_ROOT=media_root), mock.patch.object(
+            storage, "save", wraps=storage.save
+        ) as save:
+            mugshot.set_mugshots(entry_list, "mugshot-page.png", b"image")
+            self.assertEqual(save.call_count, 1)
+            name_list = model._base_manager.filter(
+                pk__in=[e.pk for e in entry_list]
+            ).values_list("mugshot", flat=True)
+            self.assertEqual(set(name_list), {entry_list[0].mugshot})
+            self.assertTrue(storage.exists(entry_list[0].mugshot))
+
+    def test_set_mugshots_failure(self):
+        import shutil
+        import tempfile
+        from unittest import mock
+
+        from django.db import DatabaseError
+        from django.db.models import QuerySet
+
+        from . import mugshot
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        entry_list = self.create_entries("failed-mugshot-page", 2)
+        storage = entry_list[0].__class__._meta.get_field("mugshot").storage
+        with self.settings(MEDIA_ROOT=media_root), mock.patch.object(
+            storage, "delete", wraps=storage.delete
+        ) as delete, mock.patch.object(
+            QuerySet, "update", side_effect=DatabaseError("failed")
+        ):
+            with self.assertRaises(DatabaseError):
+                mugshot.set_mugshots(entry_list, "failed-mugshot-page.png", b"image")
+            self.assertEqual(delete.call_count, 1)
+            self.assertFalse(storage.exists(delete.call_args[0][0]))
+
+
+class PhotoVariantsTest(TestCase):
+    def test_variants_made_on_upload(self):
+        import shutil
+        import tempfile
+        from io import BytesIO
+
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from PIL import Image
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        buf = BytesIO()
+        Image.new("RGB", (1000, 500)).save(buf, format="PNG")
+        page = create_person_page("photo-page")
+        info = page.pageinfo
+        with self.settings(MEDIA_ROOT=media_root):
+            info.photo = SimpleUploadedFile("photo.png", buf.getvalue())
+            info.save()
+            self.assertEqual((info.photo_width, info.photo_height), (1000, 500))
+            variants = info.get_photo_variants()["variants"]
+            self.assertEqual([width for width, name in variants], [200, 400, 800])
+            display = info.photo_display
+        self.assertEqual((display["width"], display["height"]), (400, 200))
+        self.assertIn("-400w.png", display["url"])
+        self.assertEqual(display["srcset"].count("w,"), 2)
+
+    def test_variants_released_on_delete(self):
+        import shutil
+        import tempfile
+        from io import BytesIO
+        from unittest import mock
+
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from PIL import Image
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        buf = BytesIO()
+        Image.new("RGB", (1000, 500)).save(buf, format="PNG")
+        info = create_person_page("deleted-photo-page").pageinfo
+        with self.settings(MEDIA_ROOT=media_root), mock.patch(
+            "django.db.transaction.on_commit", side_effect=lambda func: func()
+        ):
+            info.photo = SimpleUploadedFile("photo.png", buf.getvalue())
+            info.save()
+            storage = info.photo.storage
+            name_list = [name for width, name in info.get_photo_variants()["variants"]]
+            self.assertTrue(name_list)
+            info.delete()
+            self.assertFalse(any(storage.exists(name) for name in name_list))
+
+    def test_missing_photo(self):
+        from .models import PageInfo
+
+        info = create_person_page("missing-photo-page").pageinfo
+        PageInfo.objects.filter(pk=info.pk).update(photo="personal/missing.png")
+        # loading does not read the photo.
+        info = PageInfo.objects.get(pk=info.pk)
+        self.assertIsNone(info.photo_width)
+        info.refresh_photo_dimensions(force=True)
+        self.assertEqual((info.photo_width, info.photo_height), (None, None))
+        self.assertIsNone(info.photo_display["width"])
+
+
+@override_settings(PERSONPAGE_CONFIG={"search_index_queue": True})
+class IndexQueueTest(TestCase):
+    def test_changes_queue_page_once(self):
+        from .models import PageIndexQueue
+
+        page = create_person_page("queued-page", sections=3)
+        section = page.pagesection_set.all()[0]
+        section.content = "Changed."
+        section.save()
+        self.assertEqual(
+            list(PageIndexQueue.objects.values_list("page_id", flat=True)), [page.pk]
+        )
+        self.assertEqual(PageIndexQueue.objects.settled(delay=60).count(), 0)
+
+    def test_flag_change_queues_page(self):
+        from .models import PageIndexQueue
+
+        page = create_person_page("unlisted-queued-page")
+        PageIndexQueue.objects.all().delete()
+        page.person.flags.clear()
+        self.assertEqual(
+            list(PageIndexQueue.objects.values_list("page_id", flat=True)), [page.pk]
+        )
+
+
+class SearchIndexBuildTest(TestCase):
+    def count_index_queries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        from .models import PersonPage
+
+        with CaptureQueriesContext(connection) as queries:
+            for page in PersonPage.objects.active().for_index():
+                page.person.cn
+                page.pageinfo.introduction
+                [s.content for s in page.get_active_sections()]
+                [str(entry) for entry in page.get_research_list()]
+        return len(queries)
+
+    def test_for_index_query_count(self):
+        for i in range(2):
+            create_person_page("indexed-{}".format(i), sections=2)
+        small = self.count_index_queries()
+        for i in range(2, 8):
+            create_person_page("indexed-{}".format(i), sections=3)
+        self.assertEqual(self.count_index_queries(), small)
+
+    def test_chunked_build(self):
+        import operator
+        from unittest import mock
+
+        from haystack import connections
+
+        from . import search_indexes
+        from .models import PersonPage
+
+        for i in range(5):
+            create_person_page("built-{}".format(i), sections=1)
+        index = connections["default"].get_unified_index().get_index(PersonPage)
+        backend_class = type(connections["default"].get_backend())
+        with mock.patch.object(backend_class, "update", autospec=True) as update:
+            count = search_indexes.build_index(chunk_size=2, using="default")
+        self.assertEqual(count, 5)
+        self.assertEqual(update.call_count, 3)
+        chunked = [
+            index.full_prepare(page)
+            for call in update.call_args_list
+            for page in call[0][2]
+        ]
+        serial = [index.full_prepare(page) for page in index.index_queryset()]
+        key = operator.itemgetter("id")
+        self.assertEqual(sorted(chunked, key=key), sorted(serial, key=key))
+
+
+@override_settings(
+    PERSONPAGE_CONFIG={"search_enabled": True, "search_engine": "inverted"}
+)
+class FullTextSearchTest(TestCase):
+    def test_tokenize(self):
+        from .fulltext import tokenize
+
+        self.assertEqual(
+            tokenize("Office hours: Mon. & Wed., 10-11 (or by appt.)"),
+            ["office", "hours", "mon", "wed", "10", "11", "or", "by", "appt"],
+        )
+
+    def test_ranking(self):
+        from . import fulltext
+
+        first = create_person_page("first-searched", cn="Ada Lovelace")
+        second = create_person_page("second-searched", cn="Charles Babbage")
+        section = first.pagesection_set.create(
+            title="Research", content="Analytical engines and analytical notes."
+        )
+        second.pagesection_set.create(title="Research", content="Difference engines.")
+
+        result_list = fulltext.search("analytical engines")
+        self.assertEqual([r.object for r in result_list], [first, second])
+
+        section.delete()
+        result_list = fulltext.search("analytical")
+        self.assertEqual(result_list, [])
+
+        second.active = False
+        second.save()
+        self.assertEqual(fulltext.search("difference"), [])
+
+    def test_unlisted_not_found(self):
+        from . import fulltext
+        from .models import SearchDocument
+
+        page = create_person_page("unlisted-searched", cn="Grace Hopper")
+        self.assertEqual([r.object for r in fulltext.search("hopper")], [page])
+        page.person.flags.clear()
+        self.assertFalse(SearchDocument.objects.filter(page=page).exists())
+        self.assertEqual(fulltext.search("hopper"), [])
@@ -4,23 +4,49 @@ PersonPage URLS
 (r'^people/', include('person_pages.urls')),
 
 """
+
 from django.conf.urls import url
 
+from . import api
+from .downloads import pagefile_download
 from .models import PersonPage
 from .views import (
     PersonPageDetailView,
     PersonPageListView,
     person_calendar,
+    person_page_search,
     personpage_update,
 )
 
 urlpatterns = [
     url(r"^$", PersonPageListView.as_view(), name="person-page-list"),
+    url(r"^search/$", person_page_search, name="person-page-search"),
+    url(r"^api/pages/$", api.page_list, name="person-page-api-list"),
+    url(
+        r"^api/pages/(?P<slug>[\w-]+)/$",
+        api.page_detail,
+        name="person-page-api-detail",
+    ),
+    url(
+        r"^api/pages/(?P<slug>[\w-]+)/sections/$",
+        api.section_list,
+        name="person-page-api-sections",
+    ),
+    url(
+        r"^api/pages/(?P<slug>[\w-]+)/files/$",
+        api.file_list,
+        name="person-page-api-files",
+    ),
     url(
         r"(?P<slug>[\w-]+)/$", PersonPageDetailView.as_view(), name="person-page-detail"
     ),
     url(r"(?P<slug>[\w-]+)/update$", personpage_update, name="person-page-update"),
     url(r"(?P<slug>[\w-]+)/calendar$", person_calendar, name="person-page-calendar"),
+    url(
+        r"(?P<slug>[\w-]+)/files/(?P<file_slug>[\w-]+)$",
+        pagefile_download,
+        name="person-page-file",
+    ),
 ]
 
 
@@ -48,4 +74,9 @@ else:
             mugshot.save,
             name="person-page-mugshot-save",
         ),
+        url(
+            r"^mugshot-jobs/(?P<key>[0-9a-f]+)$",
+            mugshot.job_status,
+            name="person-page-mugshot-job",
+        ),
     ]
@@ -2,17 +2,27 @@
 PersonPage views extend class-based generic views.
 """
 
+import datetime
+import hashlib
+import time
+
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
 from django.http import Http404, HttpResponseForbidden, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render
 from django.template import TemplateDoesNotExist
-from django.utils.decorators import method_decorator
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from django.views.decorators.http import condition
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import UpdateView
 from django.views.generic.list import ListView
 from webcal.views import icalendar_feed
 
+from . import calendars, conf, pagecache
 from .forms import (
     PersonPageForm,
     get_pagefile_formset_class,
@@ -20,14 +30,13 @@ from .forms import (
     get_pagesection_formset_class,
 )
 from .models import PersonPage
+from .pagination import InvalidCursor, KeysetPaginator
 
 ######################################################################
 
 
 class PersonPageMixin(object):
-    queryset = PersonPage.objects.active().filter(
-        person__active=True, person__slug__isnull=False, person__flags__slug="directory"
-    )
+    queryset = PersonPage.objects.active()
 
     def get_object(self):
         slug = self.kwargs["slug"]
@@ -40,23 +49,218 @@ class PersonPageMixin(object):
 ######################################################################
 
 
-class PersonPageListView(PersonPageMixin, ListView):
+class CachedResponseMixin(object):
+    """
+    Serve (and store) complete responses from the page cache, for
+    anonymous GET requests when the page cache is enabled.
+    Authenticated users always bypass the cache.
+    """
+
+    cache_timeout = None
+
+    def get_cache_slug(self):
+        """
+        The slug whose version keys the response (None for the list).
+        """
+        return pagecache.LIST_SLUG
+
+    def use_page_cache(self, request):
+        if not pagecache.is_enabled():
+            return False
+        if request.method not in ("GET", "HEAD"):
+            return False
+        return not request.user.is_authenticated
+
+    def get_response(self, request, *args, **kwargs):
+        """
+        The response when it is not served from the cache.
+        """
+        return super(CachedResponseMixin, self).dispatch(request, *args, **kwargs)
+
+    def dispatch(self, request, *args, **kwargs):
+        if not self.use_page_cache(request):
+            return self.get_response(request, *args, **kwargs)
+        cache = pagecache.get_cache()
+        key = pagecache.response_key(request, self.get_cache_slug())
+        response = cache.get(key)
+        if response is not None:
+            # the validators were stored with the response.
+            return get_conditional_response(
+                request,
+                etag=response.get("ETag"),
+                last_modified=parse_http_date_safe(response.get("Last-Modified")),
+                response=response,
+            )
+        response = self.get_response(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            if hasattr(response, "render"):
+                response.render()
+            cache.set(key, response, self.cache_timeout)
+        return response
+
+
+######################################################################
+
+
+class PersonPageListView(CachedResponseMixin, PersonPageMixin, ListView):
     """
-    Does a list of jobs, and a list of additional resources.
+    A list of personal pages.
+    When ``paginate_by`` is set, the list is keyset paginated: the
+    ``after`` query parameter is the cursor for the next page.
     """
 
     context_object_name = "page_list"
+    cache_timeout = conf.get("page_cache_list_timeout")
+    paginate_by = conf.get("list_paginate_by")
+    keyset_ordering = conf.get("list_ordering")
+    cursor_kwarg = "after"
+    # The list needs only the page and its person.
+    only_fields = ["id", "active", "person"]
+
+    def get_ordering(self):
+        # keyset pagination requires a total ordering.
+        if self.get_paginate_by(None):
+            return self.keyset_ordering
+        return super(PersonPageListView, self).get_ordering()
+
+    def get_queryset(self):
+        qs = super(PersonPageListView, self).get_queryset()
+        return qs.for_list(self.only_fields)
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, self.get_ordering(), page_size)
+        cursor = self.request.GET.get(self.cursor_kwarg) or None
+        try:
+            page = paginator.page(cursor)
+        except InvalidCursor:
+            raise Http404("Invalid page")
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+
+######################################################################
+
+
+def _call_related(obj, relation_name, method_name):
+    """
+    Evaluate ``obj.<relation_name>.<method_name>`` as a template would
+    (calling it if it is callable); or return None when the relation or
+    method does not exist.
+    """
+    manager = getattr(obj, relation_name, None)
+    value = getattr(manager, method_name, None)
+    if callable(value):
+        value = value()
+    return value
+
+
+def _validator_epoch():
+    """
+    The start of the current ``page_validator_lifetime`` period (a
+    timestamp): the validators change at least this often.
+    """
+    lifetime = conf.get("page_validator_lifetime")
+    return int(time.time() // lifetime) * lifetime
+
+
+def get_page_validators(request, slug):
+    """
+    Return the ``(etag, last_modified)`` validators for the page with the
+    given slug, from a single aggregate query over the page, its content,
+    its person and the person relations shown on the page (the counts
+    and maximum ids catch deleted and added rows).  Both change at least
+    every ``page_validator_lifetime`` seconds, for changes which advance
+    no modification time (e.g., to a directory entry's office).  The
+    result is memoized on the request.
+    """
+    memo = getattr(request, "_person_page_validators", None)
+    if memo is not None and memo[0] == slug:
+        return memo[1]
+    row_list = list(
+        PersonPage.objects.active().filter(person__slug=slug).validator_values()
+    )
+    if not row_list:
+        validators = (None, None)
+    else:
+        row = row_list[0]
+        epoch = _validator_epoch()
+        user = request.user
+        # content differs for editors, so the etag is per user.
+        viewer = user.pk if user.is_authenticated else ""
+        data = repr(sorted(row.items())) + repr((viewer, epoch))
+        etag = hashlib.md5(data.encode("utf-8")).hexdigest()
+        if settings.USE_TZ:
+            start = datetime.datetime.fromtimestamp(epoch, timezone.utc)
+        else:
+            start = datetime.datetime.fromtimestamp(epoch)
+        times = [v for v in row.values() if isinstance(v, datetime.datetime)]
+        validators = (etag, max(times + [start]))
+    request._person_page_validators = (slug, validators)
+    return validators
+
+
+def page_etag(request, slug, **kwargs):
+    return get_page_validators(request, slug)[0]
+
+
+def page_last_modified(request, slug, **kwargs):
+    return get_page_validators(request, slug)[1]
 
 
 ######################################################################
 
 
-class PersonPageDetailView(PersonPageMixin, DetailView):
+class PersonPageDetailView(CachedResponseMixin, PersonPageMixin, DetailView):
     """
     A view showing details for a particular PersonPage.
+    The page graph is prefetched (see ``PersonPageQuerySet.for_detail()``)
+    and everything the template shows is passed as evaluated lists,
+    so the number of queries does not depend on the page content.
     """
 
     context_object_name = "page"
+    cache_timeout = conf.get("page_cache_detail_timeout")
+
+    def get_cache_slug(self):
+        return self.kwargs["slug"]
+
+    def get_response(self, request, *args, **kwargs):
+        # Conditional requests are checked after the response cache, so
+        # cached responses (which keep their ETag) cost no queries.
+        get_response = super(PersonPageDetailView, self).get_response
+        return condition(etag_func=page_etag, last_modified_func=page_last_modified)(
+            get_response
+        )(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return super(PersonPageDetailView, self).get_queryset().for_detail()
+
+    def get_page_context(self, page):
+        """
+        The evaluated lists for the detail template.
+        """
+        person = page.person
+        publication_list = _call_related(person, "publication_set", "recent")
+        publication_active = _call_related(person, "publication_set", "active")
+        default_entries = _call_related(person, "directoryentry_set", "default_list")
+        return {
+            "section_list": page.get_active_sections(),
+            "pagefile_list": page.public_files,
+            "directoryentry_list": getattr(person, "directoryentry_list", []),
+            "active_directoryentry_list": getattr(
+                person, "active_directoryentry_list", []
+            ),
+            "default_directoryentry_list": list(default_entries or []),
+            "research_list": page.get_research_list(),
+            "publication_list": list(publication_list or []),
+            "publication_count": (
+                publication_active.count() if publication_active is not None else 0
+            ),
+        }
+
+    def get_context_data(self, **kwargs):
+        context = super(PersonPageDetailView, self).get_context_data(**kwargs)
+        context.update(self.get_page_context(self.object))
+        return context
 
 
 ######################################################################
@@ -157,9 +361,10 @@ class PersonPageUpdateView(PersonPageMixin, UpdateView):
         """
         If the form is valid, save the associated model.
         """
-        result = super(PersonPageUpdateView, self).form_valid(form)
-        for formset in formset_list:
-            formset.save()
+        with transaction.atomic():
+            result = super(PersonPageUpdateView, self).form_valid(form)
+            for formset in formset_list:
+                formset.save()
         return result
 
     def form_invalid(self, form, formset_list):
@@ -190,12 +395,47 @@ personpage_update = login_required(PersonPageUpdateView.as_view())
 ######################################################################
 
 
+def person_page_search(request, template_name="person_pages/personpage_search.html"):
+    """
+    Search the person pages with the built-in full text search.
+    """
+    from . import fulltext
+
+    query = request.GET.get("q", "").strip()
+    result_list = []
+    if query:
+        result_list = fulltext.search(query, limit=conf.get("search_results_limit"))
+    context = {"query": query, "result_list": result_list}
+    return render(request, template_name, context)
+
+
+######################################################################
+
+
 def person_calendar(request, slug):
     """
     Provide a calendar feed for this person.
+    Feeds are cached (see ``calendars``), so polls are answered without
+    generating the feed, and with 304 Not Modified when unchanged.
     """
-    page = get_object_or_404(PersonPage, active=True, person__slug=slug)
-    return icalendar_feed(request, page.person)
+    feed = calendars.get_cached_feed(slug)
+    if feed is None:
+        page = get_object_or_404(
+            PersonPage.objects.select_related("person"),
+            active=True,
+            person__slug=slug,
+        )
+        response = icalendar_feed(request, page.person)
+        if response.status_code != 200 or response.streaming:
+            return response
+        feed = calendars.store_feed(slug, response)
+    response = calendars.feed_response(feed)
+    return get_conditional_response(
+        request,
+        etag=feed["etag"],
+        last_modified=feed["last_modified"],
+        response=response,
+    )
 
 
 #